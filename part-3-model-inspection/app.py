@@ -1,6 +1,9 @@
+import pandas as pd
 import streamlit as st
 
-from pages import data_exploration, model_testing, model_inspection
+import resilience
+import memory_governor
+from pages import data_exploration, data_drift, model_testing, model_inspection
 
 st.set_page_config(
     page_title="Model Inspection App",
@@ -15,13 +18,33 @@ Welcome to this Exploratory Data Analysis and Model Testing app.
 
 PAGE_MAP = {
     "Data Exploration": data_exploration,
+    "Data Drift": data_drift,
     "Model Testing": model_testing,
     "Model Inspection": model_inspection
 }
 
 st.sidebar.header("Page Navigation")
 current_page = st.sidebar.radio("Go To", list(PAGE_MAP), key='sidebar')
-PAGE_MAP[current_page].write()
+# remote calls made while rendering the page share a latency budget, see resilience.deadline()
+with resilience.deadline():
+    try:
+        PAGE_MAP[current_page].write()
+    except resilience.DeadlineExceeded as e:  # e.g. while waiting for a call started by another session
+        st.error(str(e))
+
+with st.sidebar.expander("Diagnostics"):
+    timeouts = resilience.timeout_counts()
+    if timeouts:
+        st.write("Remote calls which timed out since the app started:")
+        st.table(pd.DataFrame(timeouts.items(), columns=["Host", "Timeouts"]))
+    else:
+        st.write("No remote call timed out since the app started.")
+    footprint = memory_governor.GOVERNOR.footprint()
+    resident = sum(r for r, _ in footprint.values()) / 2**20
+    spilled = sum(s for _, s in footprint.values()) / 2**20
+    n_sessions = len([session_id for session_id in footprint if session_id is not None])
+    st.write(f"Session data: {resident:.0f} MB in memory and {spilled:.0f} MB spilled to disk across "
+             f"{n_sessions} sessions, for a limit of {memory_governor.SESSION_MEMORY_MAX_MB:.0f} MB.")
 
 st.sidebar.markdown("""
 ## About
@@ -0,0 +1,460 @@
+import os
+import abc
+import time
+import pickle
+import hashlib
+import functools
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+import resilience
+
+# Identifies the content of a DataFrame in O(1) once computed:
+# - asset_id and revision are set when the data was loaded from a data asset, and digest then describes
+#   which part of the asset was loaded (e.g. selected columns), empty for the whole asset
+# - otherwise asset_id and revision are None and digest is a hash of a sample of the content
+DatasetFingerprint = namedtuple('DatasetFingerprint', ['asset_id', 'revision', 'digest'])
+
+
+def _pickled_size(value):
+    """Approximate in-memory footprint of an arbitrary object, used to bound cache sizes."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class LRUCache:
+    """A thread-safe, size-bounded Least Recently Used cache.
+    Unlike st.cache, it is keyed by explicit, cheap keys chosen by the caller (e.g. dataset and column
+    names), and it is shared by all sessions of the app.
+
+    Args:
+        max_entries (int): Maximum number of entries kept.
+        max_bytes (int): Maximum total size of the entries kept, as measured by sizeof. Defaults to None, i.e. no limit.
+        sizeof (callable): Function returning the size of a value in bytes. Defaults to the size of its pickle.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, sizeof=_pickled_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # {key: (value, size)}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def set(self, key, value):
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries \
+                    or (self.max_bytes is not None and self._total_bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def get_or_compute(self, key, compute_fn):
+        """Returns the value cached under key, calling compute_fn() and caching its result on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute_fn()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+# rendered figures (plotly figures, or PNG bytes for matplotlib figures), shared by all sessions
+FIGURE_CACHE = LRUCache(
+    max_entries=int(os.environ.get("FIGURE_CACHE_MAX_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("FIGURE_CACHE_MAX_MB", 256)) * 2**20
+)
+
+
+def cached_figure(key, build_fn):
+    """Returns the figure cached under key, building it with build_fn() on a miss.
+    Keys must identify everything the figure depends on, e.g. (dataset, feature, label, plot type),
+    so that reruns triggered by unrelated widgets do not pay for rendering the figure again.
+
+    Args:
+        key (tuple): Hashable key identifying the figure.
+        build_fn (callable): Function without arguments returning the figure.
+    Returns:
+        fig: The cached or newly built figure.
+    """
+    return FIGURE_CACHE.get_or_compute(key, build_fn)
+
+
+def fingerprint_dataframe(df, n_blocks=32, block_rows=32):
+    """Computes a content fingerprint of a DataFrame from its shape, columns, dtypes and a few blocks of rows
+    spread evenly across the frame, so that the cost does not grow with the number of rows.
+    Two frames differing only outside of the sampled blocks get the same fingerprint, which is acceptable
+    for cache keys of derived views (filters, projections) but not for integrity checks.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to fingerprint.
+        n_blocks (int): Number of blocks of rows hashed. Defaults to 32.
+        block_rows (int): Number of consecutive rows per block. Defaults to 32.
+    Returns:
+        fingerprint (DatasetFingerprint): The fingerprint of df.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((df.shape, list(df.columns), [str(t) for t in df.dtypes])).encode())
+    if len(df) > 0:
+        starts = np.unique(np.linspace(0, max(len(df) - block_rows, 0), n_blocks).astype(int))
+        positions = np.unique(np.clip((starts[:, None] + np.arange(block_rows)).ravel(), 0, len(df) - 1))
+        h.update(pd.util.hash_pandas_object(df.iloc[positions], index=True).values.tobytes())
+    return DatasetFingerprint(None, None, h.hexdigest())
+
+
+def attach_fingerprint(df, fingerprint):
+    """Attaches a fingerprint to a DataFrame, e.g. right after loading it from a data asset.
+    Pandas copies attrs to frames derived from df, so the owner id is stored alongside to
+    recognize (and re-fingerprint) those derived frames.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to attach the fingerprint to.
+        fingerprint (DatasetFingerprint): The fingerprint identifying its content.
+    Returns:
+        df (pd.DataFrame): The same DataFrame, for convenience.
+    """
+    df.attrs['fingerprint'] = fingerprint
+    df.attrs['fingerprint_owner'] = id(df)
+    return df
+
+
+def get_fingerprint(df):
+    """Returns the fingerprint attached to a DataFrame, computing and attaching one if needed.
+    Meant to be used in cache keys, to avoid hashing whole frames on every call.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to identify.
+    Returns:
+        fingerprint (DatasetFingerprint): The fingerprint of df.
+    """
+    if df.attrs.get('fingerprint_owner') != id(df) or 'fingerprint' not in df.attrs:
+        attach_fingerprint(df, fingerprint_dataframe(df))
+    return df.attrs['fingerprint']
+
+
+def approx_size(value):
+    """Cheap estimate of the memory held by a cached value, without serializing DataFrames or arrays."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)) and any(isinstance(v, (pd.DataFrame, np.ndarray)) for v in value):
+        return sum(approx_size(v) for v in value)
+    return _pickled_size(value)
+
+
+class CacheBackend(abc.ABC):
+    """Interface of the stores behind cached(). Values are Python objects: backends storing them outside
+    of the process are responsible for serializing them. Expired entries must never be returned.
+    """
+
+    @abc.abstractmethod
+    def get(self, key):
+        """Returns the value stored under key, or None if there is none (or it expired)."""
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        """Stores value under key, for ttl seconds if provided."""
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """Removes the value stored under key, if any."""
+
+
+class MemoryBackend(CacheBackend):
+    """In-process backend, an LRUCache of (expiry, value) bounded in number of entries and bytes.
+    Values are kept as is, without any serialization."""
+
+    def __init__(self, max_entries=1024, max_bytes=512 * 2**20):
+        self._cache = LRUCache(max_entries, max_bytes, sizeof=lambda entry: approx_size(entry[1]))
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None or (entry[0] is not None and entry[0] < time.time()):
+            return None
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, (time.time() + ttl if ttl else None, value))
+
+    def delete(self, key):
+        self._cache.set(key, (0, None))  # expires immediately, and is evicted as any other entry
+
+
+class DiskBackend(CacheBackend):
+    """Local disk backend, one pickle file per entry, shared by the processes of a host (or replicas
+    mounting the same volume). The least recently written entries are removed beyond max_bytes."""
+
+    def __init__(self, directory, max_bytes=2 * 2**30):
+        self.directory, self.max_bytes = directory, max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + ".pkl")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expiry, value = pickle.load(f)
+        except Exception:  # missing, partially removed or unreadable entry
+            return None
+        if expiry is not None and expiry < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((time.time() + ttl if ttl else None, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)  # readers never see partially written entries
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = list()
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+            except OSError:
+                continue  # removed concurrently
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+                total -= size
+            except OSError:
+                pass
+
+
+class RedisBackend(CacheBackend):
+    """Backend for any server speaking the Redis protocol, shared by all replicas of the app.
+    Values are pickled, and values larger than max_value_bytes are not stored; the overall size limit
+    is the server's own maxmemory policy. Requires the optional redis package.
+    Redis errors are treated as cache misses, so that an unavailable server only makes the app slower."""
+
+    def __init__(self, url, prefix="cpd-app:", max_value_bytes=64 * 2**20):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._errors = (redis.RedisError,)
+        self.prefix, self.max_value_bytes = prefix, max_value_bytes
+
+    def get(self, key):
+        try:
+            raw = self._client.get(self.prefix + key)
+        except self._errors:
+            return None
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(raw) > self.max_value_bytes:
+            return
+        try:
+            self._client.set(self.prefix + key, raw, ex=int(ttl) if ttl else None)
+        except self._errors:
+            pass
+
+    def delete(self, key):
+        try:
+            self._client.delete(self.prefix + key)
+        except self._errors:
+            pass
+
+
+def make_backend(spec):
+    """Creates a backend from a specification string, as found in the CACHE_BACKEND environment variable:
+    "memory" (default), "disk" or "disk:/some/directory", or a "redis://host:port/db" url.
+    """
+    if not spec or spec == "memory":
+        return None  # the in-process layer of cached() is enough
+    if spec == "disk" or spec.startswith("disk:"):
+        directory = spec[len("disk:"):] or os.path.join(tempfile.gettempdir(), "cpd_cache")
+        return DiskBackend(directory)
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(spec)
+    raise ValueError(f"Unknown cache backend: {spec}")
+
+
+# every cached() function first looks in this process' memory, then in the shared backend if one is configured
+LOCAL_BACKEND = MemoryBackend(max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", 1024)),
+                              max_bytes=int(os.environ.get("CACHE_MAX_MB", 512)) * 2**20)
+SHARED_BACKEND = make_backend(os.environ.get("CACHE_BACKEND", "memory"))
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key: the first caller runs the function, and callers
+    arriving while it runs wait for its result (or exception) instead of running it again.
+    Used in front of network calls, so that many sessions asking for the same metadata or dataset at
+    the same time only trigger one request or download.
+    Waiting callers still honor the deadline of their own page render (see resilience.deadline()),
+    even if the call they joined was started by a session with more time left.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.value, self.error = None, None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()  # {key: _Call} for calls in flight
+
+    def do(self, key, fn):
+        """Returns fn(), or the result of the call of fn already in flight for key.
+
+        Raises:
+            resilience.DeadlineExceeded: If the deadline of the current thread expires while waiting for
+                the call in flight, as resilience.timeout() does for requests.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self._Call()
+
+        if not is_leader:
+            left = resilience.remaining()
+            if not call.done.wait(timeout=None if left is None else max(left, 0)):
+                resilience.record_timeout(resilience.PAGE_DEADLINE)
+                raise resilience.DeadlineExceeded("The time budget of this page was spent waiting for data "
+                                                  "requested by another session, please try again.")
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+SINGLE_FLIGHT = SingleFlight()
+
+
+def _key_part(value):
+    """Normalizes a function argument into a stable, hashable description for cache keys:
+    objects exposing a cache_key attribute (e.g. authentication headers, keyed by user identity)
+    use it, and DataFrames are described by their fingerprint."""
+    if hasattr(value, 'cache_key'):
+        return ('key', value.cache_key)
+    if isinstance(value, pd.DataFrame):
+        return ('df', tuple(get_fingerprint(value)))
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((str(k), _key_part(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_key_part(v) for v in value))
+    return value
+
+
+def make_key(name, args, kwargs):
+    description = repr((name, _key_part(args), _key_part(kwargs)))
+    return f"{name}:{hashlib.blake2b(description.encode(), digest_size=20).hexdigest()}"
+
+
+def no_error(value):
+    # functions of cpd_helpers return (..., error_msg) tuples: failed calls are not cached
+    return not (isinstance(value, tuple) and value and isinstance(value[-1], str) and value[-1] != "")
+
+
+def reattach_fingerprints(value):
+    # unpickled frames are new objects, their fingerprint must be attached again to be recognized
+    for v in (value if isinstance(value, tuple) else (value,)):
+        if isinstance(v, pd.DataFrame) and 'fingerprint' in v.attrs:
+            attach_fingerprint(v, v.attrs['fingerprint'])
+    return value
+
+
+def cached(ttl=None, local_only=False, cache_if=no_error, in_memory=True):
+    """Decorator caching the results of a function in LOCAL_BACKEND, and in SHARED_BACKEND
+    unless local_only is set (e.g. for results only meaningful on this host, such as local paths).
+    Results too large to be kept twice in memory (e.g. full datasets, which sessions already keep under the
+    memory governor) can skip LOCAL_BACKEND with in_memory=False, and are then only cached in SHARED_BACKEND.
+    Keys are built from the function name and its arguments, see _key_part().
+    Concurrent calls with the same key are coalesced, see SingleFlight.
+
+    Args:
+        ttl (float): Time to live of the entries, in seconds. Defaults to None, i.e. no expiry.
+        local_only (bool): Whether to skip the shared backend. Defaults to False.
+        cache_if (callable): Predicate on results deciding whether to cache them. Defaults to caching results
+            whose error_msg (last element) is empty.
+        in_memory (bool): Whether to cache results in LOCAL_BACKEND. Defaults to True.
+    """
+    def decorator(fn):
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = make_key(name, args, kwargs)
+            value = LOCAL_BACKEND.get(key) if in_memory else None
+            if value is not None:
+                return value
+            return SINGLE_FLIGHT.do(key, lambda: load(key, args, kwargs))
+
+        def load(key, args, kwargs):
+            shared = None if local_only else SHARED_BACKEND
+            if shared is not None:
+                value = shared.get(key)
+                if value is not None:
+                    value = reattach_fingerprints(value)
+                    if in_memory:
+                        LOCAL_BACKEND.set(key, value, ttl)
+                    return value
+
+            value = fn(*args, **kwargs)
+            if cache_if(value):
+                if in_memory:
+                    LOCAL_BACKEND.set(key, value, ttl)
+                if shared is not None:
+                    shared.set(key, value, ttl)
+            return value
+        return wrapper
+    return decorator
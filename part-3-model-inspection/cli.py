@@ -0,0 +1,244 @@
+"""Command-line entry point running the app's operations without the UI, e.g. from a nightly job:
+
+    python cli.py score --project-id P --dataset-id D --space-id S --deployment-id X --output scores/
+    python cli.py export-shap --space-id S --deployment-id X --output shap.parquet
+
+The API key is read from the APIKEY environment variable (see --apikey-env), as in the SHAP notebook.
+"""
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import cpd_helpers
+import remote_files
+import scoring_helpers
+import score_store
+
+MANIFEST = "_run.json"
+PART_PATTERN = "part-{:05d}.parquet"
+HIST_BINS = 1000  # score histogram resolution, used for aggregates and the approximate ROC AUC
+
+
+def open_dataset(headers, project_id, dataset_id, chunksize):
+    """Streams a data asset as DataFrame chunks, without holding it in memory.
+
+    Returns:
+        dataset_details (dict): Details of the data asset, see cpd_helpers.get_dataset_attachment().
+        chunks (iterator): Consecutive chunks of chunksize rows.
+    """
+    dataset_details, attachment_details, error_msg = cpd_helpers.get_dataset_attachment(headers, project_id, dataset_id)
+    if error_msg != "":
+        raise RuntimeError(error_msg)
+
+    def chunks():
+        if cpd_helpers.is_parquet_dataset(dataset_details):
+            with remote_files.open_url(attachment_details['url']) as f:
+                yield from remote_files.iter_parquet_chunks(f, chunksize)
+        else:
+            yield from remote_files.iter_csv_chunks(attachment_details['url'], chunksize)
+    return dataset_details, chunks()
+
+
+def check_manifest(output_dir, manifest):
+    """Writes the manifest of a run to output_dir, or checks that the parts already there come from the same
+    deployment, dataset revision and chunk size, in which case the run resumes where it stopped.
+    """
+    path = os.path.join(output_dir, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != manifest:
+            raise RuntimeError(f"{output_dir} holds the results of another run ({previous}), use another output directory.")
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def write_parquet(df, path):
+    # written under a temporary name first, so that interrupted writes are never mistaken for finished parts
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def part_aggregates(path, label):
+    """Aggregates of one part file: class counts and score histograms, per label value if label is set,
+    and votes telling which label scores are the probabilities of (see scoring_helpers.class_votes()).
+    Runs in worker processes, see aggregate_parts().
+    """
+    part = pd.read_parquet(path)
+    edges = np.linspace(0, 1, HIST_BINS + 1)
+    groups = part.groupby(part[label].astype(str)) if label is not None else [(None, part)]
+    histograms = {value: np.histogram(group['predicted_probability'].dropna().clip(0, 1), bins=edges)[0]
+                  for value, group in groups}
+    votes = dict()
+    if label is not None:
+        votes = scoring_helpers.class_votes(part['predicted_class'], part['predicted_probability'], list(histograms))
+    return len(part), part['predicted_class'].value_counts().to_dict(), histograms, votes
+
+
+def aggregate_parts(paths, label, processes):
+    """Merges the aggregates of all part files, computed in parallel processes."""
+    n_rows, class_counts, histograms, votes = 0, dict(), dict(), dict()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for n, counts, hists, part_votes in executor.map(part_aggregates, paths, [label] * len(paths)):
+            n_rows += n
+            for k, v in counts.items():
+                class_counts[k] = class_counts.get(k, 0) + v
+            for k, v in hists.items():
+                histograms[k] = histograms.get(k, 0) + v
+            for k, v in part_votes.items():
+                votes[k] = votes.get(k, 0) + v
+    return n_rows, class_counts, histograms, votes
+
+
+def binned_roc_auc(positive_hist, negative_hist):
+    """ROC AUC from score histograms of positive and negative rows, exact up to ties within a bin."""
+    tpr = np.concatenate([[0], np.cumsum(positive_hist[::-1]) / max(positive_hist.sum(), 1)])
+    fpr = np.concatenate([[0], np.cumsum(negative_hist[::-1]) / max(negative_hist.sum(), 1)])
+    return float(np.trapz(tpr, fpr))
+
+
+def score(headers, args):
+    deployment_details, model_details, error_msg = cpd_helpers.get_deployment_details(
+        headers, args.space_id, args.deployment_id)
+    if error_msg != "":
+        print(f"Could not retrieve the deployment: {error_msg}", file=sys.stderr)
+        return 1
+    dataset_details, chunks = open_dataset(headers, args.project_id, args.dataset_id, args.chunksize)
+    check_manifest(args.output, {
+        "deployment": score_store.deployment_key(deployment_details, model_details),
+        "dataset": [args.dataset_id, cpd_helpers.get_asset_revision(dataset_details)],
+        "chunksize": args.chunksize,
+        "label": args.label,
+    })
+
+    local_model = None
+    if args.local:
+        local_model, error_msg = cpd_helpers.get_local_model(headers, model_details)
+        if local_model is None:
+            print(f"Scoring remotely: {error_msg}")
+    input_schema = scoring_helpers.compile_input_schema(model_details)
+
+    offset, paths = 0, list()
+    for i, chunk in enumerate(chunks):
+        path = os.path.join(args.output, PART_PATTERN.format(i))
+        paths.append(path)
+        row_idx = np.arange(offset, offset + len(chunk))
+        offset += len(chunk)
+        if os.path.exists(path):
+            continue  # scored by a previous, interrupted run
+        if args.label is not None and args.label not in chunk.columns:
+            print(f"The dataset has no column named {args.label}.", file=sys.stderr)
+            return 1
+
+        prepared = input_schema.apply(chunk)[0] if input_schema is not None else chunk
+        result, error_msg = cpd_helpers.score_dataframe(headers, deployment_details, prepared, args.batch_size,
+                                                        args.max_workers, local_model)
+        if result is None:
+            print(f"Scoring stopped at row {row_idx[0]}, run the same command again to resume: {error_msg}",
+                  file=sys.stderr)
+            return 1
+        part = pd.DataFrame({
+            "row_idx": row_idx,
+            "predicted_class": result.classes.astype(str),
+            "predicted_probability": scoring_helpers.positive_scores(result).astype(float),
+        })
+        if args.label is not None:
+            part[args.label] = chunk[args.label].to_numpy()
+        write_parquet(part, path)
+        print(f"Scored {offset} rows")
+
+    n_rows, class_counts, histograms, votes = aggregate_parts(paths, args.label, args.processes)
+    write_parquet(pd.DataFrame(sorted(class_counts.items()), columns=["predicted_class", "count"]),
+                  os.path.join(args.output, "class_counts.parquet"))
+    edges = np.linspace(0, 1, HIST_BINS + 1)
+    histogram = pd.DataFrame({"label": list(), "bin_start": list(), "bin_end": list(), "count": list()})
+    if histograms:
+        histogram = pd.concat([pd.DataFrame({"label": value, "bin_start": edges[:-1], "bin_end": edges[1:], "count": hist})
+                               for value, hist in histograms.items()], ignore_index=True)
+    write_parquet(histogram, os.path.join(args.output, "score_histogram.parquet"))
+
+    summary = {"n_rows": n_rows, "class_counts": {str(k): int(v) for k, v in class_counts.items()}}
+    if args.label is not None and len(histograms) == 2:
+        # scores are probabilities of the class the predicted classes tell, see scoring_helpers.class_votes();
+        # if they cannot, of the last class in sorted order, as with scikit-learn models
+        positive = scoring_helpers.scored_class(votes)
+        if positive is None:
+            positive = sorted(histograms)[-1]
+        negative = [value for value in histograms if value != positive][0]
+        summary["roc_auc"] = binned_roc_auc(histograms[positive], histograms[negative])
+        summary["roc_auc_positive_class"] = positive
+    with open(os.path.join(args.output, "summary.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+def export_shap(headers, args):
+    _, model_details, error_msg = cpd_helpers.get_deployment_details(headers, args.space_id, args.deployment_id)
+    if error_msg != "":
+        print(f"Could not retrieve the deployment: {error_msg}", file=sys.stderr)
+        return 1
+    precomputed_shap = model_details.get('entity', dict()).get('custom', dict()).get('shap')
+    if not precomputed_shap:
+        print("This model has no precomputed SHAP values, see the Model Inspection page.", file=sys.stderr)
+        return 1
+
+    # one row per explained row: feature values, then their SHAP values
+    features = precomputed_shap['feature_names']
+    data = pd.DataFrame(np.array(precomputed_shap['data']), columns=features)
+    values = pd.DataFrame(np.array(precomputed_shap['values'], dtype=float), columns=[f"shap_{c}" for c in features])
+    df = pd.concat([data, values], axis=1)
+    df['shap_base_value'] = float(precomputed_shap['expected_value'])
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_parquet(df, args.output)
+    print(f"Exported SHAP values of {len(df)} rows to {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the Model Inspection app operations without the UI.")
+    parser.add_argument("--apikey-env", default="APIKEY",
+                        help="Environment variable holding the IBM Cloud API key. Defaults to APIKEY.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = subparsers.add_parser("score", help="Streams a dataset, scores it and writes Parquet files. "
+                                                       "Running the same command again resumes an interrupted run.")
+    score_parser.add_argument("--project-id", required=True)
+    score_parser.add_argument("--dataset-id", required=True)
+    score_parser.add_argument("--space-id", required=True)
+    score_parser.add_argument("--deployment-id", required=True)
+    score_parser.add_argument("--output", required=True, help="Output directory.")
+    score_parser.add_argument("--label", help="Label column, copied next to scores to compute the ROC AUC.")
+    score_parser.add_argument("--chunksize", type=int, default=50000, help="Rows per part file. Defaults to 50000.")
+    score_parser.add_argument("--batch-size", type=int, default=1000, help="Rows per scoring request. Defaults to 1000.")
+    score_parser.add_argument("--max-workers", type=int, default=4, help="Concurrent scoring requests. Defaults to 4.")
+    score_parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                              help="Processes computing aggregates. Defaults to the number of CPUs.")
+    score_parser.add_argument("--local", action="store_true",
+                              help="Score scikit-learn and XGBoost models in-process, see cpd_helpers.get_local_model().")
+    score_parser.set_defaults(run=score)
+
+    shap_parser = subparsers.add_parser("export-shap", help="Exports the SHAP values stored with a model to Parquet.")
+    shap_parser.add_argument("--space-id", required=True)
+    shap_parser.add_argument("--deployment-id", required=True)
+    shap_parser.add_argument("--output", required=True, help="Output Parquet file.")
+    shap_parser.set_defaults(run=export_shap)
+
+    args = parser.parse_args(argv)
+    auth_ok, headers, error_msg = cpd_helpers.authenticate(os.environ.get(args.apikey_env, ""))
+    if not auth_ok:
+        print(f"Authentication failed: {error_msg}", file=sys.stderr)
+        return 1
+    return args.run(headers, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
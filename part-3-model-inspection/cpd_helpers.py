@@ -1,9 +1,128 @@
+import os
+import re
+import json
+import base64
+import time
+import hashlib
+import tempfile
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import pandas as pd
 import streamlit as st
 
-CPD_URL = "https://api.dataplatform.cloud.ibm.com"  # endpoint for anything data-related
-WML_URL = "https://us-south.ml.cloud.ibm.com"  # endpoint for ML serving
+import memory_governor
+import profiling
+import remote_files
+import resilience
+import row_filters
+import scoring_helpers
+from sections import section
+from cache_helpers import DatasetFingerprint, LRUCache, approx_size, attach_fingerprint, cached, no_error, \
+    SINGLE_FLIGHT
+
+# endpoints can be overridden, e.g. to point the app to mock_backend.py
+CPD_URL = os.environ.get("CPD_URL", "https://api.dataplatform.cloud.ibm.com")  # endpoint for anything data-related
+WML_URL = os.environ.get("WML_URL", "https://us-south.ml.cloud.ibm.com")  # endpoint for ML serving
+IAM_URL = os.environ.get("IAM_URL", "https://iam.ng.bluemix.net")  # endpoint for authentication
+DATA_CACHE_DIR = os.path.join(tempfile.gettempdir(), "cpd_datasets")  # local copies of data assets
+METADATA_TTL = int(os.environ.get("METADATA_TTL", 600))  # seconds lists and details of assets are cached for
+DATA_TTL = int(os.environ.get("DATA_TTL", 3600))  # seconds datasets and scores are cached for
+CSV_CHUNKSIZE = 100000  # rows parsed (and profiled) at a time when loading CSV data assets
+TOKEN_REFRESH_MARGIN_S = 300  # background work authenticates again when its token expires within this many seconds
+PARQUET_MIME_TYPES = ('application/x-parquet', 'application/parquet', 'application/vnd.apache.parquet')
+
+# columns already materialized from data assets loaded on demand, shared by all sessions and dropped
+# by the memory governor under memory pressure: {(dataset_id, revision, column_name): pd.Series or Slot}
+_loaded_columns = LRUCache(
+    max_entries=int(os.environ.get("COLUMN_CACHE_MAX_ENTRIES", 4096)),
+    max_bytes=int(os.environ.get("COLUMN_CACHE_MAX_MB", 1024)) * 2**20,
+    sizeof=lambda column: column.size if isinstance(column, memory_governor.Slot) else approx_size(column)
+)
+# {local_path: (dataset_id, revision)} for CSV datasets returned by download_dataset()
+_downloaded_datasets = dict()
+
+
+class AuthHeaders(dict):
+    """Authentication headers returned by authenticate(), which also carry the identity
+    (IBM Cloud account id and IAM id) the bearer token was issued to.
+
+    Cached functions receiving headers are keyed on that identity rather than on the token itself
+    (see cache_key): cache entries survive token refreshes and re-authentication, while never being
+    shared between different users. The token is only used to perform requests on cache misses.
+    The API key the token was obtained with is kept as well, for background work outliving the token
+    to authenticate again, see refresh_headers().
+    """
+
+    def __init__(self, access_token, apikey=None):
+        super().__init__({"Authorization": "Bearer " + access_token, "content-type": "application/json"})
+        self.identity = _token_identity(access_token)
+        self.expires_at = _token_expiry(access_token)
+        self._apikey = apikey
+
+    @property
+    def cache_key(self):
+        return self.identity
+
+
+def _request(method, url, **kwargs):
+    """Performs an HTTP request with connect and read timeouts bounded by the time left to render
+    the current page, see resilience.deadline().
+    Timeouts and connection errors are returned as failed responses (504, resp. 503, or 408 if the budget
+    was spent before sending the request) whose text explains the failure, so that callers report them
+    in their error_msg like any other failed request.
+    Timeouts are counted per host, see resilience.timeout_counts().
+
+    Args:
+        method (str): HTTP method, e.g. "GET".
+        url (str): The url to call.
+        **kwargs: Other arguments of requests.request().
+    Returns:
+        r (requests.Response): The response.
+    """
+    host = urlparse(url).netloc
+    try:
+        return requests.request(method, url, timeout=resilience.timeout(), **kwargs)
+    except resilience.DeadlineExceeded as e:
+        return _failed_response(url, 408, str(e))
+    except requests.Timeout:
+        resilience.record_timeout(host)
+        return _failed_response(url, 504, f"{host} did not respond in time, please try again.")
+    except requests.ConnectionError as e:
+        return _failed_response(url, 503, f"Could not connect to {host}: {e}")
+
+
+def _failed_response(url, status_code, text):
+    r = requests.Response()
+    r.url, r.status_code, r.encoding = url, status_code, 'utf-8'
+    r._content, r._content_consumed = text.encode(), True
+    return r
+
+
+def _token_identity(access_token):
+    """Extracts (account_id, iam_id) from the claims of an IAM access token (a JWT).
+    The signature is not verified, since the token was just received from IAM by authenticate().
+    If the claims cannot be read, falls back to a hash of the token, i.e. no cache sharing at all.
+    """
+    try:
+        claims = access_token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(claims + '=' * (-len(claims) % 4)))
+        identity = (claims.get('account', dict()).get('bss'), claims.get('iam_id') or claims['sub'])
+    except (IndexError, KeyError, ValueError, AttributeError):
+        identity = None
+    if identity is None or identity[1] is None:
+        identity = ('token', hashlib.sha256(access_token.encode()).hexdigest())
+    return identity
+
+
+def _token_expiry(access_token):
+    # expiry time of an IAM access token (a JWT), as a Unix timestamp. None if its claims cannot be read
+    try:
+        claims = access_token.split('.')[1]
+        return float(json.loads(base64.urlsafe_b64decode(claims + '=' * (-len(claims) % 4)))['exp'])
+    except (IndexError, KeyError, ValueError, TypeError, AttributeError):
+        return None
 
 
 def authenticate(apikey):
@@ -11,13 +130,14 @@ def authenticate(apikey):
     and returns authentication headers if successful.
     See https://cloud.ibm.com/apidocs/watson-data-api#creating-an-iam-bearer-token.
     Note this function is not cached by Streamlit since they token eventually expires, so users
-    need to re-authenticate periodically.
+    need to re-authenticate periodically. The headers returned identify the user, which lets other
+    functions of this module keep their caches warm across re-authentications.
 
     Args:
         apikey (str): An IBM Cloud API key, obtained from https://cloud.ibm.com/iam/apikeys).
     Returns:
         success (bool): Whether authentication was successful
-        headers (dict): If success=True, a dictionary with valid authentication headers. Otherwise, None.
+        headers (AuthHeaders): If success=True, a dictionary with valid authentication headers. Otherwise, None.
         error_msg (str): The text response from the authentication request if the request failed.
     """
     auth_headers = {
@@ -30,17 +150,35 @@ def authenticate(apikey):
         'grant_type': 'urn:ibm:params:oauth:grant-type:apikey'
     }
 
-    r = requests.post('https://iam.ng.bluemix.net/identity/token', headers=auth_headers, data=data)
+    r = _request('POST', f"{IAM_URL}/identity/token", headers=auth_headers, data=data)
 
     if r.ok:
-        headers = {"Authorization": "Bearer " + r.json()['access_token'], "content-type": "application/json"}
-        return True, headers, ""
+        return True, AuthHeaders(r.json()['access_token'], apikey), ""
     else:
         print(r.text)
         return False, None, r.text
 
 
-@st.cache(suppress_st_warning=True)
+def refresh_headers(headers, margin_s=TOKEN_REFRESH_MARGIN_S):
+    """Authenticates again with the API key headers were obtained with, if their token expires
+    within margin_s seconds. Meant for background work outliving tokens, e.g. jobs polled for hours.
+
+    Args:
+        headers (AuthHeaders): Authentication headers obtained with authenticate().
+        margin_s (float): Seconds before expiry from which to authenticate again. Defaults to TOKEN_REFRESH_MARGIN_S.
+    Returns:
+        headers (AuthHeaders): New headers, or the same ones if they do not expire yet, if their expiry is unknown,
+            or if authentication failed.
+        error_msg (str): The text response from the authentication request if it failed.
+    """
+    expires_at, apikey = getattr(headers, 'expires_at', None), getattr(headers, '_apikey', None)
+    if expires_at is None or apikey is None or expires_at - time.time() > margin_s:
+        return headers, ""
+    auth_ok, new_headers, error_msg = authenticate(apikey)
+    return (new_headers, "") if auth_ok else (headers, error_msg)
+
+
+@cached(ttl=METADATA_TTL)
 def list_projects(headers):
     """Calls the project list endpoint of Cloud Pak for Data as a Service,
     and returns a list of projects if successful.
@@ -52,7 +190,7 @@ def list_projects(headers):
         projects (list): A list of (project_name, project_id) tuples.
         error_msg (str): The text response from the request if the request failed.
     """
-    r = requests.get(f"{CPD_URL}/v2/projects", headers=headers, params={"limit": 100})
+    r = _request('GET', f"{CPD_URL}/v2/projects", headers=headers, params={"limit": 100})
     if r.ok:
         projects = r.json()['resources']
         parsed_projects = [(x['entity']['name'], x['metadata']['guid']) for x in projects]
@@ -62,7 +200,7 @@ def list_projects(headers):
         return list(), r.text
 
 
-@st.cache(suppress_st_warning=True)
+@cached(ttl=METADATA_TTL)
 def list_datasets(headers, project_id):
     """Calls the search endpoint of Cloud Pak for Data as a Service,
     and returns a list of data assets in a given project if successful.
@@ -86,9 +224,9 @@ def list_datasets(headers, project_id):
             }
         }
     }
-    r = requests.post(f"{CPD_URL}/v3/search",
-                      headers=headers,
-                      json=search_doc)
+    r = _request('POST', f"{CPD_URL}/v3/search",
+                         headers=headers,
+                         json=search_doc)
 
     if r.ok:
         datasets = r.json()['rows']
@@ -99,7 +237,72 @@ def list_datasets(headers, project_id):
         return list(), r.text
 
 
-@st.cache(suppress_st_warning=True)
+def get_asset_revision(details):
+    """Returns a string identifying the current revision of an asset (data asset, model or function),
+    based on its metadata. Two calls returning the same value mean the asset has not changed in between.
+
+    Args:
+        details (dict): Asset details, e.g. obtained from get_dataset_attachment() or get_deployment_details().
+    Returns:
+        revision (str): The last update timestamp of the asset if available, otherwise its revision number.
+    """
+    metadata = details.get('metadata', dict())
+    revision = metadata.get('usage', dict()).get('last_updated_at') or metadata.get('modified_at') \
+        or metadata.get('rev') or metadata.get('revision_id', '')
+    return str(revision)
+
+
+def is_parquet_dataset(dataset_details):
+    """Checks whether a data asset is stored in Parquet format, based on its mime type or file name.
+
+    Args:
+        dataset_details (dict): Data asset details obtained from get_dataset_attachment().
+    """
+    mime_type = dataset_details['entity']['data_asset']['mime_type']
+    name = dataset_details.get('metadata', dict()).get('name', '')
+    return mime_type in PARQUET_MIME_TYPES or name.endswith('.parquet')
+
+
+def get_dataset_attachment(headers, project_id, dataset_id):
+    """Retrieves the details of a data asset stored in a Watson Studio project, as well as
+    the details of its first attachment, which include a signed url to download the data.
+    Not cached since signed urls expire.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): The Watson Studio project id to search in.
+        dataset_id (str): The dataset to retrieve
+    Returns:
+        dataset_details (dict): Details of the data asset, empty if the request failed.
+        attachment_details (dict): Details of its attachment, empty if any of the requests failed.
+        error_msg (str): If any of the HTTP requests fails, the text response from the first failing
+            request.
+    """
+    r = _request('GET', f"{CPD_URL}/v2/data_assets/{dataset_id}",
+                        params={"project_id": project_id},
+                        headers=headers
+                       )
+    if r.ok:
+        dataset_details = r.json()
+        attachment_id = dataset_details['attachments'][0]['id']
+    else:
+        print(r.text)
+        return dict(), dict(), r.text
+
+    r2 = _request('GET', f"{CPD_URL}/v2/assets/{dataset_id}/attachments/{attachment_id}",
+                         params={"project_id": project_id},
+                         headers=headers
+                         )
+    if r2.ok:
+        return dataset_details, r2.json(), ""
+    else:
+        print(r2.text)
+        return dataset_details, dict(), r2.text
+
+
+# full datasets are kept by the session states which loaded them, under the memory governor: a copy
+# in the in-memory cache would not be spilled along with them
+@cached(ttl=DATA_TTL, in_memory=False)
 def load_dataset(headers, project_id, dataset_id):
     """Loads into a memory a data asset stored in a Watson Studio project
     on IBM Cloud Pak for Data as a Service.
@@ -108,6 +311,9 @@ def load_dataset(headers, project_id, dataset_id):
     - Retrieving the attachment
     - Extracting a signed url from the attachment and using it to load the data into Pandas
 
+    CSV and Parquet data assets are supported. A profile of the data is built while loading it,
+    see get_session_profile(). To only load some columns, see download_dataset() and load_dataset_columns().
+
     Args:
         headers (dict): Authentication headers obtained with authenticate().
         project_id (str): The Watson Studio project id to search in.
@@ -117,35 +323,378 @@ def load_dataset(headers, project_id, dataset_id):
         error_msg (str): If any of the HTTP requests fails, the text response from the first failing
             request.
     """
-    r = requests.get(f"{CPD_URL}/v2/data_assets/{dataset_id}",
-                     params={"project_id": project_id},
-                     headers=headers
-                    )
-    if r.ok:
-        dataset_details = r.json()
-        if dataset_details['entity']['data_asset']['mime_type'] != 'text/csv':
-            st.warning("The dataset selected is not in CSV format and cannot be loaded. Please select another one.")
-        attachment_id = dataset_details['attachments'][0]['id']
-    else:
-        print(r.text)
-        return pd.DataFrame(), r.text
+    dataset_details, attachment_details, error_msg = get_dataset_attachment(headers, project_id, dataset_id)
+    if error_msg != "":
+        return pd.DataFrame(), error_msg
 
-    r2 = requests.get(f"{CPD_URL}/v2/assets/{dataset_id}/attachments/{attachment_id}",
-                      params={"project_id": project_id},
-                      headers=headers
-                      )
-    if r2.ok:
-        attachment_details = r2.json()
-    else:
-        return pd.DataFrame(), r2.text
+    profile = profiling.DatasetProfile()
+    try:
+        if is_parquet_dataset(dataset_details):
+            with remote_files.open_url(attachment_details['url']) as f:
+                df = remote_files.read_parquet(f)
+            profile.add_columns(df)
+        else:
+            if dataset_details['entity']['data_asset']['mime_type'] != 'text/csv':
+                st.warning("The dataset selected is not in CSV or Parquet format and cannot be loaded. Please select another one.")
+            with _request('GET', attachment_details['url'], stream=True) as r:
+                if not r.ok:
+                    return pd.DataFrame(), r.text
+                r.raw.decode_content = True
+                # rows are profiled chunk by chunk, as they are parsed
+                chunks = list(profiling.profiled(pd.read_csv(r.raw, chunksize=CSV_CHUNKSIZE), profile))
+            df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    except Exception as e:
+        return pd.DataFrame(), str(e)
+
+    fingerprint = DatasetFingerprint(dataset_id, get_asset_revision(dataset_details), "")
+    profiling.store_profile(fingerprint, profile)
+    return attach_fingerprint(df, fingerprint), ""
+
+
+class RemoteParquet:
+    """A Parquet data asset returned by download_dataset() in place of a local copy: its columns are read
+    with HTTP range requests from the signed url of its attachment. Signed urls expire, so a fresh one
+    is requested for every read, see open(). It is identified (e.g. in cache keys, see cache_helpers.make_key())
+    by the data asset id and revision, not by the headers used to read it.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): The Watson Studio project id the data asset belongs to.
+        dataset_id (str): Id of the data asset.
+        revision (str): Revision of the data asset, see get_asset_revision().
+    """
+
+    def __init__(self, headers, project_id, dataset_id, revision):
+        self.headers, self.project_id, self.dataset_id, self.revision = headers, project_id, dataset_id, revision
+
+    @property
+    def cache_key(self):
+        return ('parquet', self.project_id, self.dataset_id, self.revision)
+
+    def __eq__(self, other):
+        return isinstance(other, RemoteParquet) and self.cache_key == other.cache_key
 
+    def __hash__(self):
+        return hash(self.cache_key)
+
+    def __repr__(self):
+        return f"RemoteParquet({self.dataset_id!r}, revision={self.revision!r})"
+
+    def open(self):
+        """Opens the data asset for reading, see remote_files.open_url().
+
+        Raises:
+            IOError: If the signed url could not be obtained, or the data asset was updated since
+                download_dataset() returned it.
+        """
+        dataset_details, attachment_details, error_msg = get_dataset_attachment(self.headers, self.project_id,
+                                                                                self.dataset_id)
+        if error_msg != "":
+            raise IOError(error_msg)
+        if get_asset_revision(dataset_details) != self.revision:
+            raise IOError("The dataset was updated in the project, please load it again.")
+        return remote_files.open_url(attachment_details['url'])
+
+
+def _is_local_copy(value):
+    # RemoteParquet objects hold the headers of the session which asked for them, so only local copies are cached
+    return no_error(value) and not isinstance(value[0], RemoteParquet)
+
+
+@cached(ttl=DATA_TTL, local_only=True, cache_if=_is_local_copy)
+def download_dataset(headers, project_id, dataset_id):
+    """Downloads a data asset stored in a Watson Studio project to a local file, without
+    loading it into memory. Its columns can then be materialized on demand with load_dataset_columns().
+    The local copy is reused as long as the data asset is not updated in the project.
+    Parquet data assets are not downloaded: their columns are read in place with HTTP range requests,
+    see RemoteParquet.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): The Watson Studio project id to search in.
+        dataset_id (str): The dataset to download
+    Returns:
+        path (str): Path to the local copy of the dataset (a RemoteParquet for Parquet data assets),
+            None if any of the HTTP requests fails.
+        error_msg (str): If any of the HTTP requests fails, the text response from the first failing
+            request.
+    """
+    dataset_details, attachment_details, error_msg = get_dataset_attachment(headers, project_id, dataset_id)
+    if error_msg != "":
+        return None, error_msg
+    revision = get_asset_revision(dataset_details)
+    if is_parquet_dataset(dataset_details):
+        return RemoteParquet(headers, project_id, dataset_id, revision), ""
+    if dataset_details['entity']['data_asset']['mime_type'] != 'text/csv':
+        st.warning("The dataset selected is not in CSV or Parquet format and cannot be loaded. Please select another one.")
+
+    safe_revision = re.sub(r'[^\w.-]', '_', revision)
+    path = os.path.join(DATA_CACHE_DIR, f"{dataset_id}_{safe_revision}.csv")
+    _downloaded_datasets[path] = (dataset_id, revision)
+    if os.path.exists(path):
+        return path, ""
+
+    os.makedirs(DATA_CACHE_DIR, exist_ok=True)
+    # download to a temporary file first so that a partial download is never picked up as a valid copy
+    fd, tmp_path = tempfile.mkstemp(dir=DATA_CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f, _request('GET', attachment_details['url'], stream=True) as r:
+            if not r.ok:
+                return None, r.text
+            for chunk in r.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        return path, ""
+    except Exception as e:
+        return None, str(e)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@cached(local_only=True)
+def load_dataset_sample(path, nrows=1000):
+    """Reads the header and the first rows of a dataset downloaded with download_dataset().
+
+    Args:
+        path (str): Path to the local copy of the dataset, or RemoteParquet, as returned by download_dataset().
+        nrows (int): Number of rows to read. Defaults to 1000.
+    Returns:
+        df (pd.DataFrame): The first nrows of the dataset, with all its columns.
+    """
+    if _is_remote_parquet(path):
+        with _open_remote(path) as f:
+            return remote_files.read_parquet_head(f, nrows)
+    return pd.read_csv(path, nrows=nrows)
+
+
+@cached(ttl=DATA_TTL)
+def preview_dataset(headers, project_id, dataset_id, nrows=5, strategy="Head", seed=0):
+    """Previews a data asset stored in a Watson Studio project without loading it entirely:
+    - "Head" only downloads the first bytes of the data asset (or its first row group for Parquet files)
+    - "Random Sample" streams the data asset once and keeps a bounded reservoir of rows. If the time budget
+      of the page runs out (see resilience.deadline()), rows are sampled from the part streamed so far
+      and error_msg says so.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): The Watson Studio project id to search in.
+        dataset_id (str): The dataset to preview
+        nrows (int): Number of rows to return. Defaults to 5.
+        strategy (str): "Head" or "Random Sample". Defaults to "Head".
+        seed (int): Seed used for "Random Sample". Defaults to 0.
+    Returns:
+        df (pd.DataFrame): The preview rows, empty if any of the HTTP requests fails.
+        error_msg (str): If any of the HTTP requests fails, the text response from the first failing
+            request.
+    """
+    dataset_details, attachment_details, error_msg = get_dataset_attachment(headers, project_id, dataset_id)
+    if error_msg != "":
+        return pd.DataFrame(), error_msg
+
+    url = attachment_details['url']
     try:
-        return pd.read_csv(attachment_details['url']), ""
+        if is_parquet_dataset(dataset_details):
+            with remote_files.open_url(url) as f:
+                if strategy == "Head":
+                    return remote_files.read_parquet_head(f, nrows), ""
+                return _sample_until_deadline(remote_files.iter_parquet_chunks(f), nrows, seed)
+        if strategy == "Head":
+            return remote_files.read_csv_head(url, nrows), ""
+        return _sample_until_deadline(remote_files.iter_csv_chunks(url), nrows, seed)
     except Exception as e:
         return pd.DataFrame(), str(e)
 
 
-@st.cache(suppress_st_warning=True)
+def _sample_until_deadline(chunks, nrows, seed):
+    # if the page budget runs out, the rows streamed so far are sampled rather than returning nothing
+    chunks = resilience.DeadlineIterator(chunks)
+    sample = remote_files.sample_rows(chunks, nrows, seed)
+    if chunks.expired:
+        return sample, "The time budget of this page was spent: rows were only sampled from the beginning of the dataset."
+    return sample, ""
+
+
+def _is_remote_parquet(path):
+    # download_dataset() returns RemoteParquet objects for Parquet data assets, and local paths for CSV ones;
+    # urls of Parquet files can be passed as well
+    return isinstance(path, RemoteParquet) or path.startswith(('http://', 'https://'))
+
+
+def _open_remote(path):
+    return path.open() if isinstance(path, RemoteParquet) else remote_files.open_url(path)
+
+
+def _asset_revision(path):
+    # (dataset_id, revision) of a dataset returned by download_dataset()
+    if isinstance(path, RemoteParquet):
+        return path.dataset_id, path.revision
+    return _downloaded_datasets.get(path, (path, None))
+
+
+def iter_dataset_chunks(path, columns=None, chunksize=CSV_CHUNKSIZE):
+    """Reads a dataset downloaded with download_dataset() chunk by chunk, without holding it in memory.
+    Each call reads the dataset again from the start, so computations may go over it several times.
+
+    Args:
+        path (str): Path to the local copy of the dataset, or RemoteParquet, as returned by download_dataset().
+        columns (list): Names of the columns to read. Defaults to None, i.e. all columns.
+        chunksize (int): Maximum number of rows per chunk. Defaults to CSV_CHUNKSIZE.
+    Yields:
+        df (pd.DataFrame): Consecutive chunks of the dataset.
+    """
+    if _is_remote_parquet(path):
+        with _open_remote(path) as f:
+            yield from remote_files.iter_parquet_chunks(f, chunksize, columns)
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+
+def get_dataset_fingerprint(path):
+    """Returns the fingerprint of the whole data asset downloaded to path with download_dataset(),
+    i.e. its id and revision.
+    """
+    return DatasetFingerprint(*_asset_revision(path), "")
+
+
+def load_dataset_columns(path, columns=None):
+    """Materializes some columns of a dataset downloaded with download_dataset().
+    Columns are parsed from the local copy only once and then kept in memory, so that asking
+    for a new column only parses that column. Under memory pressure, the memory governor may drop
+    kept columns, which are then parsed again when needed. New columns are added to the profile of the dataset.
+
+    Args:
+        path (str): Path to the local copy of the dataset, or RemoteParquet, as returned by download_dataset().
+        columns (list): Names of the columns to load. Defaults to None, i.e. all columns.
+    Returns:
+        df (pd.DataFrame): The requested columns of the dataset, in the requested order.
+    """
+    if columns is None:
+        columns = list(load_dataset_sample(path).columns)
+
+    dataset_id, revision = _asset_revision(path)
+    found = {c: memory_governor.resolve(_loaded_columns.get((dataset_id, revision, c), memory_governor.DROPPED))
+             for c in columns}
+    missing = [c for c in columns if found[c] is memory_governor.DROPPED]
+    if missing:
+        # sessions asking for the same columns at the same time only parse them once
+        new_columns = SINGLE_FLIGHT.do(('columns', path, tuple(missing)),
+                                       lambda: _materialize_columns(path, missing, dataset_id, revision))
+        found.update(new_columns.items())
+    df = pd.concat([found[c] for c in columns], axis=1)
+    return attach_fingerprint(df, DatasetFingerprint(dataset_id, revision, repr(tuple(columns))))
+
+
+def _materialize_columns(path, columns, dataset_id, revision):
+    if _is_remote_parquet(path):
+        with _open_remote(path) as f:
+            new_columns = remote_files.read_parquet(f, columns=columns)
+    else:
+        new_columns = pd.read_csv(path, usecols=columns)
+    # columns dropped by the memory governor and parsed again are already profiled
+    profile = profiling.get_asset_profile(dataset_id, revision)
+    profile.add_columns(new_columns[[c for c in new_columns.columns if c not in profile.columns]])
+    for name, column in new_columns.items():
+        _loaded_columns.set((dataset_id, revision, name), memory_governor.govern(column, spill=False, shared=True))
+    return new_columns
+
+
+def get_session_dataset(columns=None):
+    """Returns the dataset loaded on the Data Exploration page for the current session,
+    whether it was fully loaded or is loaded column by column on demand.
+
+    Args:
+        columns (list): Names of the columns needed. Defaults to None, i.e. all columns.
+    Returns:
+        df (pd.DataFrame): The dataset, restricted to the requested columns. None if no dataset was loaded yet.
+    """
+    df = memory_governor.get_session_value('df')
+    if df is not None:
+        return df if columns is None else df[list(columns)]
+    path = st.session_state.get('dataset_path')
+    if path is not None:
+        # the same frame is returned on reruns, rather than concatenating the columns again
+        columns = None if columns is None else tuple(columns)
+        return section(f"{__name__}.session_dataset", (path, columns), lambda: load_dataset_columns(path, columns))
+    return None
+
+
+def get_session_columns():
+    """Returns the names of the columns of the dataset loaded on the Data Exploration page for the current session,
+    without loading any column when they are loaded on demand.
+
+    Returns:
+        columns (list): The names of the columns of the dataset. None if no dataset was loaded yet.
+    """
+    df = memory_governor.get_session_value('df')
+    if df is not None:
+        return list(df.columns)
+    path = st.session_state.get('dataset_path')
+    if path is not None:
+        return section(f"{__name__}.session_columns", (path,), lambda: list(load_dataset_sample(path, nrows=0).columns))
+    return None
+
+
+def get_session_model_dataset(model_details):
+    """Returns the columns of the dataset loaded on the Data Exploration page for the current session
+    which are inputs of a model, so that columns loaded on demand are only loaded when the model uses them.
+
+    Args:
+        model_details (dict): Model/Function details obtained from get_deployment_details()
+    Returns:
+        df (pd.DataFrame): The input columns of the model found in the dataset, all columns if the model has no
+            input schema or none of its inputs is in the dataset. None if no dataset was loaded yet.
+    """
+    columns = get_session_columns()
+    if columns is None:
+        return None
+    input_schema = scoring_helpers.compile_input_schema(model_details)
+    if input_schema is not None:
+        inputs = [c for c in columns if c in input_schema.column_set]
+        return get_session_dataset(inputs or None)
+    return get_session_dataset()
+
+
+def get_session_profile():
+    """Returns the profile of the dataset loaded on the Data Exploration page for the current session
+    (see profiling.DatasetProfile), to read column ranges, value lists and quantiles without scanning the data.
+    When columns are loaded on demand, only the columns loaded so far are profiled.
+
+    Returns:
+        profile (DatasetProfile): The profile of the dataset. None if no dataset was loaded yet.
+    """
+    df = memory_governor.get_session_value('df')
+    if df is not None:
+        return profiling.get_profile(df)
+    path = st.session_state.get('dataset_path')
+    if path is not None:
+        return profiling.get_asset_profile(*_asset_revision(path))
+    return None
+
+
+def get_session_mask(filters, how=row_filters.ALL):
+    """Returns the mask of the rows of the dataset loaded on the Data Exploration page for the current session
+    matching filters, see row_filters. The mask of each filter is evaluated once per dataset and then cached,
+    so that adding or removing a filter only combines cached masks. When columns are loaded on demand,
+    only the filtered columns are loaded.
+
+    Args:
+        filters (list): List of (column, op, value) tuples, see row_filters.normalize().
+        how (str): row_filters.ALL to keep rows matching all filters, row_filters.ANY for any of them.
+            Defaults to row_filters.ALL.
+    Returns:
+        mask (np.array): One boolean per row. None if there are no filters or no dataset was loaded yet.
+    """
+    df = memory_governor.get_session_value('df')
+    path = st.session_state.get('dataset_path')
+    if df is not None:
+        return row_filters.combine((row_filters.get_mask(df, f) for f in filters), how)
+    if path is not None:
+        return row_filters.combine((row_filters.get_mask(load_dataset_columns(path, [f[0]]), f) for f in filters), how)
+    return None
+
+
+@cached(ttl=METADATA_TTL)
 def list_spaces(headers):
     """Calls the spaces list endpoint of Cloud Pak for Data as a Service,
     and returns a list of projects if successful.
@@ -158,7 +707,7 @@ def list_spaces(headers):
         spaces (list): A list of (space_name, space_id) tuples.
         error_msg (str): The text response from the request if the request failed.
     """
-    r = requests.get(f"{CPD_URL}/v2/spaces", headers=headers)
+    r = _request('GET', f"{CPD_URL}/v2/spaces", headers=headers)
     if r.ok:
         spaces = r.json()['resources']
         parsed_projects = [(x['entity']['name'], x['metadata']['id']) for x in spaces]
@@ -168,7 +717,7 @@ def list_spaces(headers):
         return list(), r.text
 
 
-@st.cache(suppress_st_warning=True)
+@cached(ttl=METADATA_TTL)
 def list_deployments(headers, space_id):
     """Calls the deployments list endpoint of Cloud Pak for Data as a Service,
     and returns a list of deployments if successful.
@@ -181,9 +730,9 @@ def list_deployments(headers, space_id):
         deployments (list): A list of (project_name, project_id) tuples.
         error_msg (str): The text response from the request if the request failed.
     """
-    r = requests.get(f"{WML_URL}/ml/v4/deployments",
-                     headers=headers,
-                     params={"space_id": space_id, "version": "2021-01-01"}
+    r = _request('GET', f"{WML_URL}/ml/v4/deployments",
+                        headers=headers,
+                        params={"space_id": space_id, "version": "2021-01-01"}
     )
     if r.ok:
         deployments = r.json()['resources']
@@ -194,7 +743,7 @@ def list_deployments(headers, space_id):
         return list(), r.text
 
 
-@st.cache(suppress_st_warning=True)
+@cached(ttl=METADATA_TTL)
 def get_deployment_details(headers, space_id, deployment_id):
     """Calls the deployment details endpoint of Cloud Pak for Data as a Service,
     then calls the model (resp. function) details for the model (resp. function)
@@ -211,18 +760,18 @@ def get_deployment_details(headers, space_id, deployment_id):
     Returns:
         # TODO
     """
-    r = requests.get(f"{WML_URL}/ml/v4/deployments/{deployment_id}",
-                     headers=headers,
-                     params={"space_id": space_id, "version": "2021-01-01"}
+    r = _request('GET', f"{WML_URL}/ml/v4/deployments/{deployment_id}",
+                        headers=headers,
+                        params={"space_id": space_id, "version": "2021-01-01"}
     )
     if r.ok:
         deployment_details = r.json()
         asset_id = deployment_details['entity']['asset']['id']
         asset_type = deployment_details['entity']['deployed_asset_type']  # "model" or "function"
 
-        r2 = requests.get(f"{WML_URL}/ml/v4/{asset_type}s/{asset_id}",
-                          headers=headers,
-                          params={"space_id": space_id, "version": "2021-01-01"}
+        r2 = _request('GET', f"{WML_URL}/ml/v4/{asset_type}s/{asset_id}",
+                             headers=headers,
+                             params={"space_id": space_id, "version": "2021-01-01"}
         )
 
         if r2.ok:
@@ -239,22 +788,208 @@ def get_deployment_details(headers, space_id, deployment_id):
 def prepare_input_schema(model_details, payload):
     """Helper function that checks that a given payload follows the input schema
     of a given model, and filter input columns if needed.
+    The schema is compiled once per model revision, see scoring_helpers.compile_input_schema().
+    To prepare many rows at once, use the apply() method of the compiled schema on a DataFrame instead.
 
     Args:
         model_details (dict): Model/Function details obtained from get_deployment_details()
         payload (dict): Input data to predict, in {feature_name: value} format.
     """
-    if model_details.get('entity', dict()).get('schemas'):
-        # model has an attached input schema (e.g. AutoAI, SPSS, or Python if user specified it)
-        input_schema = model_details['entity']['schemas']['input'][0]
-        expected_input_cols = [x['name'] for x in input_schema['fields']]
-        return {k: v for k, v in payload.items() if k in expected_input_cols}
+    # models may have an attached input schema (e.g. AutoAI, SPSS, or Python if user specified it)
+    input_schema = scoring_helpers.compile_input_schema(model_details)
+    if input_schema is not None:
+        return input_schema.select(payload)
     else:
         return payload
 
 
+def download_model(headers, model_details):
+    """Calls the model content download endpoint of Cloud Pak for Data as a Service.
+    See https://cloud.ibm.com/apidocs/machine-learning#models-download-content.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        model_details (dict): Model details obtained from get_deployment_details()
+    Returns:
+        content (bytes): The model artifact, None if the request failed.
+        error_msg (str): The text response from the request if the request failed.
+    """
+    r = _request('GET', f"{WML_URL}/ml/v4/models/{model_details['metadata']['id']}/download",
+                        headers=headers,
+                        params={"space_id": model_details['metadata'].get('space_id'), "version": "2021-01-01"}
+    )
+    if r.ok:
+        return r.content, ""
+    else:
+        print(r.text)
+        return None, r.text
+
+
+def get_local_model(headers, model_details):
+    """Returns an in-process version of a deployed model, for scikit-learn and XGBoost models.
+    The artifact is downloaded and unpickled once per model revision, see scoring_helpers.load_local_model().
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        model_details (dict): Model/Function details obtained from get_deployment_details()
+    Returns:
+        model (LocalModel): The model, None if it cannot be scored in-process.
+        error_msg (str): Why the model cannot be scored in-process, if so.
+    """
+    if not scoring_helpers.supports_local_scoring(model_details):
+        return None, f"Models of type '{model_details.get('entity', dict()).get('type')}' are scored remotely."
+
+    def download():
+        content, error_msg = download_model(headers, model_details)
+        if content is None:
+            raise IOError(error_msg)
+        return content
+    try:
+        return scoring_helpers.load_local_model(model_details, download), ""
+    except Exception as e:
+        return None, str(e)
+
+
+def score_batch(headers, deployment_details, df, local_model=None):
+    """Calls the synchronous deployment prediction endpoint of Cloud Pak for Data as a Service
+    for all rows of a DataFrame at once, see scoring_helpers.encode_scoring_payload() and
+    scoring_helpers.decode_predictions() for how payloads and responses are handled.
+    If an in-process model is passed, rows are scored locally instead, falling back to the
+    deployment if local scoring fails.
+    Remote calls are hedged when slower than usual, and refused while the deployment's circuit breaker is open,
+    see resilience.hedged_call() and resilience.CircuitBreaker.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        deployment_details (dict): Deployment details obtained from get_deployment_details()
+        df (pd.DataFrame): Input data to predict, e.g. prepared with InputSchema.apply().
+        local_model (LocalModel): In-process model obtained from get_local_model(). Defaults to None.
+    Returns:
+        result (ScoringResult): Predictions for every row of df, None if the request failed.
+        error_msg (str): The text response from the request if the request failed.
+    """
+    if local_model is not None:
+        try:
+            return local_model.score(df), ""
+        except Exception as e:
+            print(f"Local scoring failed, falling back to remote scoring: {e}")
+
+    deployment_id = deployment_details['metadata']['id']
+    breaker = resilience.get_breaker(deployment_id)
+    if not breaker.allow():
+        return None, f"The deployment failed repeatedly, scoring requests are paused for {breaker.retry_in:.0f} more seconds."
+
+    # WML payloads are structured such that multiple mini-batches of data to scored can be passed,
+    # each as a list of lists (i.e. a matrix) passed under input_data.values:
+    payload = scoring_helpers.encode_scoring_payload(df)
+    # latencies are tracked per deployment and order of magnitude of the batch size
+    tracker = resilience.get_tracker((deployment_id, len(df).bit_length()))
+    r = resilience.hedged_call(
+        lambda: _request('POST', deployment_details['entity']['status']['serving_urls'][0],
+                                 headers=headers,
+                                 data=payload,
+                                 params={"version": "2021-01-01"}),
+        tracker, is_success=lambda r: r.ok)
+
+    # client errors (e.g. invalid payloads, or an exhausted page budget) do not mean the deployment is unhealthy
+    if r.status_code >= 500 or r.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    if r.ok:
+        return scoring_helpers.decode_predictions(scoring_helpers.decode_json(r.content)), ""
+    else:
+        print(r.text)
+        return None, r.text
+
+
+def score_dataframe(headers, deployment_details, df, batch_size=1000, max_workers=4, local_model=None):
+    """Scores a DataFrame of any size by splitting it in batches scored concurrently with score_batch().
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        deployment_details (dict): Deployment details obtained from get_deployment_details()
+        df (pd.DataFrame): Input data to predict, e.g. prepared with InputSchema.apply().
+        batch_size (int): Number of rows per scoring request. Defaults to 1000.
+        max_workers (int): Maximum number of concurrent scoring requests. Defaults to 4.
+        local_model (LocalModel): In-process model obtained from get_local_model(). Defaults to None.
+    Returns:
+        result (ScoringResult): Predictions for every row of df, None if any of the requests failed.
+        error_msg (str): The text response from the first failing request.
+    """
+    if local_model is not None:
+        # no network round trips to amortize: score everything at once
+        return score_batch(headers, deployment_details, df, local_model)
+    batches = [df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size)]
+    if not batches:
+        return scoring_helpers.decode_predictions({'predictions': [{'values': []}]}), ""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # batches are scored within the time budget of the calling page
+        score = resilience.bind_deadline(lambda batch: score_batch(headers, deployment_details, batch))
+        outputs = list(executor.map(score, batches))
+    for result, error_msg in outputs:
+        if result is None:
+            return None, error_msg
+    return scoring_helpers.concat_results(result for result, _ in outputs), ""
+
+
+@cached(ttl=DATA_TTL)
+def compute_partial_dependence(headers, deployment_details, df, feature, grid, n_samples=200, seed=0):
+    """Computes Individual Conditional Expectation (ICE) curves and the Partial Dependence (PD) curve
+    of a deployed model for one feature: n_samples rows are sampled from df, each row is scored once per
+    grid value, and the PD curve is the average of the ICE curves.
+    All variants are scored with concurrent batched requests, and results are cached per deployment,
+    dataset fingerprint, feature, grid and sample seed.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        deployment_details (dict): Deployment details obtained from get_deployment_details()
+        df (pd.DataFrame): Input data to sample rows from, prepared with InputSchema.apply() if needed.
+        feature (str): The feature to compute curves for.
+        grid (tuple): The values taken by that feature.
+        n_samples (int): Number of ICE curves. Defaults to 200.
+        seed (int): Seed used to sample rows. Defaults to 0.
+    Returns:
+        ice (np.ndarray): (n_samples, len(grid)) array of scores, None if any of the requests failed.
+        pd_curve (np.ndarray): The partial dependence, i.e. the average score for each grid value.
+        error_msg (str): The text response from the first failing request.
+    """
+    sample = df.sample(min(int(n_samples), len(df)), random_state=seed)
+    variants = scoring_helpers.make_ice_frame(sample, feature, grid)
+    result, error_msg = score_dataframe(headers, deployment_details, variants)
+    if result is None:
+        return None, None, error_msg
+    ice = scoring_helpers.positive_scores(result).reshape(len(grid), len(sample)).T
+    return ice, ice.mean(axis=0), ""
+
+
+@cached(ttl=DATA_TTL)
+def score_dataset(headers, deployment_details, model_details, df, local_model=None):
+    """Scores every row of a dataset with score_dataframe(), after preparing it with the model input schema.
+    Results are cached per deployment, model and dataset fingerprint.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        deployment_details (dict): Deployment details obtained from get_deployment_details()
+        model_details (dict): Model/Function details obtained from get_deployment_details()
+        df (pd.DataFrame): The dataset to score.
+        local_model (LocalModel): In-process model obtained from get_local_model(). Defaults to None.
+    Returns:
+        scores (np.ndarray): One score per row, see scoring_helpers.positive_scores(). None if any of the requests failed.
+        classes (np.ndarray): The predicted class of every row. None if any of the requests failed.
+        error_msg (str): The text response from the first failing request.
+    """
+    input_schema = scoring_helpers.compile_input_schema(model_details)
+    if input_schema is not None:
+        df, _ = input_schema.apply(df)
+    result, error_msg = score_dataframe(headers, deployment_details, df, local_model=local_model)
+    if result is None:
+        return None, None, error_msg
+    return scoring_helpers.positive_scores(result), result.classes, ""
+
+
 # @st.cache(suppress_st_warning=True)
-def get_deployment_prediction(headers, deployment_details, payload, precision=2):
+def get_deployment_prediction(headers, deployment_details, payload, precision=2, local_model=None):
     """Calls the synchronous deployment prediction endpoint of Cloud Pak for Data as a Service,
     checking the input schema if provided by model_details.
 
@@ -265,37 +1000,20 @@ def get_deployment_prediction(headers, deployment_details, payload, precision=2)
         model_details (dict): Model/Function details obtained from get_deployment_details()
         payload (dict): Input data to predict, in {feature_name: value} format.
         precision (int): Number of floating points to round the predicted probability to. Defaults to 2.
+        local_model (LocalModel): In-process model obtained from get_local_model(). Defaults to None.
     """
     if not deployment_details.get('entity'):
         return
 
-    # WML payloads are structured such that multiple mini-batches of data to scored can be passed,
-    # each as a list of lists (i.e. a matrix) passed under input_data.values:
-    prepared_payload = {
-        "input_data": [{
-            "fields": list(payload.keys()),
-            "values": [list(payload.values())]}]
-    }
-    r = requests.post(deployment_details['entity']['status']['serving_urls'][0],
-                      headers=headers,
-                      json=prepared_payload,
-                      params={"version": "2021-01-01"}
-    )
+    result, error_msg = score_batch(headers, deployment_details, pd.DataFrame([payload]), local_model)
+    if result is None:
+        return (None, None), error_msg
+    # probability of the predicted class, as for binary classification cases
+    proba, class_pred = result.scores.tolist()[0], result.classes.tolist()[0]
+    return (round(proba, precision), class_pred), ""
 
-    if r.ok:
-        # note here we are hardcoding prediction parsing for binary classification cases
-        preds = r.json()
-        proba = preds['predictions'][0]['values'][0][-1]
-        if isinstance(proba, list):
-            proba = max(proba)
-        class_pred = preds['predictions'][0]['values'][0][-2]
-        return (round(proba, precision), class_pred), ""
-    else:
-        print(r.text)
-        return (None, None), r.text
 
-
-@st.cache(suppress_st_warning=True)
+@cached(ttl=METADATA_TTL)
 def list_jobs(headers, project_id):
     """Calls the jobs list endpoint of Cloud Pak for Data as a Service,
     and returns a list of jobs if successful.
@@ -308,9 +1026,9 @@ def list_jobs(headers, project_id):
         jobs (list): A list of (job_name, job_id) tuples.
         error_msg (str): The text response from the request if the request failed.
     """
-    r = requests.get(f"{CPD_URL}/v2/jobs",
-                     headers=headers,
-                     params={"project_id": project_id}
+    r = _request('GET', f"{CPD_URL}/v2/jobs",
+                        headers=headers,
+                        params={"project_id": project_id}
     )
     if r.ok:
         jobs = r.json()['results']
@@ -338,6 +1056,7 @@ def trigger_job(headers, project_id, job_id, env_variables):
         jobrun_details (dict): Dictionary containing details of the jobrun triggered.
         error_msg (str): The text response from the request if the request failed.
     """
+    env_variables = [f"{key}={value}" for key, value in env_variables.items() if key != ""]
     jobrun_config = {
         "job_run": {
             "configuration": {
@@ -345,12 +1064,11 @@ def trigger_job(headers, project_id, job_id, env_variables):
             }
         }
     }
-    env_variables = [f"{key}={value}" for key, value in env_variables.items() if key != ""]
-    r = requests.post(f"{CPD_URL}/v2/jobs/{job_id}/runs",
-                        headers=headers,
-                        json=jobrun_config,
-                        params={'project_id': project_id}
-                        )
+    r = _request('POST', f"{CPD_URL}/v2/jobs/{job_id}/runs",
+                           headers=headers,
+                           json=jobrun_config,
+                           params={'project_id': project_id}
+                           )
     if r.ok:
         jobrun_info = r.json()
         # jobrun_id = jobrun_info['metadata']['asset_id']
@@ -358,3 +1076,135 @@ def trigger_job(headers, project_id, job_id, env_variables):
     else:
         print(r.text)
         return dict(), r.text
+
+
+def get_job_run_state(headers, project_id, job_id, run_id):
+    """Calls the jobrun details endpoint of Cloud Pak for Data as a Service,
+    and returns the state of a jobrun if successful.
+    See https://cloud.ibm.com/apidocs/watson-data-api#job-runs-get.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): Project where the job lives.
+        job_id (str): Id of the job.
+        run_id (str): Id of the jobrun, in the metadata of the details returned by trigger_job().
+    Returns:
+        state (str): State of the jobrun, e.g. "Queued", "Running", "Completed", "Failed" or "Canceled".
+            None if the request failed.
+        error_msg (str): The text response from the request if the request failed.
+    """
+    r = _request('GET', f"{CPD_URL}/v2/jobs/{job_id}/runs/{run_id}",
+                        headers=headers,
+                        params={'project_id': project_id}
+    )
+    if r.ok:
+        return r.json()['entity']['job_run']['state'], ""
+    else:
+        print(r.text)
+        return None, r.text
+
+
+def find_data_asset(headers, project_id, name):
+    """Calls the search endpoint of Cloud Pak for Data as a Service, and returns the id
+    of the data asset with a given name in a project, e.g. one written by a job.
+    Not cached, unlike list_datasets(), since it is used to wait for new assets.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): The Watson Studio project id to search in.
+        name (str): Name of the data asset.
+    Returns:
+        dataset_id (str): Id of the data asset, None if there is none or the request failed.
+        error_msg (str): The text response from the request if the request failed.
+    """
+    search_doc = {
+        "query": {
+            "bool": {
+                "must":
+                [
+                    {"match": {"metadata.artifact_type": "data_asset"}},
+                    {"match": {"entity.assets.project_id": project_id}},
+                    {"match": {"metadata.name": name}}
+                ]
+            }
+        }
+    }
+    r = _request('POST', f"{CPD_URL}/v3/search",
+                         headers=headers,
+                         json=search_doc)
+    if r.ok:
+        # the match query is not exact, e.g. it tokenizes names
+        ids = [x['artifact_id'] for x in r.json()['rows'] if x['metadata']['name'] == name]
+        return (ids[0] if ids else None), ""
+    else:
+        print(r.text)
+        return None, r.text
+
+
+def load_json_asset(headers, project_id, dataset_id):
+    """Downloads a data asset holding a JSON document, e.g. results written by a job.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): The Watson Studio project id to search in.
+        dataset_id (str): Id of the data asset.
+    Returns:
+        document: The parsed JSON document, None if any of the HTTP requests fails.
+        error_msg (str): If any of the HTTP requests fails, the text response from the first failing request.
+    """
+    _, attachment_details, error_msg = get_dataset_attachment(headers, project_id, dataset_id)
+    if error_msg != "":
+        return None, error_msg
+    r = _request('GET', attachment_details['url'])
+    if r.ok:
+        return r.json(), ""
+    else:
+        print(r.text)
+        return None, r.text
+
+
+def delete_asset(headers, project_id, asset_id):
+    """Calls the asset deletion endpoint of Cloud Pak for Data as a Service.
+    See https://cloud.ibm.com/apidocs/watson-data-api#deleteasset.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        project_id (str): Project where the asset lives.
+        asset_id (str): Id of the asset to delete.
+    Returns:
+        error_msg (str): The text response from the request if the request failed.
+    """
+    r = _request('DELETE', f"{CPD_URL}/v2/assets/{asset_id}",
+                           headers=headers,
+                           params={'project_id': project_id}
+    )
+    if r.ok:
+        return ""
+    else:
+        print(r.text)
+        return r.text
+
+
+def update_model_custom(headers, model_details, custom):
+    """Calls the model update endpoint of Cloud Pak for Data as a Service to replace
+    the custom metadata of a model, e.g. to store SHAP values with it.
+    See https://cloud.ibm.com/apidocs/machine-learning#models-update.
+
+    Args:
+        headers (dict): Authentication headers obtained with authenticate().
+        model_details (dict): Model details obtained from get_deployment_details()
+        custom (dict): The new custom metadata, which must be JSON serializable.
+    Returns:
+        model_details (dict): The updated model details, empty if the request failed.
+        error_msg (str): The text response from the request if the request failed.
+    """
+    r = _request('PATCH', f"{WML_URL}/ml/v4/models/{model_details['metadata']['id']}",
+                          headers=headers,
+                          json=[{"op": "add", "path": "/custom", "value": custom}],
+                          params={"space_id": model_details['metadata'].get('space_id'), "version": "2021-01-01"}
+    )
+    if r.ok:
+        return r.json(), ""
+    else:
+        print(r.text)
+        return dict(), r.text
@@ -0,0 +1,190 @@
+import os
+import math
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from cache_helpers import LRUCache
+
+PSI_BINS = 10  # PSI is computed over deciles of the reference dataset, as is customary
+KS_BINS = 100  # resolution of the CDFs compared by the KS statistic, in quantiles of each dataset
+PSI_EPSILON = 1e-4  # share given to empty bins, so that the PSI of a missing category stays finite
+PSI_MODERATE, PSI_MAJOR = 0.1, 0.25  # usual thresholds of moderate and major population shifts
+
+# drift reports, keyed by the fingerprints of the (reference, current) datasets and shared by all sessions
+REPORTS = LRUCache(max_entries=int(os.environ.get("DRIFT_CACHE_MAX_ENTRIES", 32)))
+
+
+def psi(expected, actual):
+    """Population Stability Index between two histograms (counts over the same bins)."""
+    p = np.maximum(expected / max(expected.sum(), 1), PSI_EPSILON)
+    q = np.maximum(actual / max(actual.sum(), 1), PSI_EPSILON)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def binned_ks(expected, actual):
+    """Kolmogorov-Smirnov statistic between two histograms over the same ordered bins: the largest gap
+    between their CDFs at the bin edges, i.e. a lower bound of the exact statistic, tight for fine bins.
+    """
+    cdf_p = np.cumsum(expected) / max(expected.sum(), 1)
+    cdf_q = np.cumsum(actual) / max(actual.sum(), 1)
+    return float(np.max(np.abs(cdf_p - cdf_q))) if len(cdf_p) else 0.0
+
+
+def chi_square(expected, actual):
+    """Chi-square test of homogeneity of two histograms (a 2 x k contingency table).
+
+    Returns:
+        chi2 (float): The test statistic.
+        p_value (float): Its p-value, with the Wilson-Hilferty approximation of the chi-square distribution.
+        cramers_v (float): The effect size, between 0 and 1, comparable across features and dataset sizes.
+    """
+    table = np.vstack([expected, actual]).astype(float)
+    table = table[:, table.sum(axis=0) > 0]
+    n, k = table.sum(), table.shape[1]
+    if k < 2 or (table.sum(axis=1) == 0).any():
+        return 0.0, 1.0, 0.0
+    counts = np.outer(table.sum(axis=1), table.sum(axis=0)) / n
+    chi2 = float(np.sum((table - counts) ** 2 / counts))
+    dof = k - 1
+    z = ((chi2 / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return chi2, 0.5 * math.erfc(z / math.sqrt(2)), math.sqrt(chi2 / n)
+
+
+class ColumnBinning:
+    """Maps the values of a column to histogram bins, the last bin counting nulls.
+    Numeric columns are binned by edges, other columns by category, with a bin for values not in categories.
+
+    Args:
+        edges (array): Increasing bin edges of a numeric column, None for a categorical column.
+        categories (list): Categories of a categorical column.
+    """
+
+    def __init__(self, edges=None, categories=None):
+        self.edges, self.categories = edges, categories
+        self.n_bins = (len(edges) + 1 if edges is not None else len(categories) + 1) + 1
+
+    def codes(self, column):
+        if self.edges is not None:
+            values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64)
+            codes = np.searchsorted(self.edges, values, side='right')
+            codes[np.isnan(values)] = self.n_bins - 1
+            return codes
+        codes = pd.Categorical(column, categories=self.categories).codes.astype(np.int64)
+        codes[codes < 0] = len(self.categories)  # values absent from the categories
+        codes[column.isna().to_numpy()] = self.n_bins - 1
+        return codes
+
+
+def histograms(chunks, binnings):
+    """Counts the values of columns per bin, one chunk at a time.
+
+    Args:
+        chunks (iterable): Consecutive DataFrame chunks of a dataset.
+        binnings (dict): {name: (column_name, ColumnBinning)}, a column possibly being binned in several ways.
+    Returns:
+        counts (dict): {name: np.array of counts per bin}
+    """
+    names = list(binnings)
+    offsets = np.concatenate([[0], np.cumsum([binnings[name][1].n_bins for name in names])]).astype(np.int64)
+    total = np.zeros(offsets[-1], dtype=np.int64)
+    for chunk in chunks:
+        # the bins of all columns are counted in a single bincount, each binning in its own range of bins
+        codes = np.concatenate([binning.codes(chunk[column]) + offsets[i]
+                                for i, (column, binning) in enumerate(binnings[name] for name in names)])
+        total += np.bincount(codes, minlength=len(total))
+    return {name: total[offsets[i]:offsets[i + 1]] for i, name in enumerate(names)}
+
+
+def _binning(reference, current):
+    # numeric bins from the quantile sketches of both datasets, categories from their lists of values.
+    # Returns the kind of column, its fine binning (KS bins, or categories) and its PSI binning if different
+    if reference.sketch is not None and current.sketch is not None:
+        q = np.linspace(0, 1, KS_BINS + 1)[1:-1]
+        ks_edges = np.unique(np.concatenate([reference.sketch.quantile(q), current.sketch.quantile(q)]))
+        psi_edges = np.unique(reference.sketch.quantile(np.linspace(0, 1, PSI_BINS + 1)[1:-1]))
+        return "numeric", ColumnBinning(edges=ks_edges), ColumnBinning(edges=psi_edges)
+    if reference.unique_values is not None and current.unique_values is not None:
+        categories = list(dict.fromkeys(reference.unique_values + current.unique_values))
+        return "categorical", ColumnBinning(categories=categories), None
+    return None, None, None
+
+
+def _profile(fingerprint, chunks_fn, columns):
+    # the profile built when the dataset was loaded is reused, and only the columns it lacks are profiled
+    profile = profiling.PROFILES.get(tuple(fingerprint))
+    if profile is None:
+        profile = profiling.DatasetProfile()
+        profiling.store_profile(fingerprint, profile)
+    missing = [c for c in columns if c not in profile.columns]
+    if missing:
+        new_columns = profiling.DatasetProfile()
+        for chunk in chunks_fn(missing):
+            new_columns.update(chunk)
+        profile.columns.update(new_columns.columns)
+        profile.n_rows = new_columns.n_rows
+    return profile
+
+
+def compare(reference, current, columns):
+    """Computes drift statistics of each column between a reference dataset (e.g. training data) and a current
+    one (e.g. recent scoring data), streaming each dataset twice: once to profile it if it was not profiled yet,
+    then once to count values in bins derived from both profiles. Memory use does not grow with the number of rows.
+    - numeric columns: PSI over deciles of the reference, and the KS statistic over quantile bins of both datasets
+    - other columns: PSI and a chi-square test over categories, for columns with at most
+      profiling.MAX_UNIQUE_VALUES distinct values
+
+    Args:
+        reference (tuple): (fingerprint, chunks_fn) of the reference dataset, chunks_fn(columns) returning
+            a new iterator over DataFrame chunks of the given columns.
+        current (tuple): (fingerprint, chunks_fn) of the current dataset.
+        columns (list): Names of the columns to compare, present in both datasets.
+    Returns:
+        report (pd.DataFrame): One row per column, the most drifted first (by PSI).
+    """
+    (ref_fingerprint, ref_chunks), (cur_fingerprint, cur_chunks) = reference, current
+    ref_profile = _profile(ref_fingerprint, ref_chunks, columns)
+    cur_profile = _profile(cur_fingerprint, cur_chunks, columns)
+
+    kinds, binnings = dict(), dict()
+    for c in columns:
+        kinds[c], binning, psi_binning = _binning(ref_profile.columns[c], cur_profile.columns[c])
+        if binning is not None:
+            binnings[(c, "bins")] = (c, binning)
+        if psi_binning is not None:
+            binnings[(c, "psi")] = (c, psi_binning)
+    binned = [c for c in columns if kinds[c] is not None]
+    ref_counts, cur_counts = dict(), dict()
+    if binned:
+        ref_counts = histograms(ref_chunks(binned), binnings)
+        cur_counts = histograms(cur_chunks(binned), binnings)
+
+    rows = list()
+    for c in columns:
+        ref, cur = ref_profile.columns[c], cur_profile.columns[c]
+        row = {"column": c, "type": kinds[c] or "skipped (too many values)", "psi": np.nan, "ks": np.nan,
+               "chi2": np.nan, "p_value": np.nan, "cramers_v": np.nan,
+               "reference_nulls": ref.null_count / max(ref.count, 1),
+               "current_nulls": cur.null_count / max(cur.count, 1)}
+        if kinds[c] == "numeric":
+            row["psi"] = psi(ref_counts[(c, "psi")], cur_counts[(c, "psi")])
+            # nulls (last bin) are left out of the CDFs
+            row["ks"] = binned_ks(ref_counts[(c, "bins")][:-1], cur_counts[(c, "bins")][:-1])
+        elif kinds[c] == "categorical":
+            ref_hist, cur_hist = ref_counts[(c, "bins")], cur_counts[(c, "bins")]
+            row["psi"] = psi(ref_hist, cur_hist)
+            row["chi2"], row["p_value"], row["cramers_v"] = chi_square(ref_hist, cur_hist)
+        rows.append(row)
+
+    report = pd.DataFrame(rows)
+    report["drift"] = np.select([report["psi"] >= PSI_MAJOR, report["psi"] >= PSI_MODERATE],
+                                ["major", "moderate"], "none")
+    report.loc[report["psi"].isna(), "drift"] = ""
+    return report.sort_values("psi", ascending=False, na_position='last').set_index("column")
+
+
+def get_report(reference, current, columns):
+    """Returns the drift report of compare(), computed once per pair of dataset fingerprints and columns."""
+    key = (tuple(reference[0]), tuple(current[0]), tuple(columns))
+    return REPORTS.get_or_compute(key, lambda: compare(reference, current, columns))
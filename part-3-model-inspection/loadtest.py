@@ -0,0 +1,170 @@
+"""Load test harness: simulates concurrent sessions running the pages of the app against mock_backend.py,
+to size replicas and catch performance regressions.
+
+    python loadtest.py --sessions 1 2 4 8 16 --runs 5
+
+Each simulated session runs in its own thread with its own Streamlit script run context and session state,
+as in `streamlit run`, and calls the write() function of every page in turn, once per run. For each number
+of concurrent sessions, the harness reports script run latency percentiles, throughput, the memory held in
+each session state and the resident memory of the process. Sessions authenticate with different API keys,
+i.e. as different users, so that they do not share cached datasets.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from collections import defaultdict
+
+import numpy as np
+from streamlit.script_run_context import ScriptRunContext, add_script_run_ctx
+from streamlit.script_runner import RerunException, StopException
+from streamlit.state.session_state import SessionState
+from streamlit.uploaded_file_manager import UploadedFileManager
+
+import mock_backend
+import resilience
+from cache_helpers import approx_size
+from memory_governor import GOVERNOR, Slot, rss_bytes
+
+
+def _ungoverned_size(value):
+    # size of what a value holds outside of memory governor slots, which are counted separately
+    if isinstance(value, Slot):
+        return 0
+    if isinstance(value, dict):
+        return sum(_ungoverned_size(v) for v in value.values())
+    if isinstance(value, tuple) and any(isinstance(v, Slot) for v in value):
+        return sum(_ungoverned_size(v) for v in value)
+    return approx_size(value)
+
+
+def session_state_bytes(session_id, session_state):
+    """Approximate memory held by the values of a session state (DataFrames, arrays, cached outputs),
+    not counting the values spilled to disk by the memory governor."""
+    total = GOVERNOR.footprint().get(session_id, (0, 0))[0]
+    for key in session_state:
+        try:
+            total += _ungoverned_size(session_state[key])
+        except Exception:
+            continue  # values which cannot be pickled, e.g. widget internals
+    return total
+
+
+class SimulatedSession(threading.Thread):
+    """A user session running each page once per run, with its own script run context.
+
+    Args:
+        session_id (str): Id of the session, also used as its API key.
+        pages (list): (page_name, page_module) tuples, run in order.
+        n_runs (int): Number of runs of every page.
+    """
+
+    def __init__(self, session_id, pages, n_runs):
+        super().__init__(daemon=True)
+        self.session_id, self.pages, self.n_runs = session_id, pages, n_runs
+        self.latencies = defaultdict(list)  # {page_name: [seconds]}
+        self.errors = list()
+        self.bytes_sent = 0
+        self.state_bytes = 0
+
+    def enqueue(self, msg):
+        # messages the app would send to the browser
+        self.bytes_sent += msg.ByteSize()
+
+    def run(self):
+        ctx = ScriptRunContext(self.session_id, self.enqueue, "", SessionState(), UploadedFileManager())
+        add_script_run_ctx(threading.current_thread(), ctx)
+        # what the user would type or click on the first page
+        ctx.session_state['apikey'] = self.session_id
+        ctx.session_state['dataset_picked_flag'] = True
+
+        for _ in range(self.n_runs):
+            for name, page in self.pages:
+                ctx.reset()
+                start = time.perf_counter()
+                try:
+                    with resilience.deadline():
+                        page.write()
+                except (RerunException, StopException):
+                    pass
+                except Exception as e:
+                    self.errors.append(f"{name}: {e!r}")
+                self.latencies[name].append(time.perf_counter() - start)
+        self.state_bytes = session_state_bytes(self.session_id, ctx.session_state)
+
+
+def run_level(n_sessions, pages, n_runs, offset):
+    """Runs n_sessions concurrent sessions until they all finish, and returns their aggregated metrics."""
+    sessions = [SimulatedSession(f"loadtest-{offset + i}", pages, n_runs) for i in range(n_sessions)]
+    start = time.perf_counter()
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([t for s in sessions for ts in s.latencies.values() for t in ts]) * 1000
+    per_page = {name: np.percentile([t for s in sessions for t in s.latencies[name]], 95) * 1000 for name, _ in pages}
+    return {
+        "sessions": n_sessions,
+        "runs": len(latencies),
+        "p50_ms": np.percentile(latencies, 50),
+        "p95_ms": np.percentile(latencies, 95),
+        "p99_ms": np.percentile(latencies, 99),
+        "runs_per_s": len(latencies) / elapsed,
+        "state_mb_per_session": np.mean([s.state_bytes for s in sessions]) / 2**20,
+        "sent_kb_per_run": sum(s.bytes_sent for s in sessions) / max(len(latencies), 1) / 2**10,
+        "rss_mb": rss_bytes() / 2**20,
+        "errors": [e for s in sessions for e in s.errors],
+        "p95_ms_per_page": per_page,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulates concurrent sessions of the app against a mock backend.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Numbers of concurrent sessions to test, in order. Defaults to 1 2 4 8.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs of every page per session. Defaults to 5.")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows of the mock dataset. Defaults to 10000.")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Seconds added to every mock API call. Defaults to 0.05.")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail if the p95 script run latency exceeds this.")
+    parser.add_argument("--max-mb-per-session", type=float, help="Fail if a session state holds more than this.")
+    args = parser.parse_args(argv)
+
+    server, base_url = mock_backend.serve(n_rows=args.rows, latency_s=args.latency)
+    for name in ("CPD_URL", "WML_URL", "IAM_URL"):
+        os.environ[name] = base_url
+    # imported once the endpoints point to the mock backend, since cpd_helpers reads them at import time
+    from pages import data_exploration, model_testing, model_inspection
+    pages = [("Data Exploration", data_exploration), ("Model Testing", model_testing),
+             ("Model Inspection", model_inspection)]
+
+    print(f"{'sessions':>8} {'runs':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'runs/s':>8} "
+          f"{'state MB/session':>16} {'sent KB/run':>11} {'RSS MB':>8} {'errors':>6}")
+    failed, offset = False, 0
+    for n_sessions in args.sessions:
+        m = run_level(n_sessions, pages, args.runs, offset)
+        offset += n_sessions  # new users at every level, so that caches do not hide the cost of new sessions
+        print(f"{m['sessions']:>8} {m['runs']:>6} {m['p50_ms']:>8.0f} {m['p95_ms']:>8.0f} {m['p99_ms']:>8.0f} "
+              f"{m['runs_per_s']:>8.1f} {m['state_mb_per_session']:>16.1f} {m['sent_kb_per_run']:>11.0f} "
+              f"{m['rss_mb']:>8.0f} {len(m['errors']):>6}")
+        for error in sorted(set(m['errors']))[:5]:
+            print(f"    {error}")
+        if args.max_p95_ms is not None and m['p95_ms'] > args.max_p95_ms:
+            print(f"    p95 latency above {args.max_p95_ms} ms, per page: "
+                  + ", ".join(f"{k} {v:.0f} ms" for k, v in m['p95_ms_per_page'].items()))
+            failed = True
+        if args.max_mb_per_session is not None and m['state_mb_per_session'] > args.max_mb_per_session:
+            print(f"    session state above {args.max_mb_per_session} MB")
+            failed = True
+        failed = failed or bool(m['errors'])
+
+    print(f"{server.backend.n_requests} requests served by the mock backend")
+    server.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import os
+import sys
+import time
+import uuid
+import pickle
+import weakref
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.script_run_context import get_script_run_ctx
+
+from cache_helpers import approx_size, reattach_fingerprints
+
+# resident bytes of governed session values, all sessions together, beyond which the least recently used are spilled
+SESSION_MEMORY_MAX_MB = float(os.environ.get("SESSION_MEMORY_MAX_MB", 1024))
+# seconds without access after which a session value is spilled, 0 to disable idle eviction
+SESSION_IDLE_S = float(os.environ.get("SESSION_IDLE_S", 900))
+# resident memory of the process beyond which session values are spilled, 0 to disable
+PROCESS_MEMORY_MAX_MB = float(os.environ.get("PROCESS_MEMORY_MAX_MB", 0))
+# values smaller than this are left in the session state as they are
+GOVERN_MIN_KB = float(os.environ.get("SESSION_GOVERN_MIN_KB", 1024))
+SPILL_DIR = os.environ.get("SESSION_SPILL_DIR")  # defaults to a temporary directory
+CHECK_INTERVAL_S = float(os.environ.get("SESSION_MEMORY_CHECK_S", 30))
+
+DROPPED = object()  # returned by Slot.get() when a value which could not be spilled was dropped
+
+
+def rss_bytes():
+    """Resident memory of this process, in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:  # not Linux: peak rather than current resident memory
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _is_large(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return True
+    return isinstance(value, (tuple, list)) and any(isinstance(v, (pd.DataFrame, np.ndarray)) for v in value)
+
+
+class Slot:
+    """Holds a large value of a session (e.g. its dataset) on behalf of the MemoryGovernor, which may spill it
+    to disk. get() reloads a spilled value transparently. Values must not be modified in place once stored.
+    The spill file is removed with the slot, i.e. when the value is replaced or the session ends.
+
+    Args:
+        governor (MemoryGovernor): The governor tracking the slot.
+        value: The value held.
+        spill (bool): Whether to write the value to disk when evicting it, or drop it (for values that can
+            be computed again, such as section outputs). Defaults to True.
+        shared (bool): Whether the value is shared by all sessions (e.g. columns of a dataset loaded on demand)
+            rather than held by the current one. Shared values are counted under the None session id.
+            Defaults to False.
+    """
+
+    def __init__(self, governor, value, spill=True, shared=False):
+        ctx = get_script_run_ctx()
+        self.session_id = ctx.session_id if ctx is not None and not shared else None
+        self.size = approx_size(value)
+        self.spill = spill
+        self.last_access = time.monotonic()
+        self._governor = governor
+        self._value, self._path, self._dropped = value, None, False
+        self._lock = threading.Lock()
+
+    @property
+    def resident(self):
+        return self._value is not None
+
+    def get(self):
+        """Returns the value, reloading it from disk if it was spilled. DROPPED if it was evicted without spilling."""
+        with self._lock:
+            self.last_access = time.monotonic()
+            if self._dropped:
+                return DROPPED
+            value, reloaded = self._value, False
+            if value is None:
+                with open(self._path, 'rb') as f:
+                    value = reattach_fingerprints(pickle.load(f))
+                self._value, reloaded = value, True
+        if reloaded:
+            self._governor.reloads += 1
+            self._governor.enforce()
+        return value
+
+    def evict(self):
+        """Writes the value to disk (only once, values being immutable) and releases it from memory.
+
+        Returns:
+            freed (int): Approximate number of bytes released.
+        """
+        with self._lock:
+            if self._value is None or self._dropped:
+                return 0
+            if not self.spill:
+                self._dropped = True
+            elif self._path is None:
+                path = os.path.join(self._governor.spill_dir, f"{uuid.uuid4().hex}.pkl")
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(self._value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+                self._path = path
+                weakref.finalize(self, _remove, path)
+            self._value = None
+            return self.size
+
+
+class MemoryGovernor:
+    """Bounds the memory held by session states: the large values of all sessions (datasets, derived frames)
+    are tracked in Slots, and the least recently used ones are spilled to disk when their total exceeds
+    max_bytes or the process exceeds max_rss_bytes, as are values left untouched for idle_s seconds
+    (e.g. in abandoned browser tabs). Checks run whenever a value is stored or reloaded, and every
+    check_interval_s seconds in a background thread.
+    Values also held elsewhere are only freed once released from there as well, which is why full datasets
+    are not kept by the in-memory layer of cached() (see cpd_helpers.load_dataset()).
+
+    Args:
+        max_bytes (int): Resident bytes of governed values, all sessions together.
+        idle_s (float): Seconds without access before a value is spilled, 0 to disable.
+        max_rss_bytes (int): Resident memory of the process triggering spills, 0 to disable.
+        spill_dir (str): Directory of the spill files. Defaults to a new temporary directory.
+        check_interval_s (float): Seconds between background checks. Defaults to CHECK_INTERVAL_S.
+    """
+
+    def __init__(self, max_bytes, idle_s, max_rss_bytes=0, spill_dir=None, check_interval_s=CHECK_INTERVAL_S):
+        self.max_bytes, self.idle_s, self.max_rss_bytes = max_bytes, idle_s, max_rss_bytes
+        self.check_interval_s = check_interval_s
+        self._spill_root, self._spill_dir = spill_dir, None
+        self._slots = weakref.WeakSet()  # slots disappear with the session states holding them
+        self._lock = threading.Lock()
+        self._thread = None
+        self.spills, self.reloads = 0, 0
+
+    @property
+    def spill_dir(self):
+        with self._lock:
+            if self._spill_dir is None:
+                if self._spill_root is not None:
+                    # one directory per process, since processes (e.g. replicas on a shared volume) remove their own files
+                    self._spill_dir = os.path.join(self._spill_root, str(os.getpid()))
+                    os.makedirs(self._spill_dir, exist_ok=True)
+                else:
+                    self._spill_dir = tempfile.mkdtemp(prefix="session-spill-")
+            return self._spill_dir
+
+    def track(self, value, spill=True, shared=False):
+        """Returns a Slot holding value, counted against the limits from now on."""
+        slot = Slot(self, value, spill, shared)
+        with self._lock:
+            self._slots.add(slot)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="memory-governor")
+                self._thread.start()
+        self.enforce()
+        return slot
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_interval_s)
+            try:
+                self.enforce()
+            except Exception as e:  # e.g. a full disk: keep governing, and try again at the next check
+                print(f"Memory governor check failed: {e!r}")
+
+    def _resident(self):
+        with self._lock:
+            slots = [s for s in self._slots if s.resident]
+        slots.sort(key=lambda s: s.last_access)
+        return slots
+
+    def enforce(self):
+        """Spills idle values, then the least recently used ones until the limits are met."""
+        slots = self._resident()
+        now = time.monotonic()
+        if self.idle_s > 0:
+            for slot in [s for s in slots if now - s.last_access > self.idle_s]:
+                self.spills += slot.evict() > 0
+            slots = [s for s in slots if s.resident]
+
+        # frames shared by several sessions (e.g. the same cached dataset) are only counted once
+        total = sum(dict((id(s._value), s.size) for s in slots if s._value is not None).values())
+        excess = max(total - self.max_bytes, 0)
+        if self.max_rss_bytes > 0:
+            excess = max(excess, rss_bytes() - self.max_rss_bytes)
+        # the most recently used value is kept: it belongs to the run which is using it
+        for slot in slots[:-1]:
+            if excess <= 0:
+                break
+            freed = slot.evict()
+            self.spills += freed > 0
+            excess -= freed
+
+    def footprint(self):
+        """Governed bytes per session, as a {session_id: (resident_bytes, spilled_bytes)} dictionary.
+        Values shared by all sessions are counted under None."""
+        with self._lock:
+            slots = list(self._slots)
+        footprint = dict()
+        for slot in slots:
+            resident, spilled = footprint.get(slot.session_id, (0, 0))
+            if slot.resident:
+                resident += slot.size
+            elif slot.spill:
+                spilled += slot.size
+            footprint[slot.session_id] = (resident, spilled)
+        return footprint
+
+
+GOVERNOR = MemoryGovernor(max_bytes=SESSION_MEMORY_MAX_MB * 2**20, idle_s=SESSION_IDLE_S,
+                          max_rss_bytes=PROCESS_MEMORY_MAX_MB * 2**20, spill_dir=SPILL_DIR)
+
+
+def govern(value, spill=True, shared=False):
+    """Returns value ready to be kept in a session state: wrapped in a Slot of GOVERNOR if it is large
+    (DataFrames, Series and arrays, or tuples holding them, of at least GOVERN_MIN_KB), as is otherwise.
+    Read it back with resolve().
+
+    Args:
+        value: The value to keep.
+        spill (bool): Whether to spill the value to disk under memory pressure, rather than drop it.
+            Defaults to True.
+        shared (bool): Whether the value is shared by all sessions rather than held by the current one,
+            see Slot. Defaults to False.
+    Returns:
+        A Slot, or value itself.
+    """
+    if _is_large(value) and approx_size(value) >= GOVERN_MIN_KB * 2**10:
+        return GOVERNOR.track(value, spill, shared)
+    return value
+
+
+def resolve(value):
+    """Returns the value kept by govern(), reloaded from disk if it was spilled, DROPPED if it was dropped."""
+    return value.get() if isinstance(value, Slot) else value
+
+
+def set_session_value(name, value):
+    """Stores a (possibly large) value in the session state of the current session, see govern()."""
+    st.session_state[name] = govern(value)
+
+
+def get_session_value(name, default=None):
+    """Returns a value stored with set_session_value(), reloaded from disk if it was spilled."""
+    value = resolve(st.session_state.get(name, default))
+    return default if value is DROPPED else value
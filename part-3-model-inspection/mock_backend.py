@@ -0,0 +1,209 @@
+"""A local stand-in for the IBM Cloud endpoints used by the app (IAM, projects, data assets, spaces,
+deployments, scoring and jobs), serving a synthetic dataset and a mock binary classifier.
+Used by loadtest.py, and to run the app offline:
+
+    python mock_backend.py --port 8765
+    CPD_URL=http://localhost:8765 WML_URL=http://localhost:8765 IAM_URL=http://localhost:8765 streamlit run app.py
+"""
+import re
+import json
+import time
+import base64
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+FEATURES = ["ExternalRiskEstimate", "MSinceOldestTradeOpen", "AverageMInFile", "NumSatisfactoryTrades",
+            "PercentTradesNeverDelq", "NetFractionRevolvingBurden"]
+LABEL = "RiskPerformance"
+MODIFIED_AT = "2021-01-01T00:00:00.000Z"
+
+
+def make_dataset(n_rows, seed=0):
+    """Synthetic credit risk dataset with numeric features and a Good/Bad label."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(50, 15, size=(n_rows, len(FEATURES))).round(1), columns=FEATURES)
+    df[LABEL] = np.where(rng.random(n_rows) < _probabilities(df), "Bad", "Good")
+    return df
+
+
+def _probabilities(df):
+    # probability of "Bad" of the mock model, a logistic function of the features
+    z = (df[FEATURES].to_numpy(dtype=float) - 50).mean(axis=1) / 5
+    return 1 / (1 + np.exp(-z))
+
+
+def _fake_token(apikey):
+    # unsigned JWT carrying the claims cpd_helpers reads, one identity per API key
+    def encode(claims):
+        return base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return ".".join([encode({"alg": "none"}), encode({"iam_id": f"IBMid-{apikey}", "account": {"bss": "mock"}}), ""])
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Routes requests to the handle_* methods of the server's MockBackend."""
+
+    def do_GET(self):
+        self.server.backend.dispatch(self, "GET")
+
+    def do_POST(self):
+        self.server.backend.dispatch(self, "POST")
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown the load test output
+
+
+class MockBackend:
+    """Serves the mock endpoints.
+
+    Args:
+        base_url (str): Url the server is reachable at, used in signed urls and serving urls.
+        n_rows (int): Number of rows of the synthetic dataset. Defaults to 10000.
+        latency_s (float): Delay added to every API call (not file downloads), in seconds. Defaults to 0.
+    """
+
+    def __init__(self, base_url, n_rows=10000, latency_s=0.0):
+        self.base_url = base_url
+        self.latency_s = latency_s
+        self.dataset = make_dataset(n_rows).to_csv(index=False).encode()
+        self.n_requests = 0
+        self._lock = threading.Lock()
+        self.routes = [
+            ("POST", r"/identity/token", self.handle_token),
+            ("GET", r"/v2/projects", lambda h, m: {"resources": [
+                {"entity": {"name": "Mock project"}, "metadata": {"guid": "project-1"}}]}),
+            ("POST", r"/v3/search", lambda h, m: {"rows": [
+                {"metadata": {"name": "mock_dataset.csv"}, "artifact_id": "dataset-1"}]}),
+            ("GET", r"/v2/data_assets/(?P<id>[^/]+)", self.handle_data_asset),
+            ("GET", r"/v2/assets/(?P<id>[^/]+)/attachments/(?P<attachment_id>[^/]+)",
+             lambda h, m: {"url": f"{self.base_url}/files/mock_dataset.csv"}),
+            ("GET", r"/files/mock_dataset.csv", self.handle_file),
+            ("GET", r"/v2/spaces", lambda h, m: {"resources": [
+                {"entity": {"name": "Mock space"}, "metadata": {"id": "space-1"}}]}),
+            ("GET", r"/ml/v4/deployments", lambda h, m: {"resources": [
+                {"entity": {"name": "Mock deployment"}, "metadata": {"id": "deployment-1"}}]}),
+            ("GET", r"/ml/v4/deployments/(?P<id>[^/]+)", self.handle_deployment),
+            ("POST", r"/ml/v4/deployments/(?P<id>[^/]+)/predictions", self.handle_predictions),
+            ("GET", r"/ml/v4/models/(?P<id>[^/]+)", self.handle_model),
+            ("GET", r"/v2/jobs", lambda h, m: {"results": []}),
+        ]
+
+    def dispatch(self, handler, method):
+        with self._lock:
+            self.n_requests += 1
+        path = urlparse(handler.path).path
+        for route_method, pattern, handle in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                if handle != self.handle_file and self.latency_s > 0:
+                    time.sleep(self.latency_s)
+                body = handle(handler, match)
+                if body is not None:
+                    self.send_json(handler, body)
+                return
+        self.send_json(handler, {"errors": [{"message": f"No mock route for {method} {path}"}]}, status=404)
+
+    @staticmethod
+    def send_json(handler, body, status=200):
+        content = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(content)))
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    @staticmethod
+    def read_body(handler):
+        return handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+
+    def handle_token(self, handler, match):
+        form = parse_qs(self.read_body(handler).decode())
+        return {"access_token": _fake_token(form.get("apikey", ["anonymous"])[0])}
+
+    def handle_data_asset(self, handler, match):
+        return {
+            "metadata": {"name": "mock_dataset.csv", "usage": {"last_updated_at": MODIFIED_AT}},
+            "entity": {"data_asset": {"mime_type": "text/csv"}},
+            "attachments": [{"id": "attachment-1"}],
+        }
+
+    def handle_file(self, handler, match):
+        # supports single range requests, as signed urls of data asset attachments do
+        data, status, headers = self.dataset, 200, dict()
+        range_match = re.fullmatch(r"bytes=(\d+)-(\d*)", handler.headers.get("Range", ""))
+        if range_match:
+            start = int(range_match.group(1))
+            end = min(int(range_match.group(2) or len(data) - 1), len(data) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            data, status = data[start:end + 1], 206
+        handler.send_response(status)
+        handler.send_header("Content-Type", "text/csv")
+        handler.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def handle_deployment(self, handler, match):
+        return {
+            "metadata": {"id": match.group("id"), "modified_at": MODIFIED_AT},
+            "entity": {
+                "name": "Mock deployment",
+                "asset": {"id": "model-1"},
+                "deployed_asset_type": "model",
+                "status": {"serving_urls": [f"{self.base_url}/ml/v4/deployments/{match.group('id')}/predictions"]},
+            },
+        }
+
+    def handle_model(self, handler, match):
+        return {
+            "metadata": {"id": match.group("id"), "modified_at": MODIFIED_AT, "space_id": "space-1"},
+            "entity": {
+                "type": "mock_1.0",
+                "schemas": {"input": [{"fields": [{"name": f, "type": "double"} for f in FEATURES]}]},
+            },
+        }
+
+    def handle_predictions(self, handler, match):
+        input_data = json.loads(self.read_body(handler))["input_data"][0]
+        df = pd.DataFrame(input_data["values"], columns=input_data["fields"]).reindex(columns=FEATURES).fillna(50)
+        p_bad = _probabilities(df)
+        values = [["Bad" if p > 0.5 else "Good", [p, 1 - p]] for p in p_bad.tolist()]
+        return {"predictions": [{"fields": ["prediction", "probability"], "values": values}]}
+
+
+def serve(port=0, n_rows=10000, latency_s=0.0):
+    """Starts the mock backend in a background thread.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port. Defaults to 0.
+        n_rows (int): Number of rows of the synthetic dataset. Defaults to 10000.
+        latency_s (float): Delay added to every API call, in seconds. Defaults to 0.
+    Returns:
+        server (ThreadingHTTPServer): The running server, stopped with shutdown().
+        base_url (str): Url to use as CPD_URL, WML_URL and IAM_URL.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.daemon_threads = True
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.backend = MockBackend(base_url, n_rows, latency_s)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves mock IBM Cloud endpoints for the Model Inspection app.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rows", type=int, default=10000, help="Rows of the synthetic dataset. Defaults to 10000.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API call. Defaults to 0.")
+    args = parser.parse_args()
+    server, base_url = serve(args.port, args.rows, args.latency)
+    print(f"Mock backend listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,82 @@
+import streamlit as st
+import plotly.express as px
+
+import cpd_helpers
+import drift
+from cache_helpers import cached_figure
+from sections import section
+from utils import format_tuples
+
+
+def write_drift_report(report, key):
+    st.write("Columns are ranked by Population Stability Index (PSI): below 0.1 the distribution is stable, "
+             "above 0.25 it shifted significantly. KS is the Kolmogorov-Smirnov statistic of numeric columns; "
+             "chi-square tests, p-values and Cramér's V apply to categorical columns.")
+    st.dataframe(report)
+    ranked = report[report["psi"].notna()].head(20)
+    if len(ranked) > 0:
+        fig = cached_figure(key + ('psi_bars',),
+                            lambda: px.bar(ranked.reset_index(), x="column", y="psi", color="drift",
+                                           color_discrete_map={"none": "green", "moderate": "orange", "major": "red"},
+                                           title="PSI of the most drifted columns"))
+        st.plotly_chart(fig)
+
+
+def write():
+    auth_ok, headers = st.session_state.get('auth_ok', False), st.session_state.get('headers')
+    project_id = st.session_state.get('project_id')
+    st.header("Data drift")
+    if not auth_ok or project_id is None:
+        st.warning("Not so fast! Head to the first page to authenticate and pick a project.")
+        return
+
+    datasets, error_msg = section(f"{__name__}.datasets", (headers, project_id),
+                                  lambda: cpd_helpers.list_datasets(headers, project_id), cpd_helpers.METADATA_TTL)
+    if error_msg != "":
+        st.error("The datasets of the project could not be listed. More details below.")
+        with st.expander("Expand to see the error message"):
+            st.write(error_msg)
+        return
+    if len(datasets) < 2:
+        st.warning("Comparing datasets requires at least two datasets in the project.")
+        return
+    _, reference_id = st.selectbox("Reference dataset, e.g. training data", datasets, format_func=format_tuples)
+    _, current_id = st.selectbox("Current dataset, e.g. recent scoring data", datasets, index=1,
+                                 format_func=format_tuples)
+    compare = st.button("Compare datasets")
+    st.session_state['drift_compare_flag'] = st.session_state.get('drift_compare_flag') or compare
+    if not st.session_state['drift_compare_flag']:
+        return
+
+    # datasets are streamed from local copies, so that they never need to fit in memory
+    paths = list()
+    for dataset_id in (reference_id, current_id):
+        path, error_msg = cpd_helpers.download_dataset(headers, project_id, dataset_id)
+        if error_msg != "":
+            st.error("The datasets could not be downloaded. More details below.")
+            with st.expander("Expand to see the error message"):
+                st.write(error_msg)
+            return
+        paths.append(path)
+
+    reference_columns = list(cpd_helpers.load_dataset_sample(paths[0]).columns)
+    current_columns = set(cpd_helpers.load_dataset_sample(paths[1]).columns)
+    common = [c for c in reference_columns if c in current_columns]
+    if not common:
+        st.warning("These datasets have no column in common.")
+        return
+    columns = st.multiselect("Columns to compare", common, default=common)
+    if not columns:
+        return
+
+    reference, current = [(cpd_helpers.get_dataset_fingerprint(path),
+                           lambda cols, path=path: cpd_helpers.iter_dataset_chunks(path, cols)) for path in paths]
+    try:
+        with st.spinner("Comparing the datasets, chunk by chunk..."):
+            report = drift.get_report(reference, current, columns)
+    except Exception as e:
+        st.error("The datasets could not be compared. More details below.")
+        with st.expander("Expand to see the error message"):
+            st.write(str(e))
+        return
+    write_drift_report(report, (tuple(reference[0]), tuple(current[0]), tuple(columns)))
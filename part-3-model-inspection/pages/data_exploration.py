@@ -1,10 +1,14 @@
 import streamlit as st
 import cpd_helpers
+import memory_governor
+import row_filters
 import matplotlib.pyplot as plt
 import plotly.express as px
 import pandas as pd
 import numpy as np
-from utils import format_tuples
+from cache_helpers import cached_figure, get_fingerprint
+from sections import section
+from utils import format_tuples, figure_to_png
 
 
 def write_df_sample(df):
@@ -16,23 +20,45 @@ def write_df_sample(df):
         st.write(df.head(int(n_rows)))
 
 
+def write_column_summary(profile):
+    if profile is None or not profile.columns:
+        st.write("No column has been loaded yet.")
+        return
+    st.write(f"{profile.n_rows} rows. Statistics are computed while loading the dataset, "
+             "medians and distinct counts of large columns are approximate.")
+    st.write(profile.summary())
+
+
+def write_df_preview(headers, project_id, dataset_id):
+    n_rows = st.number_input("Number of rows", min_value=1, max_value=1000, value=5,
+                             help='How many rows to preview.', key='preview_n_rows')
+    sample_strategy = st.radio("How to pick rows", ["Head", "Random Sample"], key='preview_strategy',
+                               help="'Head' only downloads the first bytes of the dataset. 'Random Sample' \
+                                   goes through the whole dataset once, without keeping it in memory.")
+    if st.checkbox("Show preview", key='preview_show'):
+        df, error_msg = cpd_helpers.preview_dataset(headers, project_id, dataset_id, int(n_rows), sample_strategy)
+        if error_msg != "" and len(df) == 0:
+            st.error("The dataset could not be previewed. More details below.")
+            with st.expander("Expand to see the error message"):
+                st.write(error_msg)
+        else:
+            if error_msg != "":
+                # partial preview, e.g. the page ran out of time while sampling
+                st.warning(error_msg)
+            st.write(df)
+
+
 def write_viz_1(df, x_feature, label):
     st.subheader("Univariate distributions per class")
     if len(df) == 0:
         st.warning("The dataset loaded seems empty. Please try again")
         return
-    st.plotly_chart(px.histogram(df, x=x_feature, color=label, marginal='box'))
+    fig = cached_figure((get_fingerprint(df), x_feature, label, 'histogram'),
+                        lambda: px.histogram(df, x=x_feature, color=label, marginal='box'))
+    st.plotly_chart(fig)
 
 
-def write_viz_2(df, x_feature, label):
-    st.subheader("Average default rate per feature bin")
-    st.markdown("This plot shows on the x axis a selected feature binned by quantile, \
-        and on the y axis the average rate of the label's positive class in each bin. \
-        The size of the bins can be selected with the slider below.")
-    if len(df) == 0:
-        st.warning("The dataset loaded seems empty. Please try again")
-        return
-    q_length = st.slider("Quantile size", min_value=0.01, max_value=0.5, step=0.01, value=0.05)
+def make_rate_per_bin_plot(df, x_feature, label, q_length):
     bins = pd.qcut(df[x_feature], np.arange(0, 1.01, q_length), duplicates='drop')
     rate_per_bin = df.groupby(bins)[label].value_counts(normalize=True)
     fig, ax = plt.subplots()
@@ -42,7 +68,58 @@ def write_viz_2(df, x_feature, label):
     plt.xticks(ha='right')
     ax.set_xlabel(f"Bins of feature {x_feature}")
     ax.set_ylabel(f"Average rate of label {label}")
-    st.pyplot(fig)
+    return figure_to_png(fig)
+
+
+def write_viz_2(df, x_feature, label):
+    st.subheader("Average default rate per feature bin")
+    st.markdown("This plot shows on the x axis a selected feature binned by quantile, \
+        and on the y axis the average rate of the label's positive class in each bin. \
+        The size of the bins can be selected with the slider below.")
+    if len(df) == 0:
+        st.warning("The dataset loaded seems empty. Please try again")
+        return
+    q_length = st.slider("Quantile size", min_value=0.01, max_value=0.5, step=0.01, value=0.05)
+    png = cached_figure((get_fingerprint(df), x_feature, label, q_length, 'rate_per_bin'),
+                        lambda: make_rate_per_bin_plot(df, x_feature, label, q_length))
+    st.image(png, use_column_width=True)
+
+
+def write_filter_builder(df_head, profile):
+    """Lets users build row filters, kept in the session state so that other pages (e.g. Model Testing) apply them too.
+
+    Returns:
+        filters (list): The (column, op, value) filters, see row_filters.
+        how (str): row_filters.ALL or row_filters.ANY.
+    """
+    filters = st.session_state.setdefault('row_filters', list())
+    with st.expander("Expand to filter rows"):
+        col1, col2, col3 = st.columns(3)
+        column = col1.selectbox("Column", list(df_head.columns), key='filter_column')
+        options = profile.unique_values(column) if profile is not None else None
+        if pd.api.types.is_numeric_dtype(df_head[column]):
+            op = col2.selectbox("Operator", [">=", "<=", ">", "<", "==", "!="], key='filter_op')
+            median = profile.quantile(column, 0.5) if profile is not None else None
+            value = col3.number_input("Value", value=float(median if median is not None else df_head[column].median()),
+                                      key='filter_value')
+        elif options is not None:
+            op, value = 'in', col3.multiselect("Values", options, key='filter_values')
+        else:
+            # too many distinct values to list them all
+            op = col2.selectbox("Operator", ["==", "!="], key='filter_op_text')
+            value = col3.text_input("Value", key='filter_value_text')
+        if st.button("Add filter"):
+            filters.append(row_filters.normalize((column, op, value)))
+
+        for i, flt in enumerate(filters):
+            col1, col2 = st.columns([4, 1])
+            col1.write(row_filters.format_filter(flt))
+            if col2.button("Remove", key=f"remove_filter_{i}"):
+                filters.pop(i)
+                st.experimental_rerun()
+        how = st.radio("Keep rows matching", [row_filters.ALL, row_filters.ANY], key='row_filters_how',
+                       format_func=lambda h: f"{h} filters")
+    return filters, how
 
 
 def write():
@@ -65,7 +142,8 @@ def write():
             st.write(error_msg)
     else:
         st.success("You are successfully authenticated! Pick a project below.")
-        projects, error_msg = cpd_helpers.list_projects(headers)
+        projects, error_msg = section(f"{__name__}.projects", (headers,), lambda: cpd_helpers.list_projects(headers),
+                                      cpd_helpers.METADATA_TTL)
         if projects:
             _, project_id = st.selectbox("Pick a Watson Studio Project", projects, format_func=format_tuples)
             st.session_state['project_id'] = project_id
@@ -74,37 +152,69 @@ def write():
             st.warning("Oops! Looks like you don't have any project yet. \
                 Check out [Creating a project](https://dataplatform.cloud.ibm.com/docs/content/wsj/getting-started/projects.html?context=cpdaas&audience=wdp)")
 
+    # only set once a dataset can be picked, i.e. not when the project has none
+    dataset_id, load_mode = None, None
     if not auth_ok or (project_id is None):
         st.write("Please authenticate and pick a project first.")
     else:
-        datasets, error_msg = cpd_helpers.list_datasets(headers, project_id)
+        datasets, error_msg = section(f"{__name__}.datasets", (headers, project_id),
+                                      lambda: cpd_helpers.list_datasets(headers, project_id), cpd_helpers.METADATA_TTL)
         if datasets:
             _, dataset_id = st.selectbox("Pick a Dataset to analyze", datasets, format_func=format_tuples)
             st.session_state['dataset_id'] = dataset_id
+            with st.expander("Expand to preview the dataset before loading it"):
+                write_df_preview(headers, project_id, dataset_id)
+            load_mode = st.radio("Loading mode", ["Full dataset", "Columns on demand"],
+                                 help="With 'Columns on demand', the dataset is downloaded once and only the columns \
+                                     used by the charts below are loaded into memory. Recommended for wide datasets.")
             # by default the state of st.button goes back to False on its own, but we want to check if the user every clicked on it:
             load_dataset = st.button("Load Dataset")
             st.session_state['dataset_picked_flag'] = st.session_state.get('dataset_picked_flag') or load_dataset
         else:
             st.warning("Oops! Looks like there are no datasets in your project yet.")
 
-    df = st.session_state.get('df')
-    if auth_ok and st.session_state.get('dataset_picked_flag') and df is None:
-        df, error_msg = cpd_helpers.load_dataset(headers, project_id, dataset_id)
-        st.session_state['df'] = df  # used on other pages
+    df, dataset_path = memory_governor.get_session_value('df'), st.session_state.get('dataset_path')
+    if auth_ok and st.session_state.get('dataset_picked_flag') and df is None and dataset_path is None \
+            and dataset_id is not None:
+        if load_mode == "Columns on demand":
+            dataset_path, error_msg = cpd_helpers.download_dataset(headers, project_id, dataset_id)
+            st.session_state['dataset_path'] = dataset_path  # used on other pages
+        else:
+            df, error_msg = cpd_helpers.load_dataset(headers, project_id, dataset_id)
+            memory_governor.set_session_value('df', df)  # used on other pages, spilled to disk when idle
+        if error_msg != "":
+            st.error("The dataset could not be loaded. More details below.")
+            with st.expander("Expand to see the error message"):
+                st.write(error_msg)
+
+    # in "Columns on demand" mode, only the header and the first rows are loaded at this stage:
+    df_head = df if dataset_path is None else cpd_helpers.load_dataset_sample(dataset_path)
 
     st.header("Dataset preview")
-    if not (auth_ok and st.session_state.get('dataset_picked_flag')):
+    if not (auth_ok and st.session_state.get('dataset_picked_flag')) or df_head is None:
         st.write("Please authenticate and load a dataset first.")
     else:
-        write_df_sample(df)
+        write_df_sample(df_head)
+        with st.expander("Expand to see column statistics"):
+            write_column_summary(cpd_helpers.get_session_profile())
 
     st.header("Visualizations")
-    if not (auth_ok and st.session_state.get('dataset_picked_flag')):
+    if not (auth_ok and st.session_state.get('dataset_picked_flag')) or df_head is None:
         st.write("Please authenticate and load a dataset first.")
     else:
-        label = st.selectbox("Label column", list(df.columns))
-        features = [c for c in df.columns if c != label]
+        label = st.selectbox("Label column", list(df_head.columns))
+        features = [c for c in df_head.columns if c != label]
         x_feature = st.selectbox("Feature (X axis)", features)
 
+        df = cpd_helpers.get_session_dataset([x_feature, label])
+        filters, how = write_filter_builder(df_head, cpd_helpers.get_session_profile())
+        if filters:
+            try:
+                mask = cpd_helpers.get_session_mask(filters, how)
+            except Exception as e:  # e.g. comparing text with a number
+                st.error(f"The filters could not be applied: {e}")
+            else:
+                df = row_filters.apply_mask(df, mask, row_filters.describe(filters, how))
+                st.write(f"{len(df)} out of {len(mask)} rows match the filters.")
         write_viz_1(df, x_feature, label)
         write_viz_2(df, x_feature, label)
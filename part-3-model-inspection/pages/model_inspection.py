@@ -1,11 +1,20 @@
+import time
+
 import streamlit as st
 import matplotlib.pyplot as plt
 import shap
 
 import numpy as np
+import pandas as pd
 
 import cpd_helpers
-from utils import format_tuples, make_basic_roc_curve, make_advanced_roc_curve, format_autoai_results
+import shap_jobs
+import scoring_helpers
+import score_store
+from cache_helpers import cached_figure, get_fingerprint
+from sections import section
+from utils import format_tuples, make_basic_roc_curve, make_advanced_roc_curve, format_autoai_results, figure_to_png, \
+    make_pdp_ice_plot, make_pr_curve, compute_binary_curves, decimate_curve
 
 
 def write_shap_job_select(headers, model_details):
@@ -24,12 +33,66 @@ def write_shap_job_select(headers, model_details):
             key = col1.text_input("", placeholder=f"KEY{i+1}", key=f"key_{i}")
             value = col2.text_input("", placeholder=f"VALUE{i+1}", key=f"value_{i}")
             env_vars[key] = value
-        env_vars['MODEL_ID'] = model_details['metadata']['id']
-        st.button("Trigger job", on_click=cpd_helpers.trigger_job, args=(headers, project_id, job_id, env_vars))
+        n_shards = st.number_input("Number of parallel job runs", min_value=1, max_value=64, value=1, step=1,
+                                   help="With several job runs, each one explains a range of rows of the dataset, \
+                                       and their results are merged once all of them completed.")
+        if n_shards == 1:
+            env_vars['MODEL_ID'] = model_details['metadata']['id']
+            st.button("Trigger job", on_click=cpd_helpers.trigger_job, args=(headers, project_id, job_id, env_vars))
+        else:
+            write_sharded_shap_job(headers, project_id, job_id, model_details, int(n_shards), env_vars)
     else:
         st.warning("Oops! Looks like there are no jobs in your project yet.")
 
 
+def write_sharded_shap_job(headers, project_id, job_id, model_details, n_shards, env_vars):
+    profile = cpd_helpers.get_session_profile()
+    n_rows = profile.n_rows if profile is not None and profile.n_rows > 0 else shap_jobs.MAX_ROWS
+    n_rows = st.number_input("Number of rows to explain", min_value=1, max_value=shap_jobs.MAX_ROWS, step=1,
+                             value=min(n_rows, shap_jobs.MAX_ROWS),
+                             help="Rows 0 to this number minus one of the dataset are split between job runs. \
+                                 SHAP values are stored with the model, whose metadata is limited in size.")
+    # the job reads the dataset by name
+    dataset_names = {dataset_id: name for name, dataset_id in cpd_helpers.list_datasets(headers, project_id)[0]}
+    dataset_name = dataset_names.get(st.session_state.get('dataset_id'))
+    if dataset_name is not None:
+        env_vars.setdefault('DATASET_NAME', dataset_name)
+
+    model_id = model_details['metadata']['id']
+    job = shap_jobs.get_shap_job(model_id)
+    if job is None or not job.is_alive():
+        if st.button("Trigger jobs"):
+            job = shap_jobs.start_shap_job(headers, project_id, job_id, model_details, int(n_rows), n_shards,
+                                           {k: v for k, v in env_vars.items() if k != ""})
+    if job is None:
+        return
+    st.write(f"{job.state}: {len(job.shards)} job runs started {time.ctime(job.started_at)}.")
+    st.table(pd.DataFrame(job.shards).set_index("index"))
+    if job.is_alive():
+        st.button("Refresh", help="Check the progress of the job runs.")
+    elif job.error_msg != "":
+        st.error(job.error_msg)
+    else:
+        st.success("SHAP values were stored with the model. They will be shown here once model details are "
+                   "refreshed, within a few minutes.")
+
+
+def _model_key(model_details):
+    # identifies a model revision in caches
+    return (model_details['metadata']['id'], cpd_helpers.get_asset_revision(model_details))
+
+
+def make_shap_beeswarm(precomputed_shap):
+    exp = shap.Explanation(np.array(precomputed_shap['values']),
+                           base_values=precomputed_shap['expected_value'],
+                           feature_names=precomputed_shap['feature_names'],
+                           data=np.array(precomputed_shap['data'])
+                           )
+    fig, _ = plt.subplots(figsize=(10, 10))
+    shap.plots.beeswarm(exp, show=False)
+    return figure_to_png(fig)
+
+
 def write_shap_plots(headers, model_details):
     st.markdown("""
     ### Inspect your model's SHAP values
@@ -42,14 +105,119 @@ def write_shap_plots(headers, model_details):
             write_shap_job_select(headers, model_details)
             return
 
-    exp = shap.Explanation(np.array(precomputed_shap['values']),
-                           base_values=precomputed_shap['expected_value'],
-                           feature_names=precomputed_shap['feature_names'],
-                           data=np.array(precomputed_shap['data'])
-                           )
-    fig, _ = plt.subplots(figsize=(10, 10))
-    shap.plots.beeswarm(exp, show=False)
-    st.write(fig)
+    png = cached_figure(_model_key(model_details) + ('shap_beeswarm',),
+                        lambda: make_shap_beeswarm(precomputed_shap))
+    st.image(png, use_column_width=True)
+
+
+def write_partial_dependence(headers, deployment_details, model_details):
+    st.markdown("""
+    ### Partial Dependence and ICE curves
+    Rows sampled from the dataset loaded on the first page are scored for a grid of values of the selected feature.
+    Each thin line (ICE curve) shows how the prediction for one row changes with that feature,
+    and the thick line (Partial Dependence) is their average.
+    """)
+    df = cpd_helpers.get_session_model_dataset(model_details)
+    if df is None or len(df) == 0:
+        st.warning("Oops! Looks like you have not loaded a dataset on the first page yet.")
+        return
+
+    input_schema = scoring_helpers.compile_input_schema(model_details)
+    if input_schema is not None:
+        df = section(f"{__name__}.pdp_input", (_model_key(model_details), df), lambda: input_schema.apply(df)[0])
+    numeric_features = [c for c in df.columns if df[c].dtype.kind in 'fi']
+    if not numeric_features:
+        st.info("The model has no numeric input feature.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    feature = col1.selectbox("Feature", numeric_features, key='pdp_feature')
+    n_points = col2.number_input("Number of grid values", min_value=2, max_value=100, value=20, key='pdp_n_points')
+    n_samples = col3.number_input("Number of sampled rows", min_value=1, max_value=10000, value=200, key='pdp_n_samples')
+    if not st.checkbox("Compute curves", key='pdp_compute', help="Scores number of grid values x number of sampled rows variants."):
+        return
+
+    # grid values are read from the quantile sketch of the dataset profile when the feature is numeric there
+    profile = cpd_helpers.get_session_profile()
+    quantiles = profile.quantile(feature, np.linspace(0, 1, int(n_points))) if profile is not None else None
+    if quantiles is not None:
+        grid = tuple(np.unique(quantiles))
+    else:
+        grid = tuple(scoring_helpers.make_grid(df[feature], n_points))
+    ice, pd_curve, error_msg = cpd_helpers.compute_partial_dependence(headers, deployment_details, df, feature, grid,
+                                                                      int(n_samples))
+    if error_msg != "":
+        st.error("An error happened while scoring. More details below.")
+        with st.expander("Expand to see the error message"):
+            st.write(error_msg)
+    else:
+        # the figure depends on the model revision the deployment serves, not only on the deployment
+        inputs = (score_store.deployment_key(deployment_details, model_details), df, feature, grid, int(n_samples))
+        st.plotly_chart(section(f"{__name__}.pdp_plot", inputs, lambda: make_pdp_ice_plot(feature, grid, ice, pd_curve)))
+
+
+def make_binary_curves(labels, positive, classes, scores, predicted):
+    # the predicted classes tell which class scores are the probabilities of; if they cannot,
+    # assume the last class in sorted order, as with scikit-learn models
+    scored = scoring_helpers.scored_class(scoring_helpers.class_votes(predicted, scores, classes))
+    if positive != (classes[-1] if scored is None else scored):
+        scores = 1 - scores
+    curves = compute_binary_curves((labels == positive).to_numpy(), scores)
+    roc_idx = decimate_curve(curves['fpr'], curves['tpr'])
+    pr_idx = decimate_curve(curves['recall'], curves['precision'])
+    return (make_basic_roc_curve(curves['fpr'][roc_idx], curves['tpr'][roc_idx], curves['roc_auc']),
+            make_pr_curve(curves['recall'][pr_idx], curves['precision'][pr_idx], curves['average_precision']))
+
+
+def write_binary_curves(headers, deployment_details, model_details):
+    st.markdown("""
+    ### ROC and Precision-Recall curves
+    Compares the model's scores on the dataset loaded on the first page with a label column.
+    Scores stored from the Model Testing page are reused when available.
+    """)
+    df = cpd_helpers.get_session_model_dataset(model_details)
+    if df is None or len(df) == 0:
+        st.warning("Oops! Looks like you have not loaded a dataset on the first page yet.")
+        return
+
+    col1, col2 = st.columns(2)
+    columns = cpd_helpers.get_session_columns()
+    label = col1.selectbox("Label column", columns, index=len(columns) - 1, key='curves_label')
+    # loaded before reading the profile, which only covers the columns loaded so far
+    labels = cpd_helpers.get_session_dataset([label])[label]
+    profile = cpd_helpers.get_session_profile()
+    classes = profile.unique_values(label) if profile is not None else None
+    if classes is None or len(classes) != 2:
+        st.info("Select a label column with exactly two classes.")
+        return
+    classes = sorted(classes)
+    positive = col2.selectbox("Positive class", classes, index=1, key='curves_positive')
+
+    keys = (score_store.deployment_key(deployment_details, model_details), score_store.dataset_key(get_fingerprint(df)))
+    store = score_store.ScoreStore()
+    n_scored = store.count(*keys)
+    if n_scored == len(df):
+        source = 'stored'
+        stored = section(f"{__name__}.stored_scores", (keys, n_scored), lambda: store.read(*keys, len(df)))
+        scores, predicted = stored['predicted_probability'].to_numpy(), stored['predicted_class'].to_numpy()
+    elif st.checkbox("Score the dataset", key='curves_score', help="Scores all rows of the dataset with the deployment."):
+        source = 'scored'
+        scores, predicted, error_msg = cpd_helpers.score_dataset(headers, deployment_details, model_details, df)
+        if error_msg != "":
+            st.error("An error happened while scoring. More details below.")
+            with st.expander("Expand to see the error message"):
+                st.write(error_msg)
+            return
+    else:
+        return
+
+    roc_fig, pr_fig = section(f"{__name__}.binary_curves", (keys, source, df, label, positive),
+                              lambda: make_binary_curves(labels, positive, classes, scores, predicted))
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(roc_fig)
+    with col2:
+        st.plotly_chart(pr_fig)
 
 
 def write_other_available_results(headers, model_details):
@@ -69,13 +237,17 @@ def write_other_available_results(headers, model_details):
 
     st.markdown("#### ROC curve")
     roc = metrics[0]['context']['binary_classification']['roc_curve'][1]
+    roc_idx = decimate_curve(roc['fpr'], roc['tpr'])
+    roc = {k: np.asarray(roc[k])[roc_idx] for k in ('fpr', 'tpr', 'thresholds')}
 
     col1, col2 = st.columns(2)
     with col1:
-        st.plotly_chart(make_basic_roc_curve(roc['fpr'], roc['tpr']))
+        st.plotly_chart(cached_figure(_model_key(model_details) + ('roc_basic',),
+                                      lambda: make_basic_roc_curve(roc['fpr'], roc['tpr'])))
 
     with col2:
-        st.plotly_chart(make_advanced_roc_curve(roc['fpr'], roc['tpr'], roc['thresholds']))
+        st.plotly_chart(cached_figure(_model_key(model_details) + ('roc_advanced',),
+                                      lambda: make_advanced_roc_curve(roc['fpr'], roc['tpr'], roc['thresholds'])))
 
 
 def write():
@@ -85,10 +257,12 @@ def write():
         st.warning("Not so fast! Head to the first page to authenticate and pick a dataset.")
         return
 
-    spaces, error_msg = cpd_helpers.list_spaces(headers)
+    ttl = cpd_helpers.METADATA_TTL
+    spaces, error_msg = section(f"{__name__}.spaces", (headers,), lambda: cpd_helpers.list_spaces(headers), ttl)
     _, space_id = st.selectbox("Pick a Watson Studio Deployment Space", spaces, format_func=format_tuples)
 
-    deployments, error_msg = cpd_helpers.list_deployments(headers, space_id)
+    deployments, error_msg = section(f"{__name__}.deployments", (headers, space_id),
+                                     lambda: cpd_helpers.list_deployments(headers, space_id), ttl)
     if not deployments:
         st.warning("Oops! Looks like this deployment space is empty.")
         return
@@ -96,11 +270,15 @@ def write():
     _, deployment_id = st.selectbox("Pick a Deployed Model or Function",
                                     deployments, format_func=format_tuples)
 
-    deployment_details, model_details, error_msg = cpd_helpers.get_deployment_details(headers, space_id, deployment_id)
+    deployment_details, model_details, error_msg = section(
+        f"{__name__}.deployment_details", (headers, space_id, deployment_id),
+        lambda: cpd_helpers.get_deployment_details(headers, space_id, deployment_id), ttl)
     if error_msg != "":
         st.error("An error happened while retrieving details. More details below.")
         with st.expander("Expand to see the error message"):
             st.write(error_msg)
     else:
         write_shap_plots(headers, model_details)
+        write_partial_dependence(headers, deployment_details, model_details)
+        write_binary_curves(headers, deployment_details, model_details)
         write_other_available_results(headers, model_details)
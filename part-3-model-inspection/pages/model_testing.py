@@ -1,8 +1,112 @@
 import streamlit as st
 import cpd_helpers
+import resilience
+import row_filters
+import scoring_helpers
+import score_store
+from cache_helpers import get_fingerprint
+from sections import section
+import numpy as np
 import pandas as pd
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
-from utils import format_tuples
+from utils import format_tuples, make_sweep_plot
+
+
+def write_sensitivity_sweep(headers, deployment_details, profile, row, local_model=None):
+    st.markdown("""
+    ## What-if analysis
+    Pick a feature and a range of values: all variants of the row selected above are scored
+    in a single request, and predictions are plotted against the feature values.
+    """)
+    numeric_features = [k for k, v in row.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if not numeric_features:
+        st.info("The row selected has no numeric feature to vary.")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    feature = col1.selectbox("Feature to vary", numeric_features, key='sweep_feature')
+    # default range read from the dataset profile, rather than scanning the column on every rerun
+    column_profile = profile.columns.get(feature) if profile is not None else None
+    low = float(column_profile.min) if column_profile is not None and column_profile.min is not None else float(row[feature])
+    high = float(column_profile.max) if column_profile is not None and column_profile.max is not None else float(row[feature])
+    low = col2.number_input("From", value=low, key='sweep_low')
+    high = col3.number_input("To", value=high, key='sweep_high')
+    n_points = col4.number_input("Number of values", min_value=2, max_value=500, value=50, step=1, key='sweep_n_points')
+
+    sweep_key = (deployment_details['metadata']['id'], tuple(row.items()), feature, low, high, int(n_points))
+    if st.button("Run what-if analysis"):
+        values = np.linspace(low, high, int(n_points))
+        variants = scoring_helpers.make_variants(row, feature, values)
+        result, error_msg = cpd_helpers.score_batch(headers, deployment_details, variants, local_model)
+        st.session_state['sweep'] = (sweep_key, values, result, error_msg)
+
+    previous_key, values, result, error_msg = st.session_state.get('sweep', (None, None, None, ""))
+    if previous_key != sweep_key:
+        return
+    if error_msg != "":
+        st.error("An error happened while scoring the variants. More details below.")
+        with st.expander("Expand to see the error message"):
+            st.write(error_msg)
+    else:
+        st.plotly_chart(make_sweep_plot(feature, values, result))
+
+
+def get_scoring_backend(headers, model_details):
+    # off unless enabled by the operator of the app: loading a model runs code from its artifact
+    if not scoring_helpers.ALLOW_LOCAL_MODELS:
+        return None
+    use_local = st.checkbox("Score in-process when possible", key='local_scoring',
+                            help="Downloads scikit-learn and XGBoost models once and scores them inside this app, \
+                                instead of calling the deployment for every prediction. Loading a model runs code \
+                                from its artifact: only use this with models you trust.")
+    if not use_local:
+        return None
+    local_model, error_msg = cpd_helpers.get_local_model(headers, model_details)
+    if local_model is None:
+        st.info(f"Predictions are computed by the deployment. {error_msg}")
+    return local_model
+
+
+def write_dataset_scores(headers, deployment_details, model_details, df, local_model=None):
+    if len(df) == 0:
+        return None
+    store = score_store.ScoreStore()
+    keys = (score_store.deployment_key(deployment_details, model_details),
+            score_store.dataset_key(get_fingerprint(df)))
+
+    n_scored = store.count(*keys)
+    job = score_store.get_scoring_job(*keys)
+    col1, col2 = st.columns([3, 1])
+    if job is not None and job.is_alive():
+        col1.progress(job.n_done / len(df))
+        col2.button("Refresh", help="Check the progress of the background scoring job.")
+    elif n_scored < len(df):
+        if job is not None and job.error_msg != "":
+            col1.error(f"Scoring stopped after {job.n_done} rows: {job.error_msg}")
+        else:
+            col1.write(f"{n_scored} out of {len(df)} rows have been scored by this deployment.")
+        if col2.button("Score whole dataset", help="Scores all rows in the background. Scores are stored on disk and \
+                reused by later sessions, as long as neither the model nor the dataset change."):
+            input_schema = scoring_helpers.compile_input_schema(model_details)
+            prepared = input_schema.apply(df)[0] if input_schema is not None else df
+            score_store.start_scoring_job(
+                store, *keys, prepared, headers,
+                lambda headers, batch: cpd_helpers.score_batch(headers, deployment_details, batch, local_model))
+            st.experimental_rerun()
+    if n_scored == 0:
+        return None
+    # stored scores are only read again when more rows were scored
+    return section(f"{__name__}.stored_scores", (keys, n_scored), lambda: store.read(*keys, len(df)))
+
+
+def make_grid_options(df, scores, mask=None):
+    df_grid = df if scores is None else pd.concat([df.reset_index(drop=True), scores.reset_index(drop=True)], axis=1)
+    if mask is not None:
+        # rows filtered on the Data Exploration page, filtered after joining scores which are aligned on all rows
+        df_grid = df_grid[mask]
+    gb = GridOptionsBuilder.from_dataframe(df_grid, pre_selected_rows=1)
+    gb.configure_selection('single')
+    return df_grid, gb.build()
 
 
 def write_test_predictions(headers, deployment_details, model_details):
@@ -12,20 +116,38 @@ def write_test_predictions(headers, deployment_details, model_details):
     You can then expand the section below that button to modify the feature
     values and check how your model predictions change.
     """)
-    df = st.session_state.get('df', pd.DataFrame())
-    gb = GridOptionsBuilder.from_dataframe(df, pre_selected_rows=1)
-    gb.configure_selection('single')
-    gridOptions = gb.build()
+    df = cpd_helpers.get_session_model_dataset(model_details)
+    if df is None:
+        df = pd.DataFrame()
+    profile = cpd_helpers.get_session_profile()
+    local_model = get_scoring_backend(headers, model_details)
+    scores = write_dataset_scores(headers, deployment_details, model_details, df, local_model)
+    filters, how = st.session_state.get('row_filters'), st.session_state.get('row_filters_how', row_filters.ALL)
+    mask = None
+    if filters and len(df) > 0:
+        try:
+            mask = cpd_helpers.get_session_mask(filters, how)
+        except Exception as e:
+            st.warning(f"The row filters of the Data Exploration page could not be applied: {e}")
+        else:
+            st.write(f"Showing the {mask.sum()} out of {len(mask)} rows matching the filters of the Data Exploration page.")
+    description = row_filters.describe(filters, how) if mask is not None else None
+    df_grid, gridOptions = section(f"{__name__}.grid", (df, scores, description),
+                                   lambda: make_grid_options(df, scores, mask))
 
     col1, col2 = st.columns(2)
     with col1:
         grid_response = AgGrid(
-            df,
+            df_grid,
             gridOptions=gridOptions,
             theme='streamlit',
             update_mode=GridUpdateMode.SELECTION_CHANGED,  # important
         )
 
+    # stored scores are displayed in the grid, but are not features of the selected row:
+    selected_rows = [{k: v for k, v in row.items() if k not in score_store.SCORE_COLUMNS}
+                     for row in grid_response['selected_rows']]
+
     with col2:
         with st.form("model_predictions"):
             proba, previous_proba = st.session_state.get('proba'), st.session_state.get('previous_proba')
@@ -34,10 +156,11 @@ def write_test_predictions(headers, deployment_details, model_details):
             st.metric("Predicted Class", st.session_state.get('class_pred'))
             submitted = st.form_submit_button("Predict", help="Click here to get predictions for the row selected on the left or the values entered below.")
             with st.expander("Expand to change feature values"):
-                if grid_response['selected_rows']:
-                    payload = cpd_helpers.prepare_input_schema(model_details, grid_response['selected_rows'][0])
+                if selected_rows:
+                    payload = cpd_helpers.prepare_input_schema(model_details, selected_rows[0])
                     if submitted:
-                        (proba, class_pred), error_msg = cpd_helpers.get_deployment_prediction(headers, deployment_details, payload)
+                        (proba, class_pred), error_msg = cpd_helpers.get_deployment_prediction(headers, deployment_details, payload,
+                                                                                               local_model=local_model)
                         # we keep track of the previously predicted probability, in order to show delta changes in the st.metric calls above
                         st.session_state['previous_proba'] = st.session_state.get('proba')
                         st.session_state['proba'] = proba
@@ -46,11 +169,20 @@ def write_test_predictions(headers, deployment_details, model_details):
                         if not isinstance(v, str):
                             payload[k] = st.number_input(k, value=v, key=k)
                         else:
-                            payload[k] = st.multiselect(k, df[k].unique().tolist(), key=k)
+                            options = profile.unique_values(k) if profile is not None else None
+                            if options is None:
+                                # too many distinct values to list them all
+                                payload[k] = st.text_input(k, value=v, key=k)
+                            else:
+                                payload[k] = st.multiselect(k, options, key=k)
                             # pass
                 else:
                     st.write("Select a row on the table on the left to populate this form.")
 
+    if selected_rows:
+        row = cpd_helpers.prepare_input_schema(model_details, selected_rows[0])
+        write_sensitivity_sweep(headers, deployment_details, profile, row, local_model)
+
 
 def write():
     auth_ok, headers = st.session_state.get('auth_ok', False), st.session_state.get('headers')
@@ -59,10 +191,12 @@ def write():
         st.warning("Not so fast! Head to the first page to authenticate and pick a dataset.")
         return
 
-    spaces, error_msg = cpd_helpers.list_spaces(headers)
+    ttl = cpd_helpers.METADATA_TTL
+    spaces, error_msg = section(f"{__name__}.spaces", (headers,), lambda: cpd_helpers.list_spaces(headers), ttl)
     _, space_id = st.selectbox("Pick a Watson Studio Deployment Space", spaces, format_func=format_tuples)
 
-    deployments, error_msg = cpd_helpers.list_deployments(headers, space_id)
+    deployments, error_msg = section(f"{__name__}.deployments", (headers, space_id),
+                                     lambda: cpd_helpers.list_deployments(headers, space_id), ttl)
     if not deployments:
         st.warning("Oops! Looks like this deployment space is empty.")
         return
@@ -70,10 +204,17 @@ def write():
     deployment_name, deployment_id = st.selectbox("Pick a Deployed Model or Function",
                                                   deployments, format_func=format_tuples)
 
-    deployment_details, model_details, error_msg = cpd_helpers.get_deployment_details(headers, space_id, deployment_id)
+    deployment_details, model_details, error_msg = section(
+        f"{__name__}.deployment_details", (headers, space_id, deployment_id),
+        lambda: cpd_helpers.get_deployment_details(headers, space_id, deployment_id), ttl)
     if error_msg != "":
         st.error("An error happened while retrieving details. More details below.")
         with st.expander("Expand to see the error message"):
             st.write(error_msg)
     else:
+        breaker = resilience.get_breaker(deployment_details['metadata']['id'])
+        if breaker.state == breaker.OPEN:
+            st.warning(f"This deployment failed repeatedly: predictions are paused for {breaker.retry_in:.0f} seconds.")
+        elif breaker.state == breaker.HALF_OPEN:
+            st.info("This deployment failed repeatedly: the next prediction will check whether it recovered.")
         write_test_predictions(headers, deployment_details, model_details)
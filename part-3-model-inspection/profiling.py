@@ -0,0 +1,217 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache_helpers import DatasetFingerprint, LRUCache, get_fingerprint
+
+# columns with more distinct values than this get a cardinality estimate but no list of values
+MAX_UNIQUE_VALUES = int(os.environ.get("PROFILE_MAX_UNIQUE_VALUES", 1000))
+QUANTILE_SKETCH_SIZE = int(os.environ.get("PROFILE_QUANTILE_SKETCH_SIZE", 10000))
+HLL_PRECISION = 12  # 4096 registers, i.e. a relative error of about 1.6% on distinct counts
+
+# profiles of loaded datasets, keyed by dataset fingerprint and shared by all sessions
+PROFILES = LRUCache(max_entries=int(os.environ.get("PROFILE_CACHE_MAX_ENTRIES", 64)))
+
+
+class HyperLogLog:
+    """Estimates the number of distinct values of a stream with 2**precision one-byte registers,
+    whatever the number of values, with a relative standard error of about 1.04 / sqrt(2**precision).
+
+    Args:
+        precision (int): Number of bits of the hashes used to pick a register, between 4 and 16.
+            Defaults to HLL_PRECISION.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+        p = self.precision
+        idx = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # rank of the leftmost 1-bit in the remaining 64 - p bits, which fit exactly in a float64 for p >= 11
+        bit_length = np.zeros(len(rest), dtype=np.int64)
+        nonzero = rest > 0
+        bit_length[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64) + 1
+        ranks = pd.Series(64 - p - bit_length + 1).groupby(idx).max()
+        self.registers[ranks.index] = np.maximum(self.registers[ranks.index], ranks.to_numpy())
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        n_zeros = int((self.registers == 0).sum())
+        if raw <= 2.5 * m and n_zeros > 0:
+            return m * np.log(m / n_zeros)  # linear counting is more accurate for small cardinalities
+        return raw
+
+
+class QuantileSketch:
+    """Keeps a uniform random sample of at most size values of a stream, answering quantile queries
+    with a rank error of about 1 / sqrt(size). Exact as long as the stream has at most size values.
+    Uses the same random keys scheme as remote_files.sample_rows().
+
+    Args:
+        size (int): Maximum number of values kept. Defaults to QUANTILE_SKETCH_SIZE.
+        seed (int): Seed of the random number generator. Defaults to 0.
+    """
+
+    def __init__(self, size=QUANTILE_SKETCH_SIZE, seed=0):
+        self.size = size
+        self._rng = np.random.default_rng(seed)
+        self.values, self._keys = np.empty(0), np.empty(0)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.values = np.concatenate([self.values, values])
+        self._keys = np.concatenate([self._keys, self._rng.random(len(values))])
+        if len(self._keys) > self.size:
+            keep = np.argpartition(self._keys, self.size)[:self.size]
+            self.values, self._keys = self.values[keep], self._keys[keep]
+
+    def quantile(self, q):
+        return np.quantile(self.values, q) if len(self.values) > 0 else None
+
+
+class ColumnProfile:
+    """Summary statistics of one column, updated chunk by chunk: null count, min/max, distinct count estimate,
+    quantile sketch (numeric columns), and the list of distinct values for low-cardinality columns.
+    """
+
+    def __init__(self):
+        self.count, self.null_count = 0, 0
+        self.min, self.max = None, None
+        self._distinct = HyperLogLog()
+        self._values = dict()  # distinct values in order of appearance, None once there are too many
+        self.sketch = None
+
+    def update(self, column):
+        non_null = column.dropna()
+        self.count += len(column)
+        self.null_count += len(column) - len(non_null)
+        if len(non_null) == 0:
+            return
+
+        kind = non_null.dtype.kind
+        if kind in 'biufmM':
+            lo, hi = non_null.min(), non_null.max()
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+        if kind in 'iuf':
+            self.sketch = self.sketch or QuantileSketch()
+            self.sketch.update(non_null.to_numpy())
+
+        self._distinct.update(non_null)
+        if self._values is not None:
+            self._values.update(dict.fromkeys(non_null.unique().tolist()))
+            if len(self._values) > MAX_UNIQUE_VALUES:
+                self._values = None
+
+    @property
+    def distinct_count(self):
+        """Number of distinct non-null values, exact for low-cardinality columns and estimated otherwise."""
+        if self._values is not None:
+            return len(self._values)
+        return int(round(self._distinct.estimate()))
+
+    @property
+    def unique_values(self):
+        """Distinct non-null values in order of appearance, None if there are more than MAX_UNIQUE_VALUES."""
+        return None if self._values is None else list(self._values)
+
+
+class DatasetProfile:
+    """Profile of a dataset, built in the same pass that loads it (see profiled()) so that widgets and charts
+    never rescan the data to get ranges, value lists or quantiles.
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.columns = dict()  # {column_name: ColumnProfile}
+
+    def update(self, chunk):
+        """Profiles the next chunk of rows of the dataset."""
+        for name, column in chunk.items():
+            self.columns.setdefault(name, ColumnProfile()).update(column)
+        self.n_rows += len(chunk)
+
+    def add_columns(self, df, chunksize=100000):
+        """Profiles new columns of the dataset (e.g. loaded on demand), df holding all their rows."""
+        new_columns = {name: ColumnProfile() for name in df.columns}
+        for start in range(0, len(df), chunksize):
+            for name, column in df.iloc[start:start + chunksize].items():
+                new_columns[name].update(column)
+        self.columns.update(new_columns)
+        self.n_rows = len(df)
+
+    def unique_values(self, column):
+        """Distinct values of a column, None if it has too many or was not profiled."""
+        return self.columns[column].unique_values if column in self.columns else None
+
+    def quantile(self, column, q):
+        """Approximate quantile(s) of a numeric column, None if it is not numeric or was not profiled."""
+        sketch = self.columns[column].sketch if column in self.columns else None
+        return None if sketch is None else sketch.quantile(q)
+
+    def summary(self):
+        """Returns one row of statistics per column, as a DataFrame."""
+        rows = [(name, p.null_count, p.distinct_count, p.min, p.sketch.quantile(0.5) if p.sketch is not None else None,
+                 p.max) for name, p in self.columns.items()]
+        return pd.DataFrame(rows, columns=["column", "nulls", "distinct (approx.)", "min", "median", "max"]) \
+            .set_index("column")
+
+
+def profiled(chunks, profile):
+    """Passes DataFrame chunks through unchanged while profiling them, e.g. around a chunked CSV reader.
+
+    Args:
+        chunks (iterable): Consecutive DataFrame chunks of a dataset.
+        profile (DatasetProfile): The profile to update.
+    Yields:
+        chunk (pd.DataFrame): The chunks, once profiled.
+    """
+    for chunk in chunks:
+        profile.update(chunk)
+        yield chunk
+
+
+def store_profile(fingerprint, profile):
+    """Keeps the profile built while loading the dataset identified by fingerprint, see get_profile()."""
+    PROFILES.set(tuple(fingerprint), profile)
+
+
+def get_asset_profile(asset_id, revision):
+    """Returns the profile of a whole data asset, to which columns loaded on demand are added."""
+    key = tuple(DatasetFingerprint(asset_id, revision, ""))
+    return PROFILES.get_or_compute(key, DatasetProfile)
+
+
+def get_profile(df):
+    """Returns the profile of a DataFrame: the one built while loading it, or the profile of the whole
+    data asset it was loaded from if it has the same rows. Columns missing from that profile
+    (e.g. after an eviction) are profiled now, once.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to profile.
+    Returns:
+        profile (DatasetProfile): The profile of df.
+    """
+    fingerprint = get_fingerprint(df)
+    profile = PROFILES.get(tuple(fingerprint))
+    if profile is None and fingerprint.asset_id is not None:
+        asset_profile = PROFILES.get(tuple(DatasetFingerprint(fingerprint.asset_id, fingerprint.revision, "")))
+        if asset_profile is not None and asset_profile.n_rows == len(df):
+            profile = asset_profile
+    if profile is None:
+        profile = DatasetProfile()
+        store_profile(fingerprint, profile)
+
+    missing = [c for c in df.columns if c not in profile.columns]
+    if missing:
+        profile.add_columns(df[missing])
+    return profile
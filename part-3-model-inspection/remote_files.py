@@ -0,0 +1,278 @@
+import io
+import operator
+from urllib.parse import urlparse
+
+import requests
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import resilience
+
+# comparison operators supported in filters, as (column, op, value) tuples
+FILTER_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def _get(session, url, **kwargs):
+    # timeouts are bounded by the time left to render the current page, see resilience.timeout()
+    try:
+        return session.get(url, timeout=resilience.timeout(), **kwargs)
+    except resilience.DeadlineExceeded:
+        raise
+    except requests.Timeout:
+        resilience.record_timeout(urlparse(url).netloc)
+        raise
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """A read-only, seekable file object backed by a (signed) url.
+    Bytes are fetched lazily with HTTP range requests, so that readers which only need parts
+    of a file (e.g. the footer and a few column chunks of a Parquet file) only transfer those parts.
+    """
+
+    def __init__(self, url, session=None):
+        self.url = url
+        self.bytes_fetched = 0
+        self._session = session or requests.Session()
+        self._pos = 0
+        self.size = self._fetch_size()
+
+    def _fetch_size(self):
+        # signed urls are only valid for GET requests, hence a 1-byte range request rather than a HEAD request
+        with _get(self._session, self.url, headers={"Range": "bytes=0-0"}, stream=True) as r:
+            r.raise_for_status()
+            content_range = r.headers.get("Content-Range")
+        if r.status_code != 206 or content_range is None:
+            raise IOError(f"The server does not support range requests for {self.url}")
+        return int(content_range.rsplit("/", 1)[1])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+        r = _get(self._session, self.url, headers={"Range": f"bytes={self._pos}-{self._pos + n - 1}"})
+        r.raise_for_status()
+        data = r.content[:n]
+        b[:len(data)] = data
+        self._pos += len(data)
+        self.bytes_fetched += len(data)
+        return len(data)
+
+
+def open_url(url, buffer_size=1 << 16):
+    """Opens a url as a buffered, seekable binary file using HTTP range requests.
+    The buffer avoids issuing one request per small read (e.g. when parsing file metadata).
+
+    Args:
+        url (str): The url to open, e.g. the signed url of a data asset attachment.
+        buffer_size (int): Minimum size in bytes of each range request. Defaults to 64KB.
+    Returns:
+        f (io.BufferedReader): A file object that can be passed to pyarrow or pandas readers.
+    """
+    return io.BufferedReader(HTTPRangeFile(url), buffer_size=buffer_size)
+
+
+def _row_group_may_match(row_group, filters):
+    """Uses min/max statistics of a row group to check if it may contain rows matching all filters.
+    Row groups without statistics for a filtered column are always considered a potential match.
+    """
+    stats = dict()
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        if column.statistics is not None and column.statistics.has_min_max:
+            stats[column.path_in_schema] = column.statistics
+
+    for column, op, value in filters:
+        if column not in stats:
+            continue
+        lo, hi = stats[column].min, stats[column].max
+        try:
+            if op == '==' and (value < lo or value > hi) \
+                    or op == '!=' and lo == hi == value \
+                    or op == '<' and lo >= value \
+                    or op == '<=' and lo > value \
+                    or op == '>' and hi <= value \
+                    or op == '>=' and hi < value \
+                    or op == 'in' and all(v < lo or v > hi for v in value):
+                return False
+        except TypeError:
+            # statistics and filter value are not comparable, e.g. a string filter on a numeric column
+            continue
+    return True
+
+
+def apply_filters(df, filters):
+    """Keeps rows of df matching all (column, op, value) filters.
+
+    Args:
+        df (pd.DataFrame): The data to filter.
+        filters (list): List of (column, op, value) tuples, where op is one of FILTER_OPERATORS or 'in'.
+    Returns:
+        df (pd.DataFrame): The filtered data.
+    """
+    if not filters:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if op == 'in':
+            mask &= df[column].isin(value)
+        else:
+            mask &= FILTER_OPERATORS[op](df[column], value)
+    return df[mask]
+
+
+def read_parquet(source, columns=None, filters=None):
+    """Reads a Parquet file, pushing down column selection and filters:
+    only the requested columns are read, and row groups which cannot contain matching rows according to
+    their statistics are skipped. When source is a file opened with open_url(), skipped column chunks
+    and row groups are never transferred.
+
+    Args:
+        source (str or file-like): Path to, or file object of, a Parquet file.
+        columns (list): Names of the columns to read. Defaults to None, i.e. all columns.
+        filters (list): List of (column, op, value) tuples, combined with AND. Defaults to None, i.e. all rows.
+    Returns:
+        df (pd.DataFrame): The filtered data.
+    """
+    pf = pq.ParquetFile(source)
+    filters = filters or list()
+    row_groups = [i for i in range(pf.metadata.num_row_groups)
+                  if _row_group_may_match(pf.metadata.row_group(i), filters)]
+
+    read_columns = columns
+    if columns is not None:
+        read_columns = list(columns) + [c for c, _, _ in filters if c not in columns]
+    df = pf.read_row_groups(row_groups, columns=read_columns).to_pandas()
+    df = apply_filters(df, filters).reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
+
+
+def read_parquet_head(source, nrows):
+    """Reads the first rows of a Parquet file, only going through the first row group(s).
+
+    Args:
+        source (str or file-like): Path to, or file object of, a Parquet file.
+        nrows (int): Number of rows to read.
+    Returns:
+        df (pd.DataFrame): The first nrows rows of the file.
+    """
+    pf = pq.ParquetFile(source)
+    batch = next(pf.iter_batches(batch_size=max(int(nrows), 1)), None)
+    if batch is None:
+        return pf.schema_arrow.empty_table().to_pandas()
+    return batch.to_pandas().head(int(nrows))
+
+
+def read_csv_head(url, nrows, chunk_size=1 << 16):
+    """Reads the first rows of a remote CSV file, only downloading its first bytes with range requests.
+    The range is grown geometrically until enough complete rows were downloaded.
+
+    Args:
+        url (str): The url of the CSV file, e.g. the signed url of a data asset attachment.
+        nrows (int): Number of rows to read.
+        chunk_size (int): Size in bytes of the first range requested. Defaults to 64KB.
+    Returns:
+        df (pd.DataFrame): The first nrows rows of the file.
+    """
+    end = chunk_size
+    while True:
+        with _get(requests, url, headers={"Range": f"bytes=0-{end - 1}"}, stream=True) as r:
+            r.raise_for_status()
+            # reading at most `end` bytes keeps this bounded even if the server ignores the Range header
+            data = r.raw.read(end, decode_content=True)
+        reached_eof = len(data) < end
+        if not reached_eof:
+            data = data[:data.rfind(b"\n") + 1]  # drop the last, possibly truncated, line
+        if data:
+            df = pd.read_csv(io.BytesIO(data), nrows=nrows)
+            if reached_eof or len(df) >= nrows:
+                return df
+        elif reached_eof:
+            return pd.DataFrame()
+        end *= 4
+
+
+def iter_csv_chunks(url, chunksize=50000):
+    """Streams a remote CSV file as DataFrame chunks, without holding the whole file in memory.
+
+    Args:
+        url (str): The url of the CSV file, e.g. the signed url of a data asset attachment.
+        chunksize (int): Number of rows per chunk. Defaults to 50000.
+    Yields:
+        df (pd.DataFrame): Consecutive chunks of the file.
+    """
+    with _get(requests, url, stream=True) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        yield from pd.read_csv(r.raw, chunksize=chunksize)
+
+
+def iter_parquet_chunks(source, chunksize=50000, columns=None):
+    """Streams a Parquet file as DataFrame chunks, one record batch at a time.
+
+    Args:
+        source (str or file-like): Path to, or file object of, a Parquet file.
+        chunksize (int): Maximum number of rows per chunk. Defaults to 50000.
+        columns (list): Names of the columns to read. Defaults to None, i.e. all columns.
+    Yields:
+        df (pd.DataFrame): Consecutive chunks of the file.
+    """
+    pf = pq.ParquetFile(source)
+    for batch in pf.iter_batches(batch_size=chunksize, columns=columns):
+        yield batch.to_pandas()
+
+
+def sample_rows(chunks, n, seed=0):
+    """Draws a uniform random sample of n rows from a stream of DataFrame chunks, in a single pass
+    and with memory bounded by n rows plus one chunk.
+    Every row receives a uniform random key and the n rows with the smallest keys seen so far are kept,
+    which is a vectorized form of reservoir sampling.
+
+    Args:
+        chunks (iterable): DataFrames with the same columns, e.g. from iter_csv_chunks().
+        n (int): Number of rows to sample.
+        seed (int): Seed of the random number generator. Defaults to 0.
+    Returns:
+        df (pd.DataFrame): The sampled rows (all rows if the stream has fewer than n), in stream order.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(n)
+    reservoir, keys, offset = None, np.empty(0), 0
+    for chunk in chunks:
+        chunk = chunk.set_index(pd.RangeIndex(offset, offset + len(chunk)))
+        offset += len(chunk)
+        reservoir = chunk if reservoir is None else pd.concat([reservoir, chunk])
+        keys = np.concatenate([keys, rng.random(len(chunk))])
+        if len(keys) > n:
+            keep = np.argpartition(keys, n)[:n] if n > 0 else np.empty(0, dtype=int)
+            reservoir, keys = reservoir.iloc[keep], keys[keep]
+    if reservoir is None:
+        return pd.DataFrame()
+    return reservoir.sort_index()
@@ -0,0 +1,273 @@
+import os
+import time
+import threading
+import contextlib
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+import numpy as np
+
+# hedge a request when it takes longer than this percentile of recent latencies, 0 to disable hedging
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))  # latencies needed before hedging
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))  # consecutive failures opening a circuit
+BREAKER_RESET_S = float(os.environ.get("BREAKER_RESET_S", 30))  # seconds before an open circuit is retried
+CONNECT_TIMEOUT_S = float(os.environ.get("CONNECT_TIMEOUT_S", 5))  # seconds to establish a connection
+READ_TIMEOUT_S = float(os.environ.get("READ_TIMEOUT_S", 60))  # seconds without receiving any byte
+PAGE_BUDGET_S = float(os.environ.get("PAGE_BUDGET_S", 120))  # seconds a page render may spend on remote calls
+PAGE_DEADLINE = "page deadline"  # label under which calls refused because of an expired budget are counted
+
+# runs the second calls of hedged_call(), first calls never wait for a worker
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("HEDGE_MAX_WORKERS", 32)))
+_trackers, _breakers = dict(), dict()
+_registry_lock = threading.Lock()
+# deadline of the page render running on each thread, see deadline()
+_deadlines = threading.local()
+# number of timeouts since the app started, per host (and PAGE_DEADLINE)
+_timeouts = Counter()
+_timeouts_lock = threading.Lock()
+
+
+class LatencyTracker:
+    """Keeps the latencies of the most recent calls to an endpoint, to learn when a call is unusually slow.
+
+    Args:
+        size (int): Number of recent latencies kept. Defaults to 200.
+    """
+
+    def __init__(self, size=200):
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, q):
+        with self._lock:
+            return float(np.percentile(self._latencies, q)) if self._latencies else None
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast when an endpoint keeps failing: after `failures` consecutive failures the circuit opens and
+    calls are refused for reset_s seconds, then a single trial call is let through (half-open state),
+    closing the circuit again if it succeeds.
+
+    Args:
+        failures (int): Consecutive failures opening the circuit. Defaults to BREAKER_FAILURES.
+        reset_s (float): Seconds an open circuit refuses calls. Defaults to BREAKER_RESET_S.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_s=BREAKER_RESET_S):
+        self.failures, self.reset_s = failures, reset_s
+        self._consecutive_failures, self._opened_at, self._trial_in_flight = 0, None, False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_s:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    @property
+    def retry_in(self):
+        """Seconds before an open circuit lets a trial call through."""
+        if self._opened_at is None:
+            return 0
+        return max(0.0, self.reset_s - (time.monotonic() - self._opened_at))
+
+    def allow(self):
+        """Whether a call may be attempted now."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures, self._opened_at, self._trial_in_flight = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._trial_in_flight or self._consecutive_failures >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def get_tracker(key):
+    """Returns the LatencyTracker of an endpoint (e.g. a deployment id), shared by all sessions."""
+    with _registry_lock:
+        return _trackers.setdefault(key, LatencyTracker())
+
+
+def get_breaker(key):
+    """Returns the CircuitBreaker of an endpoint (e.g. a deployment id), shared by all sessions."""
+    with _registry_lock:
+        return _breakers.setdefault(key, CircuitBreaker())
+
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised by timeout() when the time budget of the current page render is already spent."""
+    pass
+
+
+@contextlib.contextmanager
+def deadline(budget_s=PAGE_BUDGET_S):
+    """Gives the code run in this context, on the current thread, a latency budget of budget_s seconds:
+    remote calls then use timeouts bounded by the time left (see timeout()), and are refused once it is spent.
+    Nested deadlines can only shorten the budget.
+
+    Args:
+        budget_s (float): Seconds available from now. Defaults to PAGE_BUDGET_S.
+    """
+    previous = getattr(_deadlines, 'at', None)
+    at = time.monotonic() + budget_s
+    _deadlines.at = at if previous is None else min(at, previous)
+    try:
+        yield
+    finally:
+        _deadlines.at = previous
+
+
+def remaining():
+    """Seconds left before the deadline of the current thread, None if there is no deadline."""
+    at = getattr(_deadlines, 'at', None)
+    return None if at is None else at - time.monotonic()
+
+
+def timeout(connect=CONNECT_TIMEOUT_S, read=READ_TIMEOUT_S):
+    """Returns the (connect, read) timeouts to pass to requests, bounded by the time left before the deadline
+    of the current thread. Without deadline, e.g. in background jobs, the default timeouts apply.
+
+    Args:
+        connect (float): Connect timeout in seconds. Defaults to CONNECT_TIMEOUT_S.
+        read (float): Read timeout in seconds. Defaults to READ_TIMEOUT_S.
+    Returns:
+        timeout (tuple): (connect, read) timeouts in seconds.
+    Raises:
+        DeadlineExceeded: If the deadline already expired.
+    """
+    left = remaining()
+    if left is None:
+        return connect, read
+    if left <= 0:
+        record_timeout(PAGE_DEADLINE)
+        raise DeadlineExceeded("The time budget of this page was spent before the request could be sent, "
+                               "please try again.")
+    return min(connect, left), min(read, left)
+
+
+def bind_deadline(fn):
+    """Wraps fn so that it runs with the deadline of the calling thread, e.g. when submitted to a thread pool."""
+    at = getattr(_deadlines, 'at', None)
+
+    def bound(*args, **kwargs):
+        previous = getattr(_deadlines, 'at', None)
+        _deadlines.at = at
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _deadlines.at = previous
+    return bound
+
+
+class DeadlineIterator:
+    """Iterates over an iterable (e.g. DataFrame chunks) until the deadline of the current thread expires,
+    so that chunked computations can return partial results. expired tells whether iteration was cut short.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.expired = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        left = remaining()
+        if left is not None and left <= 0:
+            self.expired = True
+            raise StopIteration
+        return next(self._iterator)
+
+
+def record_timeout(host):
+    with _timeouts_lock:
+        _timeouts[host] += 1
+
+
+def timeout_counts():
+    """Number of timeouts since the app started, as a {host: count} dictionary."""
+    with _timeouts_lock:
+        return dict(_timeouts)
+
+
+def hedged_call(fn, tracker, is_success=lambda result: True, percentile=HEDGE_PERCENTILE,
+                min_samples=HEDGE_MIN_SAMPLES):
+    """Calls fn, and if it has not returned after the given percentile of the latencies recorded by tracker,
+    calls it a second time and returns whichever call succeeds first. This trims tail latency caused by a
+    slow replica, at the cost of a few duplicate calls: only use it for idempotent calls such as scoring.
+    Hedging is skipped until tracker holds min_samples latencies, or if percentile is 0.
+    The first call starts right away on a thread of its own, so that the delay before hedging measures the endpoint,
+    not a queue of calls of other sessions; only the second call goes to a shared pool of HEDGE_MAX_WORKERS threads.
+    Only latencies of successful calls are recorded, so that fast failures do not lower the hedging delay.
+
+    Args:
+        fn (callable): Function without arguments performing the call.
+        tracker (LatencyTracker): Recent latencies of the endpoint called, updated by this function.
+        is_success (callable): Predicate on results of fn, failed results are only returned if both calls fail.
+        percentile (float): Latency percentile after which to hedge. Defaults to HEDGE_PERCENTILE.
+        min_samples (int): Latencies needed before hedging. Defaults to HEDGE_MIN_SAMPLES.
+    Returns:
+        The result of the first successful call, or of the last call if none succeeded.
+    """
+    @bind_deadline
+    def timed():
+        start = time.monotonic()
+        result = fn()
+        if is_success(result):
+            tracker.record(time.monotonic() - start)
+        return result
+
+    if not percentile or len(tracker) < min_samples:
+        return timed()
+
+    # the calling thread waits for either call, hence a dedicated thread rather than running the first call itself
+    first = Future()
+
+    def run_first():
+        try:
+            first.set_result(timed())
+        except BaseException as e:
+            first.set_exception(e)
+
+    threading.Thread(target=run_first, daemon=True).start()
+    futures = [first]
+    done, _ = wait(futures, timeout=tracker.percentile(percentile))
+    if not done:
+        futures.append(_hedge_executor.submit(timed))
+
+    pending, result = set(futures), None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if is_success(result):
+                return result
+    return result
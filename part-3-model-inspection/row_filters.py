@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+
+from cache_helpers import DatasetFingerprint, LRUCache, attach_fingerprint, get_fingerprint
+from remote_files import FILTER_OPERATORS
+
+# boolean masks of single filters, keyed by (dataset fingerprint, filter) and shared by all sessions
+MASKS = LRUCache(
+    max_entries=int(os.environ.get("MASK_CACHE_MAX_ENTRIES", 1024)),
+    max_bytes=int(os.environ.get("MASK_CACHE_MAX_MB", 256)) * 2**20,
+    sizeof=lambda mask: mask.nbytes
+)
+ALL, ANY = "all", "any"  # how masks of several filters are combined
+
+
+def normalize(flt):
+    """Returns a filter as a hashable (column, op, value) tuple, lists of values of 'in' filters becoming tuples."""
+    column, op, value = flt
+    if op not in FILTER_OPERATORS and op != 'in':
+        raise ValueError(f"Unsupported filter operator: {op}")
+    return column, op, tuple(value) if op == 'in' else value
+
+
+def evaluate(column, op, value):
+    """Boolean mask of the values of a column matching a filter, missing values never matching.
+
+    Args:
+        column (pd.Series): The values to filter.
+        op (str): One of remote_files.FILTER_OPERATORS, or 'in'.
+        value: The value to compare with, a list of values for 'in'.
+    Returns:
+        mask (np.array): One boolean per value.
+    """
+    if op == 'in':
+        return column.isin(value).to_numpy()
+    return FILTER_OPERATORS[op](column, value).fillna(False).to_numpy(dtype=bool)
+
+
+def get_mask(df, flt):
+    """Returns the mask of the rows of df matching one (column, op, value) filter, evaluated once per dataset.
+    df only needs to hold the filtered column, e.g. when columns are loaded on demand.
+    """
+    column, op, value = flt = normalize(flt)
+    key = (tuple(get_fingerprint(df)), flt)
+    return MASKS.get_or_compute(key, lambda: evaluate(df[column], op, value))
+
+
+def combine(masks, how=ALL):
+    """Combines masks with bitwise and (ALL) or or (ANY). Without masks, all rows match."""
+    masks = list(masks)
+    if not masks:
+        return None
+    return np.logical_and.reduce(masks) if how == ALL else np.logical_or.reduce(masks)
+
+
+def describe(filters, how=ALL):
+    """Canonical description of a combination of filters, e.g. to key derived data."""
+    return repr((how, [normalize(f) for f in filters]))
+
+
+def apply_mask(df, mask, description):
+    """Keeps the rows of df selected by mask. The result gets a fingerprint derived from the one of df
+    and the description of the filters (see describe()), so that figures and section outputs computed
+    from it are cached without hashing it.
+
+    Args:
+        df (pd.DataFrame): The data to filter, aligned with mask.
+        mask (np.array): One boolean per row of df, None to keep all rows.
+        description (str): Description of the filters mask was computed from.
+    Returns:
+        df (pd.DataFrame): The matching rows.
+    """
+    if mask is None:
+        return df
+    fingerprint = get_fingerprint(df)
+    filtered = df[mask]
+    return attach_fingerprint(filtered, DatasetFingerprint(fingerprint.asset_id, fingerprint.revision,
+                                                           f"{fingerprint.digest}|{description}"))
+
+
+def format_filter(flt):
+    column, op, value = flt
+    if op == 'in':
+        return f"{column} in ({', '.join(map(str, value))})"
+    return f"{column} {op} {value}"
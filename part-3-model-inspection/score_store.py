@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import contextlib
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import cpd_helpers
+from scoring_helpers import positive_scores
+
+SCORE_STORE_PATH = os.environ.get("SCORE_STORE_PATH", os.path.join(tempfile.gettempdir(), "cpd_scores.sqlite"))
+SCORE_COLUMNS = ["predicted_class", "predicted_probability"]
+
+# background scoring jobs of this process: {(deployment_key, dataset_key): ScoringJob}
+_jobs = dict()
+_jobs_lock = threading.Lock()
+
+
+class ScoreStore:
+    """Persistent store of the predictions of a deployment for every row of a dataset, on local disk (SQLite).
+    Scores are keyed by a deployment key (deployment and model revisions) and a dataset key (dataset fingerprint),
+    so that later sessions reuse them as long as neither the model nor the data changed.
+
+    Args:
+        path (str): Path to the SQLite database. Defaults to SCORE_STORE_PATH.
+    """
+
+    def __init__(self, path=SCORE_STORE_PATH):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")  # lets sessions read while a job writes
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS scores (
+                    deployment_key TEXT, dataset_key TEXT, row_idx INTEGER,
+                    predicted_class TEXT, predicted_probability REAL,
+                    PRIMARY KEY (deployment_key, dataset_key, row_idx)
+                ) WITHOUT ROWID
+            """)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # commits on success, and unlike sqlite3's own context manager, also closes the connection
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as connection, connection:
+            yield connection
+
+    def write(self, deployment_key, dataset_key, row_idx, classes, probabilities):
+        """Stores the predictions of some rows, overwriting previous ones."""
+        rows = zip([deployment_key] * len(row_idx), [dataset_key] * len(row_idx), np.asarray(row_idx).tolist(),
+                   np.asarray(classes).astype(str).tolist(), np.asarray(probabilities, dtype=float).tolist())
+        with self._connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)", rows)
+
+    def count(self, deployment_key, dataset_key):
+        """Number of rows scored so far."""
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM scores WHERE deployment_key = ? AND dataset_key = ?",
+                                      (deployment_key, dataset_key)).fetchone()[0]
+
+    def read(self, deployment_key, dataset_key, n_rows):
+        """Reads stored predictions, aligned on row positions.
+
+        Args:
+            deployment_key (str): Key of the deployment, see deployment_key().
+            dataset_key (str): Key of the dataset, see dataset_key().
+            n_rows (int): Number of rows of the dataset.
+        Returns:
+            scores (pd.DataFrame): SCORE_COLUMNS for rows 0 to n_rows - 1, missing where rows were not scored yet.
+        """
+        with self._connect() as connection:
+            scores = pd.read_sql_query(
+                "SELECT row_idx, predicted_class, predicted_probability FROM scores "
+                "WHERE deployment_key = ? AND dataset_key = ?",
+                connection, params=(deployment_key, dataset_key), index_col='row_idx')
+        return scores.reindex(pd.RangeIndex(n_rows))
+
+    def scored_rows(self, deployment_key, dataset_key):
+        """Row positions already scored, used to resume interrupted jobs."""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT row_idx FROM scores WHERE deployment_key = ? AND dataset_key = ?",
+                                      (deployment_key, dataset_key)).fetchall()
+        return np.array([r[0] for r in rows], dtype=int)
+
+
+def deployment_key(deployment_details, model_details):
+    """Identifies what produced a set of scores: a deployment, and the model revision it serves."""
+    deployment_metadata, model_metadata = deployment_details['metadata'], model_details.get('metadata', dict())
+    return "{}@{}:{}@{}".format(deployment_metadata['id'], deployment_metadata.get('modified_at', ''),
+                                model_metadata.get('id', ''), model_metadata.get('modified_at', ''))
+
+
+def dataset_key(fingerprint):
+    """Identifies what was scored, from a dataset fingerprint (see cache_helpers.get_fingerprint())."""
+    return repr(tuple(fingerprint))
+
+
+class ScoringJob(threading.Thread):
+    """Background job scoring a whole dataset batch by batch and writing predictions to a ScoreStore
+    as it goes, so that progress is visible and an interrupted job resumes where it stopped.
+    Scoring a whole dataset may outlast the token of headers, which is renewed when it expires,
+    see cpd_helpers.refresh_headers().
+
+    Args:
+        store (ScoreStore): Where to write scores.
+        deployment_key (str): Key of the deployment, see deployment_key().
+        dataset_key (str): Key of the dataset, see dataset_key().
+        df (pd.DataFrame): The data to score, already prepared for the model.
+        headers (dict): Authentication headers obtained with cpd_helpers.authenticate().
+        score_fn (callable): Function scoring a DataFrame with the given headers, called as score_fn(headers, df)
+            and returning (ScoringResult, error_msg).
+        batch_size (int): Number of rows per batch. Defaults to 1000.
+    """
+
+    def __init__(self, store, deployment_key, dataset_key, df, headers, score_fn, batch_size=1000):
+        super().__init__(daemon=True)
+        self.store, self.keys, self.df = store, (deployment_key, dataset_key), df
+        self.headers, self.score_fn, self.batch_size = headers, score_fn, batch_size
+        self.n_done, self.error_msg = 0, ""
+
+    def run(self):
+        try:
+            self.error_msg = self._score()
+        except Exception as e:
+            self.error_msg = str(e)
+
+    def _score(self):
+        todo = np.ones(len(self.df), dtype=bool)
+        todo[self.store.scored_rows(*self.keys)] = False
+        self.n_done = int((~todo).sum())
+        positions = np.flatnonzero(todo)
+        for i in range(0, len(positions), self.batch_size):
+            batch_positions = positions[i:i + self.batch_size]
+            # if authentication fails, the current token is used while it lasts
+            self.headers, _ = cpd_helpers.refresh_headers(self.headers)
+            result, error_msg = self.score_fn(self.headers, self.df.iloc[batch_positions])
+            if result is None:
+                return error_msg
+            self.store.write(*self.keys, batch_positions, result.classes, positive_scores(result))
+            self.n_done += len(batch_positions)
+        return ""
+
+
+def start_scoring_job(store, deployment_key, dataset_key, df, headers, score_fn, batch_size=1000):
+    """Starts a ScoringJob unless one is already running for the same deployment and dataset.
+
+    Returns:
+        job (ScoringJob): The running job.
+    """
+    with _jobs_lock:
+        job = _jobs.get((deployment_key, dataset_key))
+        if job is None or not job.is_alive():
+            job = ScoringJob(store, deployment_key, dataset_key, df, headers, score_fn, batch_size)
+            _jobs[(deployment_key, dataset_key)] = job
+            job.start()
+    return job
+
+
+def get_scoring_job(deployment_key, dataset_key):
+    """Returns the last ScoringJob started in this process for a deployment and dataset, if any."""
+    return _jobs.get((deployment_key, dataset_key))
@@ -0,0 +1,396 @@
+import io
+import json
+import os
+import pickle
+import tarfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from cache_helpers import LRUCache
+
+try:
+    import orjson
+except ImportError:  # optional, the standard json module is used instead
+    orjson = None
+
+try:
+    import joblib
+except ImportError:  # optional, plain pickle is used instead
+    joblib = None
+
+# frameworks (prefix of entity.type in model details) whose models can be scored in-process
+LOCAL_FRAMEWORKS = ('scikit-learn', 'xgboost')
+# whether the app offers in-process scoring, which unpickles model artifacts, i.e. runs code they contain
+ALLOW_LOCAL_MODELS = os.environ.get("ALLOW_LOCAL_MODELS", "false").lower() in ("1", "true", "yes")
+
+# WML schema field types, grouped by the pandas dtype inputs are coerced to before scoring
+FLOAT_TYPES = {'double', 'float', 'float32', 'float64', 'decimal', 'number', 'real'}
+INTEGER_TYPES = {'int', 'integer', 'int32', 'int64', 'long', 'short', 'bigint', 'smallint'}
+BOOLEAN_TYPES = {'boolean', 'bool'}
+STRING_TYPES = {'string', 'str', 'object', 'varchar', 'char', 'other'}
+
+# Outcome of applying an input schema to some data:
+# - missing_columns: expected by the model but absent from the data, sent as nulls
+# - extra_columns: present in the data but not expected by the model, dropped
+# - coerced_columns: columns whose dtype had to be converted to match the schema
+SchemaReport = namedtuple('SchemaReport', ['missing_columns', 'extra_columns', 'coerced_columns'])
+
+# Predictions decoded from a scoring response, as NumPy arrays with one entry per scored row:
+# - classes: predicted classes (or predicted values for regression models)
+# - probabilities: (n_rows, n_classes) class probabilities, None if the model does not return any
+# - scores: probability of the predicted class, or predicted value for regression models
+ScoringResult = namedtuple('ScoringResult', ['classes', 'probabilities', 'scores'])
+
+_compiled_schemas = LRUCache(max_entries=64)
+_local_models = LRUCache(max_entries=16)
+
+
+class InputSchema:
+    """Input schema of a deployed model, compiled once from entity.schemas.input of its details:
+    column order, column lookups and dtype coercions are precomputed, so that preparing scoring
+    payloads is a handful of vectorized operations on whole DataFrames.
+
+    Args:
+        fields (list): List of (column_name, wml_type) tuples, in the order expected by the model.
+    """
+
+    def __init__(self, fields):
+        self.columns = [name for name, _ in fields]
+        self.column_set = frozenset(self.columns)
+        self.dtypes = {name: _target_dtype(wml_type) for name, wml_type in fields}
+
+    @classmethod
+    def from_model_details(cls, model_details):
+        """Compiles the input schema attached to a model (e.g. AutoAI, SPSS, or Python if user specified it).
+
+        Args:
+            model_details (dict): Model/Function details obtained from get_deployment_details()
+        Returns:
+            schema (InputSchema): The compiled schema, None if the model has no input schema.
+        """
+        schemas = model_details.get('entity', dict()).get('schemas')
+        if not schemas or not schemas.get('input'):
+            return None
+        fields = schemas['input'][0]['fields']
+        return cls([(x['name'], str(x.get('type', '')).lower()) for x in fields])
+
+    def select(self, payload):
+        """Keeps the entries of a {feature_name: value} payload which are expected by the model."""
+        return {k: v for k, v in payload.items() if k in self.column_set}
+
+    def apply(self, df):
+        """Prepares a whole DataFrame for scoring: columns are reordered as expected by the model,
+        unexpected columns dropped, missing ones added as nulls, and dtypes coerced.
+
+        Args:
+            df (pd.DataFrame): The data to score.
+        Returns:
+            df (pd.DataFrame): Scoring-ready data, with exactly the columns of the schema in order.
+            report (SchemaReport): Missing, extra and coerced columns.
+        """
+        missing = [c for c in self.columns if c not in df.columns]
+        extra = [c for c in df.columns if c not in self.column_set]
+        prepared = df.reindex(columns=self.columns)
+
+        coerced = list()
+        for column, dtype in self.dtypes.items():
+            if dtype is None or column in missing or prepared[column].dtype == dtype:
+                continue
+            prepared[column] = _coerce(prepared[column], dtype)
+            coerced.append(column)
+        return prepared, SchemaReport(missing, extra, coerced)
+
+
+def _target_dtype(wml_type):
+    if wml_type in FLOAT_TYPES:
+        return np.dtype('float64')
+    if wml_type in INTEGER_TYPES:
+        return np.dtype('int64')
+    if wml_type in BOOLEAN_TYPES:
+        return np.dtype('bool')
+    if wml_type in STRING_TYPES:
+        return np.dtype('object')
+    return None  # unknown type, sent as is
+
+
+def _coerce(column, dtype):
+    if dtype.kind in 'fi':
+        column = pd.to_numeric(column, errors='coerce')
+        # integers with missing values stay floats, which serialize to null where values are missing
+        return column if dtype.kind == 'i' and column.isna().any() else column.astype(dtype)
+    if dtype.kind == 'b':
+        return column.astype(dtype)
+    return column.where(column.isna(), column.astype(str))
+
+
+def compile_input_schema(model_details):
+    """Returns the compiled input schema of a model, compiling it only once per model revision.
+
+    Args:
+        model_details (dict): Model/Function details obtained from get_deployment_details()
+    Returns:
+        schema (InputSchema): The compiled schema, None if the model has no input schema.
+    """
+    metadata = model_details.get('metadata', dict())
+    key = (metadata.get('id'), metadata.get('modified_at') or metadata.get('rev'))
+    if key[0] is None:
+        return InputSchema.from_model_details(model_details)
+    return _compiled_schemas.get_or_compute(key, lambda: InputSchema.from_model_details(model_details))
+
+
+def encode_scoring_payload(df):
+    """Encodes a DataFrame as the body of a WML scoring request, i.e. a single mini-batch under input_data.
+    Frames whose columns all share one numeric NumPy dtype are serialized straight from their NumPy buffer
+    with orjson when available; other frames (e.g. mixing ints and floats, whose ints a single buffer would
+    upcast) are converted column by column, without building Python rows. Missing values are sent as nulls.
+
+    Args:
+        df (pd.DataFrame): The data to score, e.g. prepared with InputSchema.apply().
+    Returns:
+        body (bytes): The JSON-encoded payload.
+    """
+    fields = [str(c) for c in df.columns]
+    if orjson is not None:
+        dtypes = set(df.dtypes)
+        if len(dtypes) == 1 and all(isinstance(dtype, np.dtype) and dtype.kind in 'fiub' for dtype in dtypes):
+            values = np.ascontiguousarray(df.to_numpy())
+        else:
+            values = list(zip(*(df[c].tolist() for c in df.columns)))
+        return orjson.dumps({"input_data": [{"fields": fields, "values": values}]},
+                            option=orjson.OPT_SERIALIZE_NUMPY, default=_json_default)
+
+    # the json module writes NaN literals, which are not valid JSON, so they are replaced by None first
+    values = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+    return json.dumps({"input_data": [{"fields": fields, "values": values}]}).encode()
+
+
+def _json_default(value):
+    # values orjson cannot serialize natively, e.g. pd.NA or timestamps in object columns;
+    # arrays are converted to lists, whose items come back here if orjson cannot serialize them either
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    return str(value)
+
+
+def decode_json(content):
+    """Parses a JSON response body, with orjson when available."""
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+
+def decode_predictions(response):
+    """Decodes the predictions matrix of a WML scoring response into NumPy arrays.
+    Columns are located by their field name ("prediction" and "probability") when the response
+    has fields, and otherwise by position as [..., prediction, probability].
+    Binary, multiclass and regression outputs are supported.
+
+    Args:
+        response (dict): The parsed JSON response of a scoring request.
+    Returns:
+        result (ScoringResult): Predicted classes, probabilities and scores.
+    """
+    predictions = response['predictions'][0]
+    fields, values = predictions.get('fields', list()), predictions['values']
+    if not values:
+        return ScoringResult(np.empty(0, dtype=object), None, np.empty(0))
+
+    columns = list(zip(*values))  # transposes rows to columns without a Python loop per row
+    if 'prediction' in fields:
+        prediction_idx = fields.index('prediction')
+        probability_idx = fields.index('probability') if 'probability' in fields else None
+    elif len(columns) >= 2:
+        prediction_idx, probability_idx = -2, -1
+    else:
+        prediction_idx, probability_idx = 0, None
+
+    classes = np.array(columns[prediction_idx])
+    if probability_idx is None:
+        # regression, or classifier without probabilities
+        scores = classes.astype(float) if classes.dtype.kind in 'fiub' else np.full(len(classes), np.nan)
+        return ScoringResult(classes, None, scores)
+
+    probabilities = np.array(columns[probability_idx], dtype=float)
+    if probabilities.ndim == 1:  # a single probability per row
+        return ScoringResult(classes, probabilities[:, None], probabilities)
+    return ScoringResult(classes, probabilities, probabilities.max(axis=1))
+
+
+def concat_results(results):
+    """Concatenates the ScoringResults of consecutive batches."""
+    results = list(results)
+    probabilities = None
+    if all(r.probabilities is not None for r in results):
+        probabilities = np.concatenate([r.probabilities for r in results])
+    return ScoringResult(np.concatenate([r.classes for r in results]),
+                         probabilities,
+                         np.concatenate([r.scores for r in results]))
+
+
+def make_variants(row, feature, values):
+    """Builds copies of a row where one feature takes each of the given values, e.g. to score a
+    what-if sweep in a single batched request.
+
+    Args:
+        row (dict): The reference row, in {feature_name: value} format.
+        feature (str): The feature to vary.
+        values (array-like): The values taken by that feature.
+    Returns:
+        variants (pd.DataFrame): One row per value, all other features equal to the reference row.
+    """
+    values = np.asarray(values)
+    variants = pd.DataFrame([row]).iloc[np.zeros(len(values), dtype=int)].reset_index(drop=True)
+    variants[feature] = values
+    return variants
+
+
+def make_ice_frame(sample, feature, grid):
+    """Builds the rows to score for Individual Conditional Expectation (ICE) curves: every row of sample
+    is repeated for every value of grid, with the feature replaced by that value.
+
+    Args:
+        sample (pd.DataFrame): The rows to compute ICE curves for.
+        feature (str): The feature to vary.
+        grid (array-like): The values taken by that feature.
+    Returns:
+        variants (pd.DataFrame): len(grid) * len(sample) rows, grouped by grid value.
+    """
+    grid = np.asarray(grid)
+    variants = sample.iloc[np.tile(np.arange(len(sample)), len(grid))].reset_index(drop=True)
+    variants[feature] = np.repeat(grid, len(sample))
+    return variants
+
+
+def positive_scores(result):
+    """Returns one score per row suitable for curves and rankings: the probability of the last class
+    of the response, or the predicted value for regression models. Responses do not say which class that is
+    (usually the last one in sorted order): see class_votes() to find it out from the predicted classes.
+    """
+    if result.probabilities is None:
+        return result.scores
+    return result.probabilities[:, -1]
+
+
+def _matches(values, label):
+    # predicted classes and labels of a dataset may differ in type, e.g. 1, 1.0 and "1"
+    values = np.asarray(values)
+    try:
+        return values.astype(float) == float(label)
+    except (TypeError, ValueError):
+        return values.astype(str) == str(label)
+
+
+def class_votes(predicted, scores, labels):
+    """Tells which class binary classification scores (see positive_scores()) are the probabilities of,
+    from the predicted classes of the scoring response: each row predicted as a label votes for it if
+    its score is above 0.5, and against it if its score is below 0.5.
+
+    Args:
+        predicted (array-like): Predicted class of every row, e.g. ScoringResult.classes.
+        scores (array-like): Score of every row, from positive_scores().
+        labels (list): The two classes, e.g. the values of the label column.
+    Returns:
+        votes (dict): {label: votes}. Votes of several batches add up, see scored_class().
+    """
+    scores = np.asarray(scores, dtype=float)
+    above, below = scores > 0.5, scores < 0.5
+    votes = dict()
+    for label in labels:
+        matches = _matches(predicted, label)
+        votes[label] = int(np.sum(matches & above)) - int(np.sum(matches & below))
+    return votes
+
+
+def scored_class(votes):
+    """Returns the label with the most votes (see class_votes()), None on a tie, e.g. when the predicted
+    classes match none of the labels."""
+    ranked = sorted(votes.items(), key=lambda item: item[1], reverse=True)
+    if not ranked or (len(ranked) > 1 and ranked[0][1] == ranked[1][1]):
+        return None
+    return ranked[0][0]
+
+
+def make_grid(values, n_points):
+    """Picks up to n_points grid values for a numeric feature, at evenly spaced quantiles of its values."""
+    values = pd.Series(values).dropna()
+    if len(values) == 0:
+        return np.empty(0)
+    return np.unique(np.quantile(values, np.linspace(0, 1, int(n_points))))
+
+
+class LocalModel:
+    """A model artifact downloaded from the WML repository and scored in-process,
+    with the same input and output contract as remote scoring (see decode_predictions()).
+
+    Args:
+        estimator: The unpickled model, exposing predict() and optionally predict_proba().
+        input_schema (InputSchema): Schema used to order and coerce input columns. Defaults to None.
+        cache_key (tuple): (model_id, revision) of the model. Defaults to None.
+    """
+
+    def __init__(self, estimator, input_schema=None, cache_key=None):
+        self.estimator = estimator
+        self.input_schema = input_schema
+        self.cache_key = cache_key  # identifies the model revision in cache keys of functions receiving it
+
+    def score(self, df):
+        """Scores a DataFrame in-process.
+
+        Args:
+            df (pd.DataFrame): Input data to predict.
+        Returns:
+            result (ScoringResult): Predictions for every row of df.
+        """
+        if self.input_schema is not None:
+            df, _ = self.input_schema.apply(df)
+        classes = np.asarray(self.estimator.predict(df))
+        if not hasattr(self.estimator, 'predict_proba'):
+            scores = classes.astype(float) if classes.dtype.kind in 'fiub' else np.full(len(classes), np.nan)
+            return ScoringResult(classes, None, scores)
+        probabilities = np.asarray(self.estimator.predict_proba(df), dtype=float)
+        return ScoringResult(classes, probabilities, probabilities.max(axis=1))
+
+
+def supports_local_scoring(model_details):
+    """Checks whether a model was trained with a framework whose artifacts can be scored in-process.
+    Functions, AutoAI pipelines and other frameworks are always scored remotely.
+
+    Args:
+        model_details (dict): Model/Function details obtained from get_deployment_details()
+    """
+    model_type = model_details.get('entity', dict()).get('type', '')
+    return model_type.split('_')[0] in LOCAL_FRAMEWORKS
+
+
+def load_local_model(model_details, download_fn):
+    """Returns the in-process version of a model, downloading and unpickling its artifact
+    only once per model revision.
+    Unpickling runs arbitrary code from the artifact: only use this with deployment spaces you trust.
+
+    Args:
+        model_details (dict): Model/Function details obtained from get_deployment_details()
+        download_fn (callable): Function without arguments returning the model content as bytes
+            (a .tar.gz archive as stored in the WML repository, or a pickle).
+    Returns:
+        model (LocalModel): The model, ready to score.
+    """
+    metadata = model_details['metadata']
+    key = (metadata['id'], metadata.get('modified_at') or metadata.get('rev'))
+
+    def load():
+        content = download_fn()
+        return LocalModel(_unpickle_artifact(content), compile_input_schema(model_details), key)
+    return _local_models.get_or_compute(key, load)
+
+
+def _unpickle_artifact(content):
+    load = joblib.load if joblib is not None else pickle.load
+    if not tarfile.is_tarfile(io.BytesIO(content)):
+        return load(io.BytesIO(content))
+    with tarfile.open(fileobj=io.BytesIO(content)) as archive:
+        for member in archive.getmembers():
+            if member.isfile() and member.name.endswith(('.pkl', '.pickle', '.joblib')):
+                return load(archive.extractfile(member))
+    raise ValueError("No pickled model found in the model content.")
@@ -0,0 +1,46 @@
+import time
+
+import streamlit as st
+
+from cache_helpers import make_key, no_error
+from memory_governor import DROPPED, govern, resolve
+
+
+def section(name, inputs, compute_fn, ttl=None, keep_if=no_error):
+    """Runs one section of a page, or reuses its output from the previous run of the same session
+    if its inputs did not change.
+    Streamlit reruns the whole page script on every widget interaction: wrapping the work of a section
+    (fetching, preparing data, building figures or grid options) in section() makes reruns only pay for
+    the sections whose inputs changed. Widgets must still be rendered on every run, only their
+    inputs are reused.
+    Each session keeps the last output of each section only, keyed like cached functions (see cache_helpers.make_key()),
+    so inputs are cheap to compare: DataFrames by fingerprint, authentication headers by user identity.
+    Large outputs are dropped by the memory governor under memory pressure, and then computed again.
+
+    Args:
+        name (str): Unique name of the section, e.g. prefixed with the page module name.
+        inputs (tuple): Everything the section output depends on.
+        compute_fn (callable): Function without arguments computing the section output.
+        ttl (float): Seconds after which the output is computed again even if inputs did not change.
+            Defaults to None, i.e. no expiry.
+        keep_if (callable): Predicate on outputs deciding whether to reuse them. Defaults to reusing outputs
+            whose error_msg (last element) is empty.
+    Returns:
+        The output of compute_fn(), current or from a previous run.
+    """
+    memo = st.session_state.setdefault('sections', dict())
+    key = make_key(name, inputs, dict())
+    previous = memo.get(name)
+    if previous is not None:
+        previous_key, output, computed_at = previous
+        if previous_key == key and (ttl is None or time.monotonic() - computed_at < ttl):
+            output = resolve(output)
+            if output is not DROPPED:
+                return output
+
+    output = compute_fn()
+    if keep_if(output):
+        memo[name] = (key, govern(output, spill=False), time.monotonic())
+    else:
+        memo.pop(name, None)
+    return output
@@ -0,0 +1,188 @@
+import os
+import time
+import uuid
+import threading
+
+import numpy as np
+
+import cpd_helpers
+
+# name of the data asset each job run writes its SHAP values to, see the compute-and-store-shap-values notebook
+SHARD_ASSET_NAME = "shap_{run_id}_{index:04d}.json"
+POLL_S = float(os.environ.get("SHAP_JOB_POLL_S", 30))  # seconds between checks of the job runs
+TIMEOUT_S = float(os.environ.get("SHAP_JOB_TIMEOUT_S", 6 * 3600))  # seconds after which unfinished job runs are given up
+MAX_FAILED_CHECKS = 10  # consecutive failed checks of the job runs after which they are given up
+# rows explained at most: the merged explanation is stored in the custom metadata of the model, which is limited in size.
+# The default is the number of rows a single run of the notebook explains
+MAX_ROWS = int(os.environ.get("SHAP_MAX_ROWS", 1000))
+FINISHED_STATES = ("Completed", "Failed", "Canceled")
+
+_jobs = dict()  # {model_id: ShardedShapJob}, the last sharded job started for each model
+_jobs_lock = threading.Lock()
+
+
+def shard_bounds(n_rows, n_shards):
+    """Splits rows 0 to n_rows - 1 into n_shards contiguous (start, end) ranges of nearly equal sizes."""
+    edges = np.linspace(0, n_rows, min(n_shards, max(n_rows, 1)) + 1).round().astype(int)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def merge_shards(shards):
+    """Merges the SHAP values computed by each job run into one explanation, rows in dataset order.
+
+    Args:
+        shards (list): Documents written by the job runs, with the feature_names, expected_value, values
+            and data of their rows, and row_start.
+    Returns:
+        shap (dict): The merged explanation, in the format stored in the custom metadata of models.
+    Raises:
+        ValueError: If shards explain different features, or with different base values
+            (i.e. different background data).
+    """
+    shards = sorted(shards, key=lambda shard: shard['row_start'])
+    first = shards[0]
+    for shard in shards[1:]:
+        if shard['feature_names'] != first['feature_names']:
+            raise ValueError("The job runs explained different features, please start them again.")
+        if not np.isclose(shard['expected_value'], first['expected_value']):
+            raise ValueError("The job runs used different background data, please start them again.")
+    return {
+        'feature_names': first['feature_names'],
+        'expected_value': first['expected_value'],
+        'values': [row for shard in shards for row in shard['values']],
+        'data': [row for shard in shards for row in shard['data']],
+    }
+
+
+class ShardedShapJob(threading.Thread):
+    """Computes SHAP values of a dataset with several runs of a notebook job in parallel, each explaining
+    a range of rows passed as environment variables (SHARD_INDEX, SHARD_COUNT, ROW_START, ROW_END).
+    The job runs are polled until all of them finish, then their results are merged and stored
+    in the custom metadata of the model, like a single run of the notebook would.
+    Runs still unfinished after timeout_s seconds, or which cannot be checked MAX_FAILED_CHECKS times in a row,
+    are given up. The token of headers is renewed when it expires, see cpd_helpers.refresh_headers().
+
+    Args:
+        headers (dict): Authentication headers obtained with cpd_helpers.authenticate().
+        project_id (str): Project where the job lives.
+        job_id (str): Id of the notebook job.
+        model_details (dict): Details of the model to explain, see cpd_helpers.get_deployment_details().
+        n_rows (int): Number of rows of the dataset to explain, at most MAX_ROWS.
+        n_shards (int): Number of job runs.
+        env_variables (dict): Other environment variables passed to every job run, e.g. DATASET_NAME.
+        poll_s (float): Seconds between checks of the job runs. Defaults to POLL_S.
+        timeout_s (float): Seconds after which unfinished job runs are given up. Defaults to TIMEOUT_S.
+    """
+
+    def __init__(self, headers, project_id, job_id, model_details, n_rows, n_shards, env_variables, poll_s=POLL_S,
+                 timeout_s=TIMEOUT_S):
+        super().__init__(daemon=True)
+        self.headers, self.project_id, self.job_id = headers, project_id, job_id
+        self.model_details, self.env_variables = model_details, env_variables
+        self.poll_s, self.timeout_s = poll_s, timeout_s
+        self.run_id = uuid.uuid4().hex[:12]
+        # one entry per job run: {index, row_start, row_end, jobrun_id, state}
+        self.shards = [{"index": i, "row_start": start, "row_end": end, "jobrun_id": None, "state": "Not started"}
+                       for i, (start, end) in enumerate(shard_bounds(min(n_rows, MAX_ROWS), n_shards))]
+        self.state, self.error_msg = "Starting", ""
+        self.started_at, self.finished_at = time.time(), None
+
+    def run(self):
+        try:
+            self.error_msg = self._trigger() or self._wait() or self._merge()
+        except Exception as e:
+            self.error_msg = str(e)
+        self.state = "Failed" if self.error_msg != "" else "Completed"
+        self.finished_at = time.time()
+
+    def _trigger(self):
+        for shard in self.shards:
+            env_variables = dict(self.env_variables, MODEL_ID=self.model_details['metadata']['id'],
+                                 SHAP_RUN_ID=self.run_id, SHARD_INDEX=shard['index'], SHARD_COUNT=len(self.shards),
+                                 ROW_START=shard['row_start'], ROW_END=shard['row_end'])
+            jobrun_details, error_msg = cpd_helpers.trigger_job(self.headers, self.project_id, self.job_id,
+                                                                env_variables)
+            if error_msg != "":
+                return f"Job run {shard['index']} could not be started: {error_msg}"
+            shard['jobrun_id'], shard['state'] = jobrun_details['metadata']['asset_id'], "Queued"
+        return ""
+
+    def _refresh_headers(self):
+        # if authentication fails, the current token is used while it lasts, and failed checks give up the job
+        self.headers, _ = cpd_helpers.refresh_headers(self.headers)
+
+    def _wait(self):
+        self.state = "Running"
+        deadline, failed_checks = self.started_at + self.timeout_s, 0
+        while any(shard['state'] not in FINISHED_STATES for shard in self.shards):
+            if time.time() > deadline:
+                return f"The job runs did not finish within {self.timeout_s / 60:.0f} minutes, " \
+                       f"see their logs in the project."
+            time.sleep(self.poll_s)
+            self._refresh_headers()
+            for shard in self.shards:
+                if shard['state'] in FINISHED_STATES:
+                    continue
+                state, error_msg = cpd_helpers.get_job_run_state(self.headers, self.project_id, self.job_id,
+                                                                 shard['jobrun_id'])
+                if state is not None:
+                    shard['state'], failed_checks = state, 0
+                    continue
+                # failed checks are retried at the next poll, unless they keep failing
+                failed_checks += 1
+                if failed_checks >= MAX_FAILED_CHECKS:
+                    return f"The job runs could not be checked {failed_checks} times in a row: {error_msg}"
+        failed = [str(shard['index']) for shard in self.shards if shard['state'] != "Completed"]
+        if failed:
+            return f"Job runs {', '.join(failed)} did not complete, see their logs in the project."
+        return ""
+
+    def _merge(self):
+        self.state = "Merging"
+        self._refresh_headers()
+        documents, asset_ids = list(), list()
+        for shard in self.shards:
+            name = SHARD_ASSET_NAME.format(run_id=self.run_id, index=shard['index'])
+            # assets written by a job may take a moment to become searchable
+            for _ in range(10):
+                asset_id, error_msg = cpd_helpers.find_data_asset(self.headers, self.project_id, name)
+                if asset_id is not None:
+                    break
+                time.sleep(self.poll_s)
+            if asset_id is None:
+                return f"The results of job run {shard['index']} ({name}) were not found. {error_msg}"
+            document, error_msg = cpd_helpers.load_json_asset(self.headers, self.project_id, asset_id)
+            if error_msg != "":
+                return error_msg
+            documents.append(document)
+            asset_ids.append(asset_id)
+
+        custom = dict(self.model_details.get('entity', dict()).get('custom') or dict())
+        custom['shap'] = merge_shards(documents)
+        _, error_msg = cpd_helpers.update_model_custom(self.headers, self.model_details, custom)
+        if error_msg != "":
+            return error_msg
+        for asset_id in asset_ids:
+            cpd_helpers.delete_asset(self.headers, self.project_id, asset_id)  # a leftover asset is harmless
+        return ""
+
+
+def start_shap_job(headers, project_id, job_id, model_details, n_rows, n_shards, env_variables):
+    """Starts a ShardedShapJob unless one is already running for the same model.
+
+    Returns:
+        job (ShardedShapJob): The running job.
+    """
+    model_id = model_details['metadata']['id']
+    with _jobs_lock:
+        job = _jobs.get(model_id)
+        if job is None or not job.is_alive():
+            job = ShardedShapJob(headers, project_id, job_id, model_details, n_rows, n_shards, env_variables)
+            _jobs[model_id] = job
+            job.start()
+    return job
+
+
+def get_shap_job(model_id):
+    """Returns the last ShardedShapJob started in this process for a model, if any."""
+    return _jobs.get(model_id)
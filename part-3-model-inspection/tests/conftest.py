@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# the app modules are imported as top-level modules, as when running `streamlit run app.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers each request with the next (delay_s, status, body) behavior of the server, in order of arrival."""
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond()
+
+    def respond(self):
+        delay_s, status, body = self.server.next_behavior()
+        time.sleep(delay_s)
+        content = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Local server which is slow or fails on chosen requests, see StandInHandler."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/"
+        self.behaviors, self.default = list(), (0, 200, "{}")
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+    def next_behavior(self):
+        with self._lock:
+            self.n_requests += 1
+            return self.behaviors.pop(0) if self.behaviors else self.default
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
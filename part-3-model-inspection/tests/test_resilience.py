@@ -0,0 +1,171 @@
+import time
+import uuid
+
+import requests
+
+import resilience
+
+
+def warm_tracker(latency_s, n=resilience.HEDGE_MIN_SAMPLES):
+    tracker = resilience.LatencyTracker()
+    for _ in range(n):
+        tracker.record(latency_s)
+    return tracker
+
+
+def call_with_breaker(breaker, url):
+    # how score_batch() uses a breaker: server errors count as failures, any other response as a success
+    if not breaker.allow():
+        return None
+    r = requests.get(url, timeout=5)
+    if r.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return r
+
+
+def test_no_hedge_before_enough_latencies(server):
+    server.behaviors = [(0.3, 200, '"slow"')]
+    tracker = warm_tracker(0.01, n=resilience.HEDGE_MIN_SAMPLES - 1)
+
+    r = resilience.hedged_call(lambda: requests.get(server.url, timeout=5), tracker, is_success=lambda r: r.ok)
+
+    assert r.json() == "slow"
+    assert server.n_requests == 1
+    assert len(tracker) == resilience.HEDGE_MIN_SAMPLES
+
+
+def test_failed_calls_do_not_record_latencies(server):
+    server.behaviors = [(0, 503, '"unavailable"')]
+    tracker = warm_tracker(0.5, n=3)
+
+    r = resilience.hedged_call(lambda: requests.get(server.url, timeout=5), tracker, is_success=lambda r: r.ok)
+
+    assert r.status_code == 503
+    assert len(tracker) == 3
+    assert tracker.percentile(50) == 0.5
+
+
+def test_hedge_fires_after_tracked_percentile(server):
+    server.behaviors = [(2.0, 200, '"slow"'), (0, 200, '"fast"')]
+    tracker = warm_tracker(0.05)
+
+    start = time.monotonic()
+    r = resilience.hedged_call(lambda: requests.get(server.url, timeout=5), tracker, is_success=lambda r: r.ok)
+    elapsed = time.monotonic() - start
+
+    assert r.json() == "fast"
+    assert server.n_requests == 2
+    assert 0.05 <= elapsed < 1.0  # the hedge waited for the 95th percentile, not for the slow call
+
+
+def test_no_hedge_when_call_is_fast(server):
+    server.behaviors = [(0, 200, '"fast"')]
+    tracker = warm_tracker(0.5)
+
+    r = resilience.hedged_call(lambda: requests.get(server.url, timeout=5), tracker, is_success=lambda r: r.ok)
+
+    assert r.json() == "fast"
+    assert server.n_requests == 1
+
+
+def test_first_successful_response_wins(server):
+    # the hedge fails fast, the original call succeeds later: the failure must not be returned
+    server.behaviors = [(0.5, 200, '"slow success"'), (0, 503, '"fast failure"')]
+    tracker = warm_tracker(0.05)
+
+    r = resilience.hedged_call(lambda: requests.get(server.url, timeout=5), tracker, is_success=lambda r: r.ok)
+
+    assert r.status_code == 200
+    assert r.json() == "slow success"
+    assert server.n_requests == 2
+
+
+def test_failed_result_returned_when_both_calls_fail(server):
+    server.behaviors = [(0.3, 500, '"first"'), (0, 503, '"second"')]
+    tracker = warm_tracker(0.05)
+
+    r = resilience.hedged_call(lambda: requests.get(server.url, timeout=5), tracker, is_success=lambda r: r.ok)
+
+    assert r.status_code in (500, 503)
+    assert server.n_requests == 2
+
+
+def test_breaker_closed_open_half_open_closed(server):
+    server.behaviors = [(0, 500, "{}"), (0, 502, "{}")]
+    breaker = resilience.CircuitBreaker(failures=2, reset_s=0.3)
+    assert breaker.state == breaker.CLOSED
+
+    assert call_with_breaker(breaker, server.url).status_code == 500
+    assert breaker.state == breaker.CLOSED
+    assert call_with_breaker(breaker, server.url).status_code == 502
+    assert breaker.state == breaker.OPEN
+
+    # open: calls are refused without reaching the server, and callers learn when to retry
+    assert call_with_breaker(breaker, server.url) is None
+    assert server.n_requests == 2
+    assert 0 < breaker.retry_in <= 0.3
+
+    time.sleep(0.35)
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.retry_in == 0
+    # a single trial call is let through
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert call_with_breaker(breaker, server.url).status_code == 200
+
+
+def test_failed_trial_opens_breaker_again(server):
+    server.behaviors = [(0, 500, "{}"), (0, 500, "{}")]
+    breaker = resilience.CircuitBreaker(failures=1, reset_s=0.2)
+
+    call_with_breaker(breaker, server.url)
+    assert breaker.state == breaker.OPEN
+    time.sleep(0.25)
+    assert breaker.state == breaker.HALF_OPEN
+    assert call_with_breaker(breaker, server.url).status_code == 500
+    assert breaker.state == breaker.OPEN
+    assert breaker.retry_in > 0
+
+
+def test_score_batch_opens_breaker_and_reports_retry_in(server):
+    import pandas as pd
+    import cpd_helpers
+
+    deployment_details = {
+        'metadata': {'id': f"test-deployment-{uuid.uuid4().hex}"},
+        'entity': {'status': {'serving_urls': [server.url]}},
+    }
+    df = pd.DataFrame({'x': [1.0, 2.0]})
+    server.default = (0, 503, '{"errors": [{"message": "unavailable"}]}')
+
+    for _ in range(resilience.BREAKER_FAILURES):
+        result, error_msg = cpd_helpers.score_batch(dict(), deployment_details, df)
+        assert result is None
+        assert "unavailable" in error_msg
+    assert server.n_requests == resilience.BREAKER_FAILURES
+
+    result, error_msg = cpd_helpers.score_batch(dict(), deployment_details, df)
+    assert result is None
+    assert "paused" in error_msg
+    assert server.n_requests == resilience.BREAKER_FAILURES  # refused without calling the deployment
+    assert resilience.get_breaker(deployment_details['metadata']['id']).retry_in > 0
+
+
+def test_score_batch_client_errors_do_not_open_breaker(server):
+    import pandas as pd
+    import cpd_helpers
+
+    deployment_details = {
+        'metadata': {'id': f"test-deployment-{uuid.uuid4().hex}"},
+        'entity': {'status': {'serving_urls': [server.url]}},
+    }
+    server.default = (0, 400, '{"errors": [{"message": "invalid payload"}]}')
+
+    for _ in range(resilience.BREAKER_FAILURES + 1):
+        result, error_msg = cpd_helpers.score_batch(dict(), deployment_details, pd.DataFrame({'x': [1.0]}))
+        assert "invalid payload" in error_msg
+    assert resilience.get_breaker(deployment_details['metadata']['id']).state == resilience.CircuitBreaker.CLOSED
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import scoring_helpers
+
+
+def decode_values(df):
+    payload = json.loads(scoring_helpers.encode_scoring_payload(df))
+    return payload['input_data'][0]['fields'], payload['input_data'][0]['values']
+
+
+@pytest.fixture(params=[True, False], ids=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(scoring_helpers, "orjson", None)
+
+
+def test_numeric_frame(encoder):
+    fields, values = decode_values(pd.DataFrame({'a': [1.5, np.nan], 'b': [2.0, 3.0]}))
+    assert fields == ['a', 'b']
+    assert values == [[1.5, 2.0], [None, 3.0]]
+
+
+def test_mixed_int_and_float_keeps_ints(encoder):
+    _, values = decode_values(pd.DataFrame({'n': [1, 2], 'x': [0.5, np.nan]}))
+    assert values == [[1, 0.5], [2, None]]
+    assert isinstance(values[0][0], int)
+
+
+def test_mixed_bool_and_numbers(encoder):
+    _, values = decode_values(pd.DataFrame({'flag': [True, False], 'n': [1, 2], 'x': [0.5, 1.5]}))
+    assert values == [[True, 1, 0.5], [False, 2, 1.5]]
+
+
+def test_nullable_and_object_columns(encoder):
+    _, values = decode_values(pd.DataFrame({'n': pd.array([1, None], dtype="Int64"), 's': ['a', None]}))
+    assert values == [[1, 'a'], [None, None]]
+
+
+def test_json_default_handles_object_arrays():
+    assert scoring_helpers._json_default(np.array([1, pd.NA, 'a'], dtype=object)) == [1, pd.NA, 'a']
+    assert scoring_helpers._json_default(pd.NA) is None
+    assert scoring_helpers._json_default(pd.Timestamp('2021-01-01')) == '2021-01-01 00:00:00'
+
+
+def test_scored_class_from_predicted_classes():
+    # the model's probabilities are those of class 0, the first class in sorted order
+    predicted, scores = np.array([0, 0, 1]), np.array([0.9, 0.7, 0.2])
+    votes = scoring_helpers.class_votes(predicted, scores, [0, 1])
+    assert votes == {0: 2, 1: -1}
+    assert scoring_helpers.scored_class(votes) == 0
+
+
+def test_scored_class_matches_labels_of_other_types():
+    votes = scoring_helpers.class_votes(np.array(["1.0", "0.0"]), np.array([0.8, 0.3]), [0, 1])
+    assert scoring_helpers.scored_class(votes) == 1
+    # no row predicted as the scored class: the other class gets votes against it
+    votes = scoring_helpers.class_votes(np.array(["Good", "Good"]), np.array([0.1, 0.4]), ["Bad", "Good"])
+    assert scoring_helpers.scored_class(votes) == "Bad"
+
+
+def test_scored_class_unknown_on_tie():
+    votes = scoring_helpers.class_votes(np.array(["yes", "no"]), np.array([0.8, 0.3]), [0, 1])
+    assert scoring_helpers.scored_class(votes) is None
@@ -1,5 +1,10 @@
+import io
+
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+import matplotlib.pyplot as plt
 
 def format_tuples(t):
     """A helper function to format tuples in dropdowns.
@@ -13,7 +18,128 @@ def format_tuples(t):
         return str(t)
 
 
-def make_basic_roc_curve(fpr, tpr):
+def figure_to_png(fig):
+    """Renders a matplotlib figure to PNG bytes and closes it, so that the rendered
+    image can be cached and displayed with st.image without rendering it again.
+
+    Args:
+        fig (matplotlib figure): The figure to render.
+
+    Returns:
+        png (bytes): The figure rendered as a PNG image.
+    """
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=200)
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def make_sweep_plot(feature, values, result):
+    """Plots the predictions of a model against the values taken by a single feature,
+    with one line per class probability (or the predicted value for regression models).
+
+    Args:
+        feature (str): Name of the feature that varies.
+        values (array-like): The values taken by that feature.
+        result (ScoringResult): Predictions for each of these values, see scoring_helpers.decode_predictions().
+
+    Returns:
+        fig (plotly figure): A line plot of predictions against feature values.
+    """
+    if result.probabilities is None:
+        df_sweep = pd.DataFrame({"Prediction": result.scores}, index=values)
+    else:
+        df_sweep = pd.DataFrame(result.probabilities, index=values,
+                                columns=[f"Probability of class #{i}" for i in range(result.probabilities.shape[1])])
+    df_sweep.index.name = feature
+    df_sweep.columns.name = "Output"
+
+    fig = px.line(df_sweep, title=f'Predictions as {feature} varies', width=700, height=500)
+    fig.update_yaxes(title="Prediction")
+    return fig
+
+
+def make_pdp_ice_plot(feature, grid, ice, pd_curve, max_ice_lines=100):
+    """Plots Individual Conditional Expectation (ICE) curves, one thin line per sampled row,
+    together with the Partial Dependence (PD) curve, their average.
+
+    Args:
+        feature (str): Name of the feature the curves were computed for.
+        grid (array-like): The values taken by that feature.
+        ice (np.ndarray): (n_rows, len(grid)) array of scores.
+        pd_curve (np.ndarray): The average of ice for each grid value.
+        max_ice_lines (int): Maximum number of ICE curves drawn, to keep the plot light. Defaults to 100.
+
+    Returns:
+        fig (plotly figure): ICE and PD curves plotted against the feature values.
+    """
+    fig = go.Figure()
+    for i, curve in enumerate(ice[:max_ice_lines]):
+        fig.add_trace(go.Scatter(x=grid, y=curve, mode='lines', line=dict(color='lightgrey', width=1),
+                                 name='ICE', legendgroup='ICE', showlegend=(i == 0), hoverinfo='skip'))
+    fig.add_trace(go.Scatter(x=grid, y=pd_curve, mode='lines+markers', line=dict(width=4), name='Partial Dependence'))
+    fig.update_layout(title=f'Partial Dependence and ICE curves for {feature}',
+                      xaxis_title=feature, yaxis_title='Prediction', width=700, height=500)
+    return fig
+
+
+def compute_binary_curves(y_true, scores):
+    """Computes ROC and Precision-Recall curves of a binary classifier with a single sort,
+    i.e. in O(n log n), with one point per distinct score.
+
+    Args:
+        y_true (array-like): Boolean vector, True for rows of the positive class
+        scores (array-like): Vector of scores, higher meaning more likely positive
+
+    Returns:
+        curves (dict): Vectors fpr, tpr, thresholds (ROC curve, starting at (0, 0)) and precision, recall
+            (PR curve), as well as the roc_auc and average_precision scores.
+    """
+    y_true, scores = np.asarray(y_true, dtype=bool), np.asarray(scores, dtype=float)
+    order = np.argsort(-scores, kind='mergesort')
+    y_true, scores = y_true[order], scores[order]
+
+    # last position of each distinct score, i.e. where a threshold at that score stops
+    threshold_idx = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tps = np.cumsum(y_true)[threshold_idx]
+    fps = threshold_idx + 1 - tps
+    n_pos, n_neg = tps[-1], fps[-1]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tpr, fpr = np.r_[0, tps / n_pos], np.r_[0, fps / n_neg]
+        precision, recall = tps / (tps + fps), tps / n_pos
+    return dict(
+        fpr=fpr, tpr=tpr, thresholds=np.r_[max(1.0, scores[0]), scores[threshold_idx]],
+        precision=precision, recall=recall,
+        roc_auc=np.trapz(tpr, fpr),
+        average_precision=np.sum(np.diff(np.r_[0, recall]) * precision),
+    )
+
+
+def decimate_curve(x, y, max_points=500):
+    """Picks at most max_points points of a curve to plot, evenly spaced along its length (in L1 distance).
+    Between two consecutive points kept, the curve travels at most about length / (max_points - 1),
+    so it never deviates from the plotted line by more than that, e.g. 0.4% for an ROC curve and 500 points.
+
+    Args:
+        x (array-like): Vector of x coordinates, in curve order
+        y (array-like): Vector of y coordinates, in curve order
+        max_points (int): Maximum number of points to keep. Defaults to 500.
+
+    Returns:
+        idx (np.ndarray): Positions of the points to keep, including both ends of the curve.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if len(x) <= max_points:
+        return np.arange(len(x))
+    length = np.r_[0, np.cumsum(np.nan_to_num(np.abs(np.diff(x)) + np.abs(np.diff(y))))]
+    if length[-1] == 0:
+        return np.array([0, len(x) - 1])
+    segment = np.floor(length / length[-1] * (max_points - 2)).astype(int)
+    return np.unique(np.r_[0, np.flatnonzero(np.diff(segment)) + 1, len(x) - 1])
+
+
+def make_basic_roc_curve(fpr, tpr, auc=None):
     """Given fpr and tpr values for an ROC curve,
     generates an ROC curve with TPR against FPR in plotly express
     as commonly used.
@@ -21,13 +147,14 @@ def make_basic_roc_curve(fpr, tpr):
     Args:
         fpr (array-like): List or vector of False Positive Rates
         fpr (array-like): List or vector of True Positive Rates
+        auc (float): Area under the curve, shown in the title if provided.
 
     Returns:
         fig (plotly figure): An ROC curve plotted in plotly.
     """
     fig = px.area(
         x=fpr, y=tpr,
-        title=f'ROC Curve',
+        title='ROC Curve' if auc is None else f'ROC Curve (AUC={auc:.4f})',
         labels=dict(x='False Positive Rate', y='True Positive Rate'),
         width=700, height=500
     )
@@ -41,6 +168,30 @@ def make_basic_roc_curve(fpr, tpr):
     return fig
 
 
+def make_pr_curve(recall, precision, average_precision=None):
+    """Given recall and precision values for a Precision-Recall curve,
+    generates a PR curve with precision against recall in plotly express.
+
+    Args:
+        recall (array-like): List or vector of Recalls
+        precision (array-like): List or vector of Precisions
+        average_precision (float): Average precision, shown in the title if provided.
+
+    Returns:
+        fig (plotly figure): A PR curve plotted in plotly.
+    """
+    fig = px.area(
+        x=recall, y=precision,
+        title='Precision-Recall Curve' if average_precision is None
+        else f'Precision-Recall Curve (AP={average_precision:.4f})',
+        labels=dict(x='Recall', y='Precision'),
+        width=700, height=500
+    )
+    fig.update_yaxes(range=[0, 1], scaleanchor="x", scaleratio=1)
+    fig.update_xaxes(range=[0, 1], constrain='domain')
+    return fig
+
+
 def make_advanced_roc_curve(fpr, tpr, thresholds):
     """Given fpr and tpr values for an ROC curve, as well as thresholds used
     to calculate these rates, generates two line plots for FPR against threshold